@@ -3,89 +3,648 @@
 # The relative position of this file: /backend/accountServer/account_main.py
 import socket
 import threading
+import asyncio
+import queue
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
+from collections import OrderedDict, deque
 import json
 import time
 import os
-from urllib.parse import parse_qs, urlparse
+from http import HTTPStatus
 import sqlite3
 import random
 import string
-import hashlib
+import hmac
 import smtplib
 from email.mime.text import MIMEText
 from email.header import Header
 import configure
+import password_hasher
+import account_schema
+import avatar_store
+import database_online_backup
+from http_request import (
+    HttpRequestError, DropConnection, HttpRequestReader, Route, Router, Middleware, MiddlewarePipeline
+)
+from rate_limiter import SlidingWindowRateLimiter, SharedSlidingWindowRateLimiter, RouteRateLimiter
+from request_guard import IpBlacklist, RequestSignatureMatcher
+from metrics import MetricsRegistry, MetricsHttpServer
+from worker_supervisor import WorkerSupervisor
 import ssl
 import datetime
 import sys
+import zlib
+import multiprocessing
+import signal
+import argparse
+import importlib
 
-# 表结构（列名和顺序）v1.0.2
-EXPECTED_COLUMNS = [
-    'id',                   # 0
-    'anonymous_user',       # 1
-    'email',                # 2
-    'password',             # 3
-    'name',                 # 4
-    'qq',                   # 5
-    'theme_color',          # 6
-    'head_img',             # 7
-    'token',                # 8
-    'token_expiry',         # 9
-    'email_verified',       # 10
-    'verification_code',    # 11
-    'code_expiry',          # 12
-    'resetpwd_code',        # 13
-    'resetpwd_expiry',      # 14
-    'created_at',           # 15
-    'last_login'            # 16
-]
+# 共享模块位于 backend/shared
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.queue_logger import QueueLogger
+
+# users表的列名和顺序见 account_schema.EXPECTED_COLUMNS
 
 characters_     = string.digits + string.ascii_letters
 maxWriteLog_    = 500 # 记录每个响应内容在日志内的最大长度
+keep_alive_timeout_      = 15   # 长连接空闲超时秒数
+keep_alive_max_requests_ = 100  # 每个长连接最多处理的请求数
+
+def apply_module_settings():
+    """读取模块级配置（多进程模式下平滑重载配置后再次调用）"""
+    global keep_alive_timeout_, keep_alive_max_requests_
+    keep_alive_timeout_ = getattr(configure, '_keep_alive_timeout_', 15)
+    keep_alive_max_requests_ = getattr(configure, '_keep_alive_max_requests_', 100)
+
+apply_module_settings()
+
+def create_logger(name='account', tag=None):
+    """按配置创建日志记录器"""
+    return QueueLogger(
+        name,
+        directory=getattr(configure, '_log_dir_', 'logs'),
+        level=getattr(configure, '_log_level_', 'INFO'),
+        max_bytes=getattr(configure, '_log_max_bytes_', 10 * 1024 * 1024),
+        rotate_interval=getattr(configure, '_log_rotate_interval_', 86400),
+        backup_count=getattr(configure, '_log_backup_count_', 30),
+        queue_size=getattr(configure, '_log_queue_size_', 10000),
+        tag=tag
+    )
+
+# 日志写入 logs 目录 首次写日志时才启动后台线程和创建文件 避免进程池子进程导入本模块时创建空日志文件
+logger = create_logger()
+
+def log_message(message, level='INFO', **fields):
+    """记录日志信息到文件和控制台（放入日志队列，不阻塞）"""
+    logger.log(level, message, **fields)
+
+class HtmlTemplate:
+    """预先编码的HTML模板
+
+    模板使用 str.format 语法。创建时填入固定值，slots 中的变量位置留空，
+    其余部分一次性编码为字节；渲染时只编码变量，返回字节块列表。
+    """
+
+    MARK = '\x00'
+
+    def __init__(self, template, slots, **static_values):
+        values = dict(static_values)
+        for name in slots:
+            values[name] = f"{self.MARK}{name}{self.MARK}"
+        # 偶数位置为固定内容 奇数位置为变量名
+        parts = template.format(**values).split(self.MARK)
+        self.parts = [part.encode('utf-8') if index % 2 == 0 else part for index, part in enumerate(parts)]
+    
+    def render(self, **values):
+        """填入变量，返回字节块列表"""
+        chunks = []
+        for part in self.parts:
+            if isinstance(part, bytes):
+                if part:
+                    chunks.append(part)
+            else:
+                chunks.append(str(values[part]).encode('utf-8'))
+        return RenderedHtml(chunks, self, values)
+
+class RenderedHtml(list):
+    """HTML模板的渲染结果（字节块列表），保留模板和变量作为压缩缓存的键"""
+
+    def __init__(self, chunks, template, values):
+        super().__init__(chunks)
+        self.template = template
+        self.values = values
+
+class ResponseCompressor:
+    """根据 Accept-Encoding 压缩响应体（gzip 或 deflate）
+
+    小于 min_size 的响应体不压缩。HTML页面大多是固定内容，压缩结果按模板和变量缓存，
+    同样的页面只压缩一次。压缩窗口按响应体大小缩小，减少小响应的压缩器初始化开销。
+    压缩率和CPU耗时记录在指标中，用于调整阈值。
+    """
+
+    WBITS_OFFSET = {'gzip': 16, 'deflate': 0}   # deflate 按HTTP规范使用zlib格式
+    RATIO_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+    CPU_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01)
+
+    def __init__(self, metrics, enabled=True, min_size=512, level=6, page_cache_size=256):
+        self.enabled = enabled
+        self.min_size = min_size
+        self.level = level
+        self.negotiated = {}        # Accept-Encoding 头 -> 选择的编码（只缓存有限数量）
+        self.page_cache = OrderedDict()     # (编码, 模板, 变量) -> 压缩后的页面 按LRU淘汰
+        self.page_cache_size = page_cache_size
+        self.lock = threading.Lock()
+        self.compressed = metrics.counter(
+            'account_compressed_responses_total', '压缩后发送的响应数', ('encoding',))
+        self.skipped = metrics.counter(
+            'account_compression_skipped_total', '客户端支持压缩但响应体小于阈值未压缩的响应数')
+        self.input_bytes = metrics.counter('account_compression_input_bytes_total', '压缩前的响应体字节数')
+        self.output_bytes = metrics.counter('account_compression_output_bytes_total', '压缩后的响应体字节数')
+        self.ratio = metrics.histogram(
+            'account_compression_ratio', '压缩后与压缩前的大小之比', buckets=self.RATIO_BUCKETS)
+        self.cpu_seconds = metrics.histogram(
+            'account_compression_cpu_seconds', '压缩单个响应体的CPU耗时', buckets=self.CPU_BUCKETS)
+    
+    def negotiate(self, accept_encoding):
+        """根据 Accept-Encoding 头选择编码，不压缩时返回None"""
+        if not self.enabled or not accept_encoding:
+            return None
+        encoding = self.negotiated.get(accept_encoding, '')
+        if encoding != '':
+            return encoding
+        
+        qualities = {}
+        for item in accept_encoding.lower().split(','):
+            name, _, params = item.partition(';')
+            quality = 1.0
+            params = params.strip()
+            if params.startswith('q='):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            qualities[name.strip()] = quality
+        wildcard = qualities.get('*', 0.0)
+        encoding = None
+        best = 0.0
+        # 同等权重时优先使用gzip
+        for name in ('gzip', 'deflate'):
+            quality = qualities.get(name, wildcard)
+            if quality > best:
+                encoding, best = name, quality
+        
+        if len(self.negotiated) < 256:
+            self.negotiated[accept_encoding] = encoding
+        return encoding
+    
+    def compress(self, body_chunks, encoding):
+        """压缩响应体，返回 (字节块列表, 额外响应头)"""
+        size = sum(map(len, body_chunks))
+        if not self.enabled or size < self.min_size:
+            if encoding and size:
+                self.skipped.inc()
+            return body_chunks, []
+        if not encoding:
+            return body_chunks, ['Vary: Accept-Encoding']
+        
+        if isinstance(body_chunks, RenderedHtml):
+            data = self.compress_page(body_chunks, encoding, size)
+        else:
+            data = self.compress_chunks(body_chunks, encoding, size)
+        
+        self.compressed.inc((encoding,))
+        self.input_bytes.inc(amount=size)
+        self.output_bytes.inc(amount=len(data))
+        self.ratio.observe(len(data) / size)
+        return [data], [f'Content-Encoding: {encoding}', 'Vary: Accept-Encoding']
+    
+    def compress_chunks(self, body_chunks, encoding, size):
+        start = time.thread_time()
+        # 窗口不需要大于响应体
+        window_bits = max(10, min(15, (size - 1).bit_length()))
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, window_bits + self.WBITS_OFFSET[encoding])
+        data = b''.join([compressor.compress(chunk) for chunk in body_chunks]) + compressor.flush()
+        self.cpu_seconds.observe(time.thread_time() - start)
+        return data
+    
+    def compress_page(self, page, encoding, size):
+        """压缩HTML页面，相同模板和变量的页面直接使用缓存"""
+        key = (encoding, page.template, tuple(sorted(page.values.items())))
+        with self.lock:
+            data = self.page_cache.get(key)
+            if data is not None:
+                self.page_cache.move_to_end(key)
+                return data
+        data = self.compress_chunks(page, encoding, size)
+        with self.lock:
+            self.page_cache[key] = data
+            if len(self.page_cache) > self.page_cache_size:
+                self.page_cache.popitem(last=False)
+        return data
+
+class ResponseBuilder:
+    """HTTP响应构建器
+
+    状态行、Content-Type、Connection 和 CORS 等固定的响应头按组合缓存为字节串，
+    每次只生成 Content-Length、Set-Cookie 等可变部分。
+    返回字节块列表 [固定响应头, 可变响应头, 响应体...]，可以直接交给
+    socket.sendmsg 或 StreamWriter.writelines 发送，响应体不需要再拼接复制。
+    """
+
+    def __init__(self, allow_origin, keep_alive_timeout, keep_alive_max_requests):
+        self.connection_headers = {
+            True: f"Connection: keep-alive\r\nKeep-Alive: timeout={keep_alive_timeout}, max={keep_alive_max_requests}\r\n",
+            False: "Connection: close\r\n"
+        }
+        # 添加CORS头允许跨域访问api
+        self.cors_headers = (
+            f"Access-Control-Allow-Origin: {allow_origin}\r\n"
+            "Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n"
+            "Access-Control-Allow-Headers: Content-Type, Authorization\r\n"
+        )
+        self.prefixes = {}      # (状态码, Content-Type, 是否保持连接, 是否带CORS头) -> 固定响应头
+    
+    def prefix(self, status_code, content_type, keep_alive, cors):
+        """返回缓存的固定响应头"""
+        key = (status_code, content_type, keep_alive, cors)
+        prefix = self.prefixes.get(key)
+        if prefix is None:
+            try:
+                status_text = HTTPStatus(status_code).phrase
+            except ValueError:
+                status_text = 'Unknown'
+            prefix = (
+                f"HTTP/1.1 {status_code} {status_text}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                + self.connection_headers[bool(keep_alive)]
+                + (self.cors_headers if cors else '')
+            ).encode('utf-8')
+            self.prefixes[key] = prefix
+        return prefix
+    
+    def build(self, status_code, body_chunks, content_type='application/json', keep_alive=False,
+              cookies=None, headers=None, cors=True):
+        """生成完整响应的字节块列表，总是包含 Content-Length"""
+        variable = f"Content-Length: {sum(map(len, body_chunks))}\r\n"
+        if cookies:
+            for cookie in cookies:
+                variable += f"Set-Cookie: {cookie}\r\n"
+        if headers:
+            for header in headers:
+                variable += f"{header}\r\n"
+        variable += "\r\n"
+        return [self.prefix(status_code, content_type, keep_alive, cors), variable.encode('utf-8'), *body_chunks]
+    
+    @staticmethod
+    def status_code(response):
+        """响应的状态码字符串"""
+        return response[0][9:12].decode('latin-1')
+    
+    @staticmethod
+    def status_line(response):
+        return response[0].split(b'\r\n', 1)[0].decode('latin-1')
+    
+    @staticmethod
+    def body(response):
+        """响应体的字节块列表"""
+        return response[2:]
+
+# 激活返回页面 ViewAccountActivationRespone.html
+ACTIVATION_PAGE_TEMPLATE = """<html><head><meta charset="UTF-8"><title>{title}</title><style>body{{background:linear-gradient(135deg,#667eea,#764ba2);margin:0;padding:20px;min-height:100vh;display:flex;align-items:center;justify-content:center}} .c{{background:white;padding:30px;border-radius:10px;box-shadow:0 10px 30px rgba(0,0,0,0.2);text-align:center;width:100%}} .m{{background:{bg_color};border:1px solid {border_color};padding:15px;border-radius:5px;margin:20px 0;color:#155724;font-size:24px}} .i{{font-size:48px;margin-bottom:20px}}</style></head><body><div class="c"><div class="i">{icon}</div><h1>{title}</h1><div class="m">{message}</div></div></body></html>"""
 
-# 创建日志文件
-current_time = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
-log_filename = f"{current_time}-log.log"
-log_file = open(log_filename, 'w', encoding='utf-8')
+# 密码重置返回页面 ViewPasswordResetRespone.html
+RESETPWD_PAGE_TEMPLATE = """<html><head><meta charset="UTF-8"><title>{title}</title><style>body{{background:linear-gradient(135deg,#667eea,#764ba2);margin:0;padding:20px;min-height:100vh;display:flex;align-items:center;justify-content:center}} .c{{background:white;padding:30px;border-radius:10px;box-shadow:0 10px 30px rgba(0,0,0,0.2);text-align:center;width:100%;max-width:600px}} .m{{background:{bg_color};border:1px solid {border_color};padding:15px;border-radius:5px;margin:20px 0;color:#155724;font-size:18px;text-align:left}} .i{{font-size:48px;margin-bottom:20px}} .w{{color:#856404;background-color:#fff3cd;border:1px solid #ffeaa7;padding:10px;border-radius:5px;margin:15px 0;font-size:16px}} .btn{{display:inline-block;background:#4CAF50;color:#fff;padding:12px 24px;text-decoration:none;border-radius:5px;margin:15px 0;border:none;cursor:pointer;font-size:16px}} .btn:hover{{background:#45a049}} input{{width:100%;padding:10px;margin:10px 0;border:1px solid #ddd;border-radius:5px;box-sizing:border-box}}</style></head><body><div class="c"><div class="i">{icon}</div><h1>{title}</h1><div class="m">{message}</div></div></body></html>"""
 
-def log_message(message):
-    """记录日志信息到文件和控制台"""
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    formatted_message = f"[{timestamp}] {message}"
-    print(formatted_message)
-    log_file.write(formatted_message + '\n')
-    log_file.flush()
+def build_page_templates(template):
+    """按成功/失败两种样式预先编码页面模板"""
+    return {
+        True: HtmlTemplate(template, ('title', 'message'), icon="✅", bg_color="#d4edda", border_color="#c3e6cb"),
+        False: HtmlTemplate(template, ('title', 'message'), icon="❌", bg_color="#f8d7da", border_color="#f5c6cb")
+    }
 
 class DatabaseManager:
-    """数据库管理类"""
+    """数据库管理类
 
-    def __init__(self):
-        self.db_path = 'users_sqlite_3_py.db'
+    维护一个有上限的连接池，连接以WAL模式打开并复用预编译语句缓存。
+    通过 connection() 或 transaction() 可以让同一线程内的多条语句使用同一个连接。
+    每个线程累计自己的数据库耗时（事务按整体计时），用于区分请求中的数据库时间和处理时间。
+    """
+
+    def __init__(self, db_path='users_sqlite_3_py.db'):
+        self.db_path = db_path
+        self.pool_size = getattr(configure, '_db_pool_size_', 16)
+        self.statement_cache_size = getattr(configure, '_db_statement_cache_', 128)
+        self.busy_timeout = getattr(configure, '_db_busy_timeout_', 5.0)
+        self.pool = queue.LifoQueue()       # 空闲连接 后进先出以保持热连接
+        self.created = 0                    # 已创建的连接数
+        self.lock = threading.Lock()
+        self.local = threading.local()      # 当前线程占用的连接及嵌套深度
+    
+    def create_connection(self):
+        """创建新连接并设置pragma"""
+        # isolation_level=None 时每条语句自动提交 事务由 transaction() 显式控制
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size
+        )
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')    # WAL模式下NORMAL即可保证一致性
+        conn.execute('PRAGMA cache_size = -8192')       # 8MB页缓存
+        conn.execute('PRAGMA mmap_size = 67108864')     # 64MB内存映射
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+    
+    def acquire(self):
+        """从连接池取出一个连接，池空且未达上限时创建新连接"""
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self.lock:
+            if self.created < self.pool_size:
+                self.created += 1
+                create = True
+            else:
+                create = False
+        
+        if create:
+            try:
+                return self.create_connection()
+            except Exception:
+                with self.lock:
+                    self.created -= 1
+                raise
+        return self.pool.get(timeout=self.busy_timeout)
+    
+    def release(self, conn):
+        """归还连接到连接池"""
+        if conn.in_transaction:
+            conn.rollback()
+        self.pool.put(conn)
     
     def get_connection(self):
-        """获取数据库连接"""
-        return sqlite3.connect(self.db_path)
+        """获取当前线程占用的连接，没有则返回None"""
+        return getattr(self.local, 'conn', None)
     
-    def execute_query(self, query, params=None):
-        """执行查询并返回结果"""
+    @contextmanager
+    def connection(self):
+        """在上下文内让当前线程的所有查询使用同一个连接"""
         conn = self.get_connection()
+        if conn is not None:
+            # 嵌套使用 直接复用外层连接
+            yield conn
+            return
+        
+        conn = self.acquire()
+        self.local.conn = conn
         try:
-            cursor = conn.cursor()
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
+            yield conn
+        finally:
+            self.local.conn = None
+            self.release(conn)
+    
+    @contextmanager
+    def transaction(self, immediate=True):
+        """在同一连接上执行显式事务，异常时回滚"""
+        with self.connection() as conn:
+            if conn.in_transaction:
+                # 已处于外层事务中
+                yield conn
+                return
             
-            if query.strip().upper().startswith('SELECT'):
-                return cursor.fetchall()
+            start = time.perf_counter()
+            conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
             else:
                 conn.commit()
-                return cursor.lastrowid
-        finally:
+            finally:
+                self.add_time(time.perf_counter() - start)
+    
+    def add_time(self, seconds):
+        self.local.db_time = getattr(self.local, 'db_time', 0.0) + seconds
+    
+    def reset_time(self):
+        """清零当前线程累计的数据库耗时"""
+        self.local.db_time = 0.0
+    
+    def elapsed_time(self):
+        """当前线程自上次清零以来的数据库耗时（秒）"""
+        return getattr(self.local, 'db_time', 0.0)
+    
+    def execute_query(self, query, params=None):
+        """执行查询并返回结果"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            # 事务中的语句由 transaction() 统一计时
+            start = None if conn.in_transaction else time.perf_counter()
+            try:
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+                
+                if query.strip().upper().startswith('SELECT'):
+                    return cursor.fetchall()
+                else:
+                    return cursor.lastrowid
+            finally:
+                cursor.close()
+                if start is not None:
+                    self.add_time(time.perf_counter() - start)
+    
+    def close_all(self):
+        """关闭连接池中的所有连接"""
+        while True:
+            try:
+                conn = self.pool.get_nowait()
+            except queue.Empty:
+                break
             conn.close()
+            with self.lock:
+                self.created -= 1
+
+class TokenSessionCache:
+    """已验证的 (user_id, token) 会话缓存
+
+    按LRU淘汰，每个条目在TTL和token_expiry中较早的时间点失效。
+    token被轮换或清除时需要调用 invalidate_user 使该用户的所有条目失效。
+    多进程模式下失效时间同时写入共享表，其他工作进程在命中缓存时检查该时间。
+    """
+
+    def __init__(self, max_size=10000, ttl=60, shared_state=None):
+        self.shared_state = shared_state
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()    # (user_id, token) -> (失效时间, 用户数据行, 写入时间)
+        self.user_keys = {}             # user_id -> 该用户的缓存键集合
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def get(self, user_id, token):
+        """查询缓存，未命中或已过期时返回None"""
+        key = (str(user_id), token)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= now or self.invalidated_elsewhere(key, entry[2]):
+                self.remove_key(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def invalidated_elsewhere(self, key, cached_at):
+        """该条目写入后是否被其他工作进程标记为失效"""
+        if self.shared_state is None:
+            return False
+        invalidated = self.shared_state.get(key[0], 'session')
+        return invalidated is not None and invalidated[1] >= cached_at
+    
+    def put(self, user_id, token, row, token_expiry=None):
+        """写入已验证的会话"""
+        key = (str(user_id), token)
+        now = time.time()
+        expires_at = now + self.ttl
+        if token_expiry:
+            expires_at = min(expires_at, token_expiry)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.entries[key] = (expires_at, row, now)
+            self.user_keys.setdefault(key[0], set()).add(key)
+            while len(self.entries) > self.max_size:
+                oldest = next(iter(self.entries))
+                self.remove_key(oldest)
+                self.evictions += 1
+    
+    def invalidate_user(self, user_id):
+        """使某个用户的所有缓存会话失效"""
+        if self.shared_state is not None:
+            now = time.time()
+            self.shared_state.set(str(user_id), 'session', now + self.ttl, now)
+        with self.lock:
+            keys = self.user_keys.pop(str(user_id), None)
+            if not keys:
+                return
+            for key in keys:
+                self.entries.pop(key, None)
+            self.invalidations += len(keys)
+    
+    def remove_key(self, key):
+        """删除单个条目（调用方需持有锁）"""
+        self.entries.pop(key, None)
+        keys = self.user_keys.get(key[0])
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del self.user_keys[key[0]]
+    
+    def stats(self):
+        """返回缓存命中统计"""
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+class PasswordHashBusy(Exception):
+    """密码哈希进程池排队已满"""
+
+class TlsHandshakeStats:
+    """TLS握手统计：握手次数、失败次数、会话复用率和耗时分位数"""
+
+    def __init__(self, sample_size=1024):
+        self.lock = threading.Lock()
+        self.started = 0
+        self.completed = 0
+        self.resumed = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.total_time = 0.0
+        self.samples = deque(maxlen=sample_size)    # 最近的握手耗时 用于计算分位数
+    
+    def record_start(self):
+        with self.lock:
+            self.started += 1
+    
+    def record(self, seconds, resumed):
+        """记录一次完成的握手"""
+        with self.lock:
+            self.completed += 1
+            if resumed:
+                self.resumed += 1
+            self.total_time += seconds
+            self.samples.append(seconds)
+    
+    def record_failure(self, timeout=False):
+        """记录一次失败的握手"""
+        with self.lock:
+            self.failures += 1
+            if timeout:
+                self.timeouts += 1
+    
+    def stats(self):
+        """返回统计信息 耗时单位为毫秒"""
+        with self.lock:
+            samples = sorted(self.samples)
+            completed = self.completed
+            result = {
+                'started': self.started,
+                'completed': completed,
+                'failures': self.failures,
+                'timeouts': self.timeouts,
+                'resumed': self.resumed,
+                'resumption_rate': round(self.resumed / completed, 4) if completed else 0.0,
+                'avg_ms': round(self.total_time / completed * 1000, 2) if completed else 0.0
+            }
+        for name, q in (('p50_ms', 0.5), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+            result[name] = round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000, 2) if samples else 0.0
+        return result
+
+class TlsTimingStreamProtocol(asyncio.StreamReaderProtocol):
+    """记录TLS握手耗时的流协议（事件循环模式）
+
+    协议对象在TCP连接建立时创建，而connection_made在TLS握手完成后才被调用，
+    两者的时间差即为握手耗时。握手失败或超时的连接不会调用connection_made，
+    因此事件循环模式下失败数为 started - completed（包含正在握手的连接）。
+    """
+
+    def __init__(self, stream_reader, client_connected_cb, tls_stats, loop=None):
+        super().__init__(stream_reader, client_connected_cb, loop=loop)
+        self.tls_stats = tls_stats
+        self.created_at = time.perf_counter()
+        tls_stats.record_start()
+    
+    def connection_made(self, transport):
+        ssl_object = transport.get_extra_info('ssl_object')
+        if ssl_object is not None:
+            self.tls_stats.record(time.perf_counter() - self.created_at, ssl_object.session_reused)
+        super().connection_made(transport)
 
 class SecurityUtils:
-    """安全工具类"""
+    """安全工具类
+
+    密码哈希使用可配置的 scrypt/PBKDF2 算法，计算在进程池中进行，
+    不占用请求处理线程的GIL。进程池的排队数量有上限，超出时抛出 PasswordHashBusy。
+    """
+    
+    def __init__(self):
+        self.algorithm = getattr(configure, '_password_hasher_', 'scrypt')
+        if self.algorithm == 'scrypt':
+            self.params = {
+                'n': getattr(configure, '_scrypt_n_', 16384),
+                'r': getattr(configure, '_scrypt_r_', 8),
+                'p': getattr(configure, '_scrypt_p_', 1)
+            }
+        else:
+            self.params = {'iterations': getattr(configure, '_pbkdf2_iterations_', 600000)}
+        self.workers = getattr(configure, '_hash_workers_', None) or os.cpu_count() or 1
+        self.max_queue = getattr(configure, '_hash_max_queue_', 64)
+        self.wait_timeout = getattr(configure, '_hash_wait_timeout_', 10)
+        self.slots = threading.BoundedSemaphore(self.workers + self.max_queue)
+        self.executor = None
+        self.lock = threading.Lock()
     
     @staticmethod
     def generate_random_code(length=18):
@@ -97,209 +656,603 @@ class SecurityUtils:
         """生成token（数字+字母）"""
         return ''.join(random.choice(characters_) for _ in range(length))
     
-    @staticmethod
-    def hash_password(password):
+    def start(self):
+        """启动进程池并预热所有子进程"""
+        with self.lock:
+            if self.executor is None:
+                # 支持时使用 forkserver 启动子进程 子进程不会继承监听socket和数据库连接等文件描述符
+                mp_context = None
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    mp_context = multiprocessing.get_context('forkserver')
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=mp_context,
+                    initializer=password_hasher.init_worker,
+                    initargs=(os.getpid(),)
+                )
+        futures = [self.executor.submit(password_hasher.warm_up) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+    
+    def close(self):
+        """关闭进程池"""
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+                self.executor = None
+    
+    def run_in_pool(self, fn, *args):
+        """在进程池中执行哈希计算，排队已满时抛出 PasswordHashBusy"""
+        if not self.slots.acquire(timeout=self.wait_timeout):
+            raise PasswordHashBusy("密码哈希队列已满")
+        try:
+            if self.executor is None:
+                self.start()
+            return self.executor.submit(fn, *args).result()
+        finally:
+            self.slots.release()
+    
+    def hash_password(self, password):
         """密码哈希处理"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        return self.run_in_pool(password_hasher.hash_password, password, self.algorithm, self.params)
     
-    @staticmethod
-    def verify_password(real_password, hashed_password):
+    def verify_password(self, real_password, hashed_password):
         """验证密码"""
-        return SecurityUtils.hash_password(real_password) == hashed_password
+        return self.run_in_pool(password_hasher.verify_password, real_password, hashed_password)
+    
+    def needs_rehash(self, hashed_password):
+        """密码哈希是否需要按当前配置重新计算（旧版SHA-256或参数已变化）"""
+        return password_hasher.needs_rehash(hashed_password, self.algorithm, self.params)
 
 class EmailUtils:
     """邮件工具类"""
     
     @staticmethod
-    def send_verification_email(email, name, verification_code, user_id):
-        """发送验证邮件"""
-        # 邮件配置 
-        smtp_server = configure._smtp_server_
-        smtp_port = configure._smtp_port_
-        sender_email = configure._sender_email_
-        sender_password = configure._sender_password_
-
+    def build_verification_email(name, verification_code, user_id):
+        """生成账号激活邮件的主题和内容"""
         # 激活链接 
         activation_link = f"{configure._server_url_}/activate?code={verification_code}&user_id={user_id}"
         subject = "ATSW账户激活"
         # HTML邮件内容 WebsiteAccountActivation.html
         body = f"""<html><head><meta charset="UTF-8"><style>body{{color:#333;margin:0;padding:20px}} .h{{background:linear-gradient(135deg,#667eea,#764ba2);color:#fff;padding:20px;text-align:center;border-radius:8px 8px 0 0}} .b{{display:inline-block;background:#4CAF50;color:#fff;padding:12px 24px;text-decoration:none;border-radius:5px;margin:15px 0}} .f{{border-top:1px solid #ddd;color:#666;font-size:18px}}</style></head><body><div class="h"><h2>🎉 欢迎加入 ATSW！</h2></div><div><p>亲爱的 <strong>{name}</strong>，</p><p>感谢您注册我们的网站！请点击下方按钮激活您的账户：</p><div style="text-align:left"><a href="{activation_link}" class="b">🚀 立即激活账户</a></div><p>或者复制以下链接到浏览器中打开：</p><p style="word-break:break-all;background:#eee;padding:10px;border-radius:4px;font-size:12px">{activation_link}</p><p><strong>⚠️ 重要提示：</strong>此链接在 <strong>5分钟</strong> 内有效。</p><p>如果您没有注册此账户，请忽略此邮件。</p></div><div class="f"><p>谢谢！<br>ATSW网站团队</p></div></body></html>"""
-        try:
-            # 创建HTML邮件
-            msg = MIMEText(body, 'html', 'utf-8')
-            msg['Subject'] = Header(subject, 'utf-8')
-            msg['From'] = sender_email
-            msg['To'] = email
-            
-            # 发送邮件
-            server = smtplib.SMTP_SSL(host=smtp_server, port=smtp_port, timeout=5)
-            server.login(sender_email, sender_password)
-            server.sendmail(sender_email, [email], msg.as_string())
-            server.quit()
-            
-            log_message(f"账号激活邮件发送成功: {email}")
-            return True
-        except Exception as e:
-            log_message(f"发送账号激活邮件失败: {email}, 错误: {e}")
-            return False
+        return subject, body
     
     @staticmethod
-    def send_reset_password_email(email, name, resetpwd_code, user_id):
-        """发送密码重置邮件"""
-        # 邮件配置 
-        smtp_server = configure._smtp_server_
-        smtp_port = configure._smtp_port_
-        sender_email = configure._sender_email_
-        sender_password = configure._sender_password_
-
+    def build_reset_password_email(name, resetpwd_code, user_id):
+        """生成密码重置邮件的主题和内容"""
         # 重置密码链接
         reset_link = f"{configure._server_url_}/resetpwdrun?user_id={user_id}&resetpwd_code={resetpwd_code}"
         subject = "ATSW密码重置"
         # 重置密码验证邮件内容 ViewPasswordResetVerify.html
         body = f"""<html><head><meta charset="UTF-8"><style>body{{color:#333;margin:0;padding:20px}} .h{{background:linear-gradient(135deg,#667eea,#764ba2);color:#fff;padding:20px;text-align:center;border-radius:8px 8px 0 0}} .b{{display:inline-block;background:#4CAF50;color:#fff;padding:12px 24px;text-decoration:none;border-radius:5px;margin:15px 0}} .f{{border-top:1px solid #ddd;color:#666;font-size:18px}}</style></head><body><div class="h"><h2>🔐 ATSW密码重置</h2></div><div><p>亲爱的 <strong>{name}</strong>，</p><p>我们收到了您重置密码的请求。请点击下方按钮重置您的密码：</p><div style="text-align:left"><a href="{reset_link}" class="b">🔑 立即重置密码</a></div><p>或者复制以下链接到浏览器中打开：</p><p style="word-break:break-all;background:#eee;padding:10px;border-radius:4px;font-size:12px">{reset_link}</p><p><strong>⚠️ 重要提示：</strong>此链接在 <strong>5分钟</strong> 内有效。</p><p>如果您没有请求重置密码，请忽略此邮件。</p></div><div class="f"><p>谢谢！<br>ATSW网站团队</p></div></body></html>"""
+        return subject, body
+    
+    @staticmethod
+    def create_message(email, subject, body):
+        """创建HTML邮件"""
+        msg = MIMEText(body, 'html', 'utf-8')
+        msg['Subject'] = Header(subject, 'utf-8')
+        msg['From'] = configure._sender_email_
+        msg['To'] = email
+        return msg
+    
+    @staticmethod
+    def connect_smtp():
+        """建立并登录SMTP连接"""
+        smtp_server = configure._smtp_server_
+        smtp_port = configure._smtp_port_
+        timeout = getattr(configure, '_smtp_timeout_', 10)
+        
+        if getattr(configure, '_smtp_use_ssl_', True):
+            server = smtplib.SMTP_SSL(host=smtp_server, port=smtp_port, timeout=timeout)
+        else:
+            server = smtplib.SMTP(host=smtp_server, port=smtp_port, timeout=timeout)
+            if getattr(configure, '_smtp_starttls_', False):
+                server.starttls()
+        
+        # 本地测试用的SMTP服务可以不配置密码
+        if configure._sender_password_:
+            server.login(configure._sender_email_, configure._sender_password_)
+        return server
+
+class ExpirySweeper:
+    """过期数据清理线程
+
+    定期清除已过期的激活码、重置码和token，并删除长时间未激活的账户。
+    每批只处理少量行（通过带LIMIT的子查询按索引选取），批次之间短暂停顿，
+    不会长时间占用数据库写锁。多进程模式下只在一个工作进程中运行。
+    """
+
+    def __init__(self, db, metrics):
+        self.db = db
+        self.interval = getattr(configure, '_sweep_interval_', 300)
+        self.batch_size = getattr(configure, '_sweep_batch_size_', 200)
+        self.batch_pause = getattr(configure, '_sweep_batch_pause_', 0.05)
+        self.inactive_ttl = getattr(configure, '_inactive_account_ttl_', 0)    # 注册多久后删除仍未激活的账户 0表示不删除（默认）
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.swept = metrics.counter('account_swept_rows_total', '过期数据清理的行数', ('kind',))
+        self.sweep_seconds = metrics.gauge('account_sweep_duration_seconds', '最近一次过期数据清理的耗时')
+        self.last_sweep = metrics.gauge('account_sweep_last_timestamp_seconds', '最近一次过期数据清理完成的时间')
+    
+    def sweeps(self, now):
+        """返回 (名称, SQL, 参数) 列表，SQL 中的子查询选取一批需要处理的行"""
+        sweeps = [
+            ('verification_code', '''
+                UPDATE users SET verification_code = NULL, code_expiry = NULL
+                WHERE id IN (SELECT id FROM users WHERE verification_code IS NOT NULL AND code_expiry < ? LIMIT ?)
+            ''', (now,)),
+            ('resetpwd_code', '''
+                UPDATE users SET resetpwd_code = NULL, resetpwd_expiry = NULL
+                WHERE id IN (SELECT id FROM users WHERE resetpwd_code IS NOT NULL AND resetpwd_expiry < ? LIMIT ?)
+            ''', (now,)),
+            ('token', '''
+                UPDATE users SET token = NULL, token_expiry = NULL
+                WHERE id IN (SELECT id FROM users WHERE token IS NOT NULL AND token_expiry < ? LIMIT ?)
+            ''', (now,))
+        ]
+        if self.inactive_ttl:
+            sweeps.append(('inactive_account', '''
+                DELETE FROM users
+                WHERE id IN (SELECT id FROM users WHERE email_verified = 0 AND created_at < ? LIMIT ?)
+            ''', (now - self.inactive_ttl,)))
+        return sweeps
+    
+    def sweep(self):
+        """执行一轮清理，返回 {名称: 行数}"""
+        start = time.perf_counter()
+        counts = {}
+        for name, sql, params in self.sweeps(int(time.time())):
+            total = 0
+            while not self.stop_event.is_set():
+                with self.db.connection() as conn:
+                    count = conn.execute(sql, params + (self.batch_size,)).rowcount
+                total += count
+                if count < self.batch_size:
+                    break
+                self.stop_event.wait(self.batch_pause)
+            if total:
+                self.swept.inc((name,), total)
+            counts[name] = total
+        self.sweep_seconds.set(time.perf_counter() - start)
+        self.last_sweep.set(int(time.time()))
+        return counts
+    
+    def start(self):
+        """启动后台清理线程"""
+        if not self.interval or (self.thread and self.thread.is_alive()):
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='expiry-sweeper', daemon=True)
+        self.thread.start()
+    
+    def stop(self, timeout=5):
+        """停止后台清理线程"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+    
+    def run(self):
+        """后台清理循环"""
+        while not self.stop_event.wait(self.interval):
+            try:
+                counts = self.sweep()
+                if any(counts.values()):
+                    log_message(f"过期数据清理: {counts}")
+            except Exception as e:
+                log_message(f"过期数据清理出错: {e}", level='ERROR')
+
+class DatabaseBackupJob:
+    """定时在线备份线程
+
+    使用 SQLite 在线备份接口分批复制数据库页（见 database_online_backup.py），
+    备份期间请求处理线程仍可正常读写。多进程模式下只在一个工作进程中运行。
+    """
+
+    def __init__(self, db, metrics):
+        self.db = db
+        self.interval = getattr(configure, '_backup_interval_', 0)
+        self.backup_dir = getattr(configure, '_backup_dir_', 'database_backup')
+        self.keep = getattr(configure, '_backup_keep_', 7)
+        self.compress = getattr(configure, '_backup_compress_', True)
+        self.pages = getattr(configure, '_backup_pages_', database_online_backup.DEFAULT_PAGES)
+        self.sleep = getattr(configure, '_backup_sleep_', database_online_backup.DEFAULT_SLEEP)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.backups = metrics.counter('account_backups_total', '定时备份的次数', ('result',))
+        self.backup_seconds = metrics.gauge('account_backup_duration_seconds', '最近一次备份的耗时')
+        self.backup_bytes = metrics.gauge('account_backup_size_bytes', '最近一次备份文件的字节数')
+        self.last_backup = metrics.gauge('account_backup_last_success_timestamp_seconds', '最近一次备份成功的时间')
+    
+    def backup(self):
+        """执行一次备份，返回备份文件路径"""
+        start = time.perf_counter()
         try:
-            # 创建HTML邮件
-            msg = MIMEText(body, 'html', 'utf-8')
-            msg['Subject'] = Header(subject, 'utf-8')
-            msg['From'] = sender_email
-            msg['To'] = email
-            
-            # 发送邮件
-            server = smtplib.SMTP_SSL(host=smtp_server, port=smtp_port, timeout=5)
-            server.login(sender_email, sender_password)
-            server.sendmail(sender_email, [email], msg.as_string())
-            server.quit()
-            
-            log_message(f"密码重置邮件发送成功: {email}")
-            return True
-        except Exception as e:
-            log_message(f"发送密码重置邮件失败: {email}, 错误: {e}")
-            return False
+            path = database_online_backup.backup_database(
+                self.db.db_path, self.backup_dir, pages=self.pages, sleep=self.sleep,
+                compress=self.compress, keep=self.keep, stop_event=self.stop_event
+            )
+        except Exception:
+            self.backups.inc(('error',))
+            raise
+        self.backups.inc(('ok',))
+        self.backup_seconds.set(time.perf_counter() - start)
+        self.backup_bytes.set(os.path.getsize(path))
+        self.last_backup.set(int(time.time()))
+        return path
+    
+    def start(self):
+        """启动后台备份线程"""
+        if not self.interval or (self.thread and self.thread.is_alive()):
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='database-backup', daemon=True)
+        self.thread.start()
+    
+    def stop(self, timeout=5):
+        """停止后台备份线程（正在进行的备份会在两批之间中止）"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+    
+    def run(self):
+        """后台备份循环"""
+        while not self.stop_event.wait(self.interval):
+            try:
+                path = self.backup()
+                log_message(f"数据库备份完成: {path}")
+            except Exception as e:
+                if not self.stop_event.is_set():
+                    log_message(f"数据库备份出错: {e}", level='ERROR')
+
+class EmailOutbox:
+    """持久化的邮件发件箱
+
+    请求处理线程只把邮件写入 email_outbox 表后立即返回，
+    后台线程批量取出到期的邮件，复用已登录的SMTP连接发送，失败时按指数退避重试。
+    取出的邮件会被租用一段时间，进程中途退出后租期结束会被重新发送。
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.batch_size = getattr(configure, '_email_batch_size_', 20)
+        self.max_attempts = getattr(configure, '_email_max_attempts_', 5)
+        self.retry_base = getattr(configure, '_email_retry_base_', 30)          # 首次重试等待秒数 之后逐次翻倍
+        self.retry_max = getattr(configure, '_email_retry_max_', 3600)
+        self.lease_seconds = getattr(configure, '_email_lease_seconds_', 120)   # 取出后未完成时重新发送的等待秒数
+        self.poll_interval = getattr(configure, '_email_poll_interval_', 5)
+        self.idle_timeout = getattr(configure, '_smtp_idle_timeout_', 30)       # SMTP连接空闲多久后关闭
+        self.wakeup = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.smtp = None
+        self.smtp_last_used = 0
+        self.sent_count = 0
+        self.failed_count = 0
+    
+    def enqueue(self, email, subject, body, kind=''):
+        """将邮件写入发件箱并唤醒发送线程"""
+        outbox_id = self.db.execute_query('''
+            INSERT INTO email_outbox (recipient, subject, body, kind, next_attempt_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (email, subject, body, kind, int(time.time())))
+        self.wakeup.set()
+        return outbox_id
+    
+    def pending_count(self):
+        """待发送的邮件数量"""
+        return self.db.execute_query(
+            "SELECT COUNT(*) FROM email_outbox WHERE status = 'pending'"
+        )[0][0]
+    
+    def start(self):
+        """启动后台发送线程"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='email-outbox', daemon=True)
+        self.thread.start()
+    
+    def stop(self, timeout=5):
+        """停止后台发送线程"""
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout)
+        self.close_smtp()
+    
+    def run(self):
+        """后台发送循环"""
+        while not self.stop_event.is_set():
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+            try:
+                # 连续处理直到没有到期的邮件
+                while not self.stop_event.is_set():
+                    batch = self.claim_batch()
+                    if not batch:
+                        break
+                    self.send_batch(batch)
+            except Exception as e:
+                log_message(f"发件箱处理出错: {e}", level='ERROR')
+            
+            # 关闭空闲的SMTP连接
+            if self.smtp and time.time() - self.smtp_last_used > self.idle_timeout:
+                self.close_smtp()
+    
+    def claim_batch(self):
+        """在事务中取出一批到期邮件并租用"""
+        now = int(time.time())
+        with self.db.transaction() as conn:
+            rows = conn.execute('''
+                SELECT id, recipient, subject, body, kind, attempts
+                FROM email_outbox
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                ORDER BY next_attempt_at
+                LIMIT ?
+            ''', (now, self.batch_size)).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE email_outbox SET next_attempt_at = ? WHERE id = ?",
+                    [(now + self.lease_seconds, row[0]) for row in rows]
+                )
+        return rows
+    
+    def get_smtp(self):
+        """获取可复用的SMTP连接，连接失效时重新建立"""
+        if self.smtp is not None:
+            # 刚使用过的连接直接复用 空闲较久的连接先用NOOP检查是否仍然可用
+            if time.time() - self.smtp_last_used < 5:
+                return self.smtp
+            try:
+                self.smtp.noop()
+                return self.smtp
+            except Exception:
+                self.close_smtp()
+        self.smtp = EmailUtils.connect_smtp()
+        return self.smtp
+    
+    def close_smtp(self):
+        """关闭SMTP连接"""
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except Exception:
+            pass
+        self.smtp = None
+    
+    def send_batch(self, batch):
+        """使用同一个SMTP会话发送一批邮件并记录结果"""
+        sent = []
+        failed = []
+        connect_error = None
+        for outbox_id, email, subject, body, kind, attempts in batch:
+            if connect_error is not None:
+                # 无法连接SMTP服务器时 本批剩余邮件直接等待下次重试
+                failed.append((outbox_id, attempts + 1, connect_error))
+                continue
+            
+            msg = EmailUtils.create_message(email, subject, body).as_string()
+            try:
+                smtp = self.get_smtp()
+            except Exception as e:
+                connect_error = str(e)
+                failed.append((outbox_id, attempts + 1, connect_error))
+                log_message(f"连接SMTP服务器失败: {e}", level='ERROR')
+                continue
+            
+            try:
+                try:
+                    smtp.sendmail(configure._sender_email_, [email], msg)
+                except smtplib.SMTPServerDisconnected:
+                    # 复用的连接被服务器关闭 重新连接后再试一次
+                    self.close_smtp()
+                    self.get_smtp().sendmail(configure._sender_email_, [email], msg)
+                self.smtp_last_used = time.time()
+                sent.append(outbox_id)
+                log_message(f"邮件发送成功: {email} ({kind})")
+            except Exception as e:
+                if not isinstance(e, smtplib.SMTPRecipientsRefused):
+                    self.close_smtp()
+                failed.append((outbox_id, attempts + 1, str(e)))
+                log_message(f"邮件发送失败: {email} ({kind}), 第{attempts + 1}次, 错误: {e}", level='ERROR')
+        
+        now = int(time.time())
+        with self.db.transaction() as conn:
+            if sent:
+                conn.executemany(
+                    "UPDATE email_outbox SET status = 'sent', sent_at = ?, last_error = NULL WHERE id = ?",
+                    [(now, outbox_id) for outbox_id in sent]
+                )
+            for outbox_id, attempts, error in failed:
+                if attempts >= self.max_attempts:
+                    conn.execute(
+                        "UPDATE email_outbox SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                        (attempts, error, outbox_id)
+                    )
+                else:
+                    delay = min(self.retry_base * 2 ** (attempts - 1), self.retry_max)
+                    conn.execute(
+                        "UPDATE email_outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                        (attempts, now + delay, error, outbox_id)
+                    )
+        self.sent_count += len(sent)
+        self.failed_count += len(failed)
+
+class MetricsMiddleware(Middleware):
+    """记录请求数、请求总耗时以及其中的数据库耗时和处理耗时"""
+
+    name = 'metrics'
+
+    def __init__(self, service):
+        self.service = service
+    
+    def before(self, request):
+        self.service.db.reset_time()
+        request.start_time = time.perf_counter()
+    
+    def after(self, request, response):
+        service = self.service
+        elapsed = time.perf_counter() - request.start_time
+        db_time = service.db.elapsed_time()
+        # 未允许的路径和方法统一记为other 避免扫描请求产生大量标签
+        method = request.method
+        if method not in ('GET', 'POST', 'OPTIONS'):
+            method = 'other'
+        labels = (request.route.name,)
+        service.requests_total.inc((request.route.name, method, ResponseBuilder.status_code(response)))
+        service.request_seconds.observe(elapsed, labels)
+        service.request_db_seconds.observe(db_time, labels)
+        service.request_handler_seconds.observe(max(elapsed - db_time, 0.0), labels)
+        return response
+
+class LoggingMiddleware(Middleware):
+    """记录请求参数（隐藏敏感信息）和响应状态"""
+
+    name = 'logging'
+
+    def __init__(self, service):
+        self.service = service
+    
+    def before(self, request):
+        if request.route.log:
+            self.service.log_request(request.method, request.path, request.params, request.addr)
+    
+    def after(self, request, response):
+        if request.route.log:
+            self.service.log_response(response, request.addr)
+        return response
+
+class CorsMiddleware(Middleware):
+    """处理CORS预检请求（CORS响应头已包含在 ResponseBuilder 的固定响应头中）"""
+
+    name = 'cors'
+
+    def __init__(self, service):
+        self.service = service
+    
+    def before(self, request):
+        # OPTIONS预检请求 返回空响应
+        if request.method == 'OPTIONS' and request.route.name != Router.UNKNOWN:
+            return self.service.create_response({}, keep_alive=request.keep_alive)
 
 class AccountService:
     """账号服务类"""
     
-    def __init__(self):
+    def __init__(self, shared_state=None, run_sweeper=True):
         self.db = DatabaseManager()
         self.security = SecurityUtils()
         self.email_utils = EmailUtils()
+        self.outbox = EmailOutbox(self.db)
+        self.session_cache = TokenSessionCache(
+            max_size=getattr(configure, '_session_cache_size_', 10000),
+            ttl=getattr(configure, '_session_cache_ttl_', 60),
+            shared_state=shared_state
+        )
         self.default_reset_password = 'atsw@top'
-        self.hashed_reset_password = self.security.hash_password(self.default_reset_password)
-        self.allowed_paths = {
-            '/register',
-            '/tokenlogin',
-            '/login',
-            '/activate',
-            '/getuserdata',
-            '/resetpwd',
-            '/resetpwdrun',
-            '/updatepwd'
+        self.avatar_prefix = '/avatar/'     # GET /avatar/哈希.扩展名 读取头像
+        # 内部服务调用的密钥 为空时不开放批量接口
+        self.internal_secret = getattr(configure, '_internal_secret_', '').encode('utf-8')
+        self.batch_max_items = getattr(configure, '_batch_max_items_', 500)
+        # 各路径允许的请求体大小 未列出的路径使用默认值
+        self.body_limits = {
+            '/setheadimg': getattr(configure, '_headimg_body_limit_', 2 * 1024 * 1024),
+            '/avatar': getattr(configure, '_avatar_max_bytes_', 2 * 1024 * 1024),
+            '/batch/tokenlogin': 256 * 1024,
+            '/batch/getuserdata': 256 * 1024
         }
+        self.avatars = avatar_store.AvatarStore(
+            getattr(configure, '_avatar_dir_', 'avatars'),
+            cache_bytes=getattr(configure, '_avatar_cache_bytes_', 16 * 1024 * 1024)
+        )
+        self.avatar_base_url = getattr(configure, '_avatar_base_url_', '') or f"{configure._server_url_}{self.avatar_prefix}"
+        self.avatar_max_age = getattr(configure, '_avatar_max_age_', 31536000)
+        # 流式接收请求体的路径 -> 接收前验证请求并创建接收器的函数（见 open_body_sink）
+        # 验证通过后上传的头像才开始接收，边接收边写入临时文件
+        self.body_sinks = {
+            '/avatar': self.begin_avatar_upload
+        }
+        self.responses = ResponseBuilder(
+            configure._access_control_allow_origin_, keep_alive_timeout_, keep_alive_max_requests_
+        )
+        self.activation_pages = build_page_templates(ACTIVATION_PAGE_TEMPLATE)
+        self.resetpwd_pages = build_page_templates(RESETPWD_PAGE_TEMPLATE)
+        self.metrics = MetricsRegistry()
+        self.register_metrics()
+        self.sweeper = ExpirySweeper(self.db, self.metrics) if run_sweeper else None
+        self.backup_job = DatabaseBackupJob(self.db, self.metrics) if run_sweeper else None
+        self.compressor = ResponseCompressor(
+            self.metrics,
+            enabled=getattr(configure, '_compression_enable_', True),
+            min_size=getattr(configure, '_compression_min_size_', 512),
+            level=getattr(configure, '_compression_level_', 6)
+        )
+        self.router = self.build_router()
+        self.bad_request_route = Route(Router.UNKNOWN, self.handle_bad_request, log=False)
+        self.pipeline = MiddlewarePipeline(
+            [MetricsMiddleware(self), LoggingMiddleware(self), CorsMiddleware(self)],
+            self.stage_seconds
+        )
+    
+    def register_metrics(self):
+        """注册请求处理、邮件发送和会话缓存相关的指标"""
+        metrics = self.metrics
+        self.requests_total = metrics.counter(
+            'account_requests_total', '已处理的请求数', ('route', 'method', 'status'))
+        self.request_seconds = metrics.histogram(
+            'account_request_duration_seconds', '请求处理总耗时', ('route',))
+        self.request_db_seconds = metrics.histogram(
+            'account_request_db_seconds', '请求中数据库操作的耗时', ('route',))
+        self.request_handler_seconds = metrics.histogram(
+            'account_request_handler_seconds', '请求中除数据库以外的处理耗时', ('route',))
+        self.stage_seconds = metrics.histogram(
+            'account_stage_seconds', '请求处理各阶段（中间件和路由处理函数）自身的耗时', ('stage',),
+            buckets=MiddlewarePipeline.STAGE_BUCKETS)
+        metrics.gauge('account_email_outbox_pending', '发件箱中待发送的邮件数', callback=self.outbox.pending_count)
+        metrics.counter('account_emails_sent_total', '发送成功的邮件数', callback=lambda: self.outbox.sent_count)
+        metrics.counter('account_emails_failed_total', '最终发送失败的邮件数', callback=lambda: self.outbox.failed_count)
+        metrics.counter('account_session_cache_hits_total', '会话缓存命中次数', callback=lambda: self.session_cache.stats()['hits'])
+        metrics.counter('account_session_cache_misses_total', '会话缓存未命中次数', callback=lambda: self.session_cache.stats()['misses'])
     
     def create_html_response(self, title, message, is_success=True):
-        """创建HTML响应页面"""
-        icon = "✅" if is_success else "❌"
-        bg_color = "#d4edda" if is_success else "#f8d7da"
-        border_color = "#c3e6cb" if is_success else "#f5c6cb"
-
-        # 激活返回页面 ViewAccountActivationRespone.html
-        html = f"""<html><head><meta charset="UTF-8"><title>{title}</title><style>body{{background:linear-gradient(135deg,#667eea,#764ba2);margin:0;padding:20px;min-height:100vh;display:flex;align-items:center;justify-content:center}} .c{{background:white;padding:30px;border-radius:10px;box-shadow:0 10px 30px rgba(0,0,0,0.2);text-align:center;width:100%}} .m{{background:{bg_color};border:1px solid {border_color};padding:15px;border-radius:5px;margin:20px 0;color:#155724;font-size:24px}} .i{{font-size:48px;margin-bottom:20px}}</style></head><body><div class="c"><div class="i">{icon}</div><h1>{title}</h1><div class="m">{message}</div></div></body></html>"""
-        return html.encode('utf-8')
+        """创建激活结果页面，返回字节块列表"""
+        return self.activation_pages[is_success].render(title=title, message=message)
     
     def create_resetpwd_html_response(self, title, message, is_success=True):
-        """创建密码重置HTML响应页面"""
-        icon = "✅" if is_success else "❌"
-        bg_color = "#d4edda" if is_success else "#f8d7da"
-        border_color = "#c3e6cb" if is_success else "#f5c6cb"
-
-        # 密码重置返回页面 ViewPasswordResetRespone.html
-        html = f"""<html><head><meta charset="UTF-8"><title>{title}</title><style>body{{background:linear-gradient(135deg,#667eea,#764ba2);margin:0;padding:20px;min-height:100vh;display:flex;align-items:center;justify-content:center}} .c{{background:white;padding:30px;border-radius:10px;box-shadow:0 10px 30px rgba(0,0,0,0.2);text-align:center;width:100%;max-width:600px}} .m{{background:{bg_color};border:1px solid {border_color};padding:15px;border-radius:5px;margin:20px 0;color:#155724;font-size:18px;text-align:left}} .i{{font-size:48px;margin-bottom:20px}} .w{{color:#856404;background-color:#fff3cd;border:1px solid #ffeaa7;padding:10px;border-radius:5px;margin:15px 0;font-size:16px}} .btn{{display:inline-block;background:#4CAF50;color:#fff;padding:12px 24px;text-decoration:none;border-radius:5px;margin:15px 0;border:none;cursor:pointer;font-size:16px}} .btn:hover{{background:#45a049}} input{{width:100%;padding:10px;margin:10px 0;border:1px solid #ddd;border-radius:5px;box-sizing:border-box}}</style></head><body><div class="c"><div class="i">{icon}</div><h1>{title}</h1><div class="m">{message}</div></div></body></html>"""
-        return html.encode('utf-8')
+        """创建密码重置结果页面，返回字节块列表"""
+        return self.resetpwd_pages[is_success].render(title=title, message=message)
 
-    def parse_request(self, request_data):
-        """解析HTTP请求"""
-        try:
-            if not request_data or not isinstance(request_data, str):
-                return None, None, {}
-            
-            # 限制请求大小
-            if len(request_data) > 8192:  # 8KB限制
-                log_message("请求数据过大")
-                return None, None, {}
-            
-            lines = request_data.split('\r\n')
-            if not lines:
-                return None, None, {}
-            
-            # 验证请求行格式
-            request_line = lines[0].strip()
-            if not request_line:
-                return None, None, {}
-            
-            parts = request_line.split()
-            if len(parts) < 2:
-                return None, None, {}
-            
-            method = parts[0] # GET OR POST
-            path = parts[1] # 包含路径和参数
-            
-            # 验证路径格式
-            parsed_url = urlparse(path)
-            path = parsed_url.path
-            query_params = parse_qs(parsed_url.query)
-            
-            # 解析POST数据
-            post_data = {}
-            if method == 'POST':
-                # 找到空行后的请求体
-                body_start = False
-                for i, line in enumerate(lines):
-                    if line == '':
-                        body_start = i + 1
-                        break
-                
-                if body_start and body_start < len(lines):
-                    try:
-                        body = lines[body_start]
-                        post_data = parse_qs(body)
-                    except:
-                        post_data = {}
-            
-            # 简化参数格式
-            params = {}
-            for key, value in query_params.items():
-                params[key] = value[0] if value else ''
-            
-            for key, value in post_data.items():
-                params[key] = value[0] if value else ''
-            
-            return method, path, params
-            
-        except Exception as e:
-            log_message(f"解析请求时出错: {e}")
-            return None, None, {}
+    def should_keep_alive(self, request):
+        """根据HTTP版本和Connection头判断客户端是否希望保持连接"""
+        # HTTP/1.1默认保持连接 HTTP/1.0需要显式声明
+        connection = request.headers.get('connection', '').lower()
+        if 'close' in connection:
+            return False
+        if 'keep-alive' in connection:
+            return True
+        return request.version == 'HTTP/1.1'
     
-    def create_response(self, data, status_code=200, content_type='application/json', cookies=None):
-        """创建HTTP响应"""
-        status_text = 'OK' if status_code == 200 else 'Not Found'
-        response = f"HTTP/1.1 {status_code} {status_text}\r\n"
-        response += f"Content-Type: {content_type}\r\n"
-        
-        # 添加CORS头允许跨域访问api
-        response += f"Access-Control-Allow-Origin: {configure._access_control_allow_origin_}\r\n"
-        response += "Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n"
-        response += "Access-Control-Allow-Headers: Content-Type, Authorization\r\n"
-        
-        if cookies:
-            for cookie in cookies:
-                response += f"Set-Cookie: {cookie}\r\n"
-        
-        response += "\r\n"
-        
+    def create_response(self, data, status_code=200, content_type='application/json', cookies=None, keep_alive=False, headers=None, encoding=None):
+        """创建HTTP响应，返回字节块列表；encoding为协商出的压缩编码"""
+        body = []
         if content_type == 'application/json' and data:
-            response += json.dumps(data)
-        
-        return response.encode('utf-8')
+            body.append(json.dumps(data).encode('utf-8'))
+        body, encoding_headers = self.compressor.compress(body, encoding)
+        if encoding_headers:
+            headers = (headers or []) + encoding_headers
+        return self.responses.build(
+            status_code, body, content_type,
+            keep_alive=keep_alive, cookies=cookies, headers=headers
+        )
+    
+    def create_html_http_response(self, html_chunks, keep_alive=False, encoding=None):
+        """将HTML页面包装为完整的HTTP响应"""
+        body, encoding_headers = self.compressor.compress(html_chunks, encoding)
+        return self.responses.build(
+            200, body, 'text/html; charset=utf-8',
+            keep_alive=keep_alive, headers=encoding_headers, cors=False
+        )
     
     def log_request(self, method, path, params, addr):
         """记录请求信息"""
@@ -317,32 +1270,25 @@ class AccountService:
         log_message(f"请求来自 {addr}: {method} {path}")
         log_message(f"请求参数: {safe_params}")
     
-    def log_response(self, response_data, addr):
+    def log_response(self, response, addr):
         """记录响应信息"""
+        status_line = ResponseBuilder.status_line(response)
+        log_message(f"响应给 {addr}: {status_line}")
+        if b'Content-Type: application/json' not in response[0] or b'Content-Encoding' in response[1]:
+            # HTML页面和压缩后的响应不需要解码记录
+            log_message(f"响应内容: [长度: {sum(map(len, ResponseBuilder.body(response)))}]")
+            return
+        body = b''.join(ResponseBuilder.body(response))
         try:
-            # 尝试解析响应内容
-            response_str = response_data.decode('utf-8')
-            # 提取状态码
-            status_line = response_str.split('\r\n')[0]
-            # 提取响应体
-            body_start = response_str.find('\r\n\r\n') + 4
-            body = response_str[body_start:] if body_start > 3 else ""
-            
             # 尝试解析JSON响应体
-            try:
-                json_body = json.loads(body) if body else {}
-                # 隐藏敏感信息
-                safe_body = json_body.copy()
-                if 'user' in safe_body and safe_body['user'] and 'password' in safe_body['user']:
-                    safe_body['user']['password'] = '***'
-                
-                log_message(f"响应给 {addr}: {status_line}")
-                log_message(f"响应内容: {json.dumps(safe_body, ensure_ascii=False)}")
-            except:
-                log_message(f"响应给 {addr}: {status_line}")
-                log_message(f"响应内容: {body[:maxWriteLog_]}...")
-        except:
-            log_message(f"响应给 {addr}: [二进制数据，长度: {len(response_data)}]")
+            json_body = json.loads(body) if body else {}
+            # 隐藏敏感信息
+            safe_body = json_body.copy()
+            if 'user' in safe_body and safe_body['user'] and 'password' in safe_body['user']:
+                safe_body['user']['password'] = '***'
+            log_message(f"响应内容: {json.dumps(safe_body, ensure_ascii=False)}")
+        except Exception:
+            log_message(f"响应内容: {body[:maxWriteLog_].decode('utf-8', 'replace')}...")
     
     def handle_register(self, params):
         """处理注册请求"""
@@ -385,17 +1331,18 @@ class AccountService:
                 VALUES (?, ?, ?, ?, ?, ?, ?, NULL, NULL)
             ''', (email, hashed_password, name, qq_value, verification_code, code_expiry, 0))
             
-            # 发送验证邮件
-            email_sent = self.email_utils.send_verification_email(
-                email, name, verification_code, user_id
-            )
-            
-            if email_sent:
+            # 将验证邮件放入发件箱 由后台线程发送
+            try:
+                subject, body = self.email_utils.build_verification_email(name, verification_code, user_id)
+                self.outbox.enqueue(email, subject, body, 'activate')
                 response["success"] = True
                 response["message"] = "注册成功！请查收邮件激活账户"
-            else:
+            except Exception as e:
+                log_message(f"账号激活邮件入队失败: {email}, 错误: {e}", level='ERROR')
                 response["message"] = "注册成功，但发送验证邮件失败，请联系管理员"
             
+        except PasswordHashBusy:
+            response["message"] = "服务器繁忙，请稍后再试"
         except Exception as e:
             response["message"] = f"注册过程中发生错误: {str(e)}"
         
@@ -448,7 +1395,7 @@ class AccountService:
             
             user_data = user[0]
             
-            # 验证密码
+            # 验证密码（在进程池中计算 此时不占用数据库连接）
             if not self.security.verify_password(password, user_data[3]):
                 response["message"] = "邮箱或密码错误"
                 return response, []
@@ -458,16 +1405,35 @@ class AccountService:
                 response["message"] = "请先激活您的账户"
                 return response, []
             
+            # 旧版哈希或哈希参数已变化时 使用本次登录的明文密码重新计算
+            new_hash = self.security.hash_password(password) if self.security.needs_rehash(user_data[3]) else None
+            
             # 生成新token
             token = self.security.generate_token(22)
             token_expiry = int(time.time()) + 15768000  # 182.5天
             
-            # 更新用户token
-            self.db.execute_query('''
-                UPDATE users 
-                SET token = ?, token_expiry = ?, last_login = ?
-                WHERE id = ?
-            ''', (token, token_expiry, int(time.time()), user_data[0]))
+            # 验证密码和计算哈希时没有占用数据库连接，其间密码可能已被修改或重置，
+            # 两个更新都以验证时读取的密码哈希为条件，并在同一个事务中提交
+            with self.db.transaction() as conn:
+                # 更新用户token
+                updated = conn.execute('''
+                    UPDATE users 
+                    SET token = ?, token_expiry = ?, last_login = ?
+                    WHERE id = ? AND password = ?
+                ''', (token, token_expiry, int(time.time()), user_data[0], user_data[3])).rowcount
+                
+                # 密码已被修改时不再写入旧密码的新哈希
+                if updated and new_hash is not None:
+                    conn.execute('''
+                        UPDATE users 
+                        SET password = ?
+                        WHERE id = ? AND password = ?
+                    ''', (new_hash, user_data[0], user_data[3]))
+            if not updated:
+                # 验证的是已被替换的旧密码
+                response["message"] = "邮箱或密码错误"
+                return response, []
+            self.session_cache.invalidate_user(user_data[0])
             
             # 准备Cookie
             expires = time.strftime("%a, %d-%b-%Y %H:%M:%S GMT", time.gmtime(token_expiry))
@@ -485,7 +1451,7 @@ class AccountService:
                 "name": user_data[4],
                 "qq": user_data[5],
                 "theme_color": user_data[6],
-                "head_img": user_data[7],
+                "head_img": self.avatar_url(user_data[7]),
                 "token": token
             }
             
@@ -495,6 +1461,9 @@ class AccountService:
             
             return response, cookie_list
             
+        except PasswordHashBusy:
+            response["message"] = "服务器繁忙，请稍后再试"
+            return response, []
         except Exception as e:
             response["message"] = f"登录过程中发生错误: {str(e)}"
             return response, []
@@ -566,6 +1535,162 @@ class AccountService:
                 is_success=False
             )
     
+    def start(self):
+        """启动后台任务"""
+        # 先启动密码哈希进程池 避免在其他线程运行后再创建子进程
+        self.security.start()
+        self.outbox.start()
+        if self.sweeper:
+            self.sweeper.start()
+        if self.backup_job:
+            self.backup_job.start()
+    
+    def close(self):
+        """释放服务占用的资源"""
+        if self.sweeper:
+            self.sweeper.stop()
+        if self.backup_job:
+            self.backup_job.stop()
+        self.outbox.stop()
+        self.security.close()
+        log_message(f"会话缓存统计: {self.session_cache.stats()}")
+        log_message(f"邮件发送统计: 成功 {self.outbox.sent_count}, 失败 {self.outbox.failed_count}")
+        self.db.close_all()
+    
+    def get_token_session(self, user_id, token):
+        """根据user_id和token获取用户数据行，优先从会话缓存中读取
+
+        返回 (id, anonymous_user, email, name, qq, theme_color, head_img, token_expiry, email_verified)，
+        用户不存在或token无效时返回None
+        """
+        user_data = self.session_cache.get(user_id, token)
+        if user_data is not None:
+            return user_data
+        
+        user = self.db.execute_query('''
+            SELECT id, anonymous_user, email, name, qq, theme_color, head_img, token_expiry, email_verified
+            FROM users 
+            WHERE id = ? AND token = ?
+        ''', (user_id, token))
+        
+        if not user:
+            return None
+        
+        user_data = user[0]
+        self.session_cache.put(user_id, token, user_data, user_data[7])
+        return user_data
+    
+    def get_token_sessions(self, pairs):
+        """批量获取会话数据行，未命中缓存的用户通过一次 id IN (...) 查询读取
+
+        pairs 为 (user_id, token) 列表，返回与之对应的数据行列表（无效时为None）
+        """
+        results = [None] * len(pairs)
+        missing = {}        # user_id -> 需要查询的下标列表
+        for index, (user_id, token) in enumerate(pairs):
+            user_data = self.session_cache.get(user_id, token)
+            if user_data is not None:
+                results[index] = user_data
+            else:
+                missing.setdefault(user_id, []).append(index)
+        
+        user_ids = list(missing)
+        # 每条语句的参数数量有上限 按批次查询
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            rows = self.db.execute_query(f'''
+                SELECT id, anonymous_user, email, name, qq, theme_color, head_img, token_expiry, email_verified, token
+                FROM users
+                WHERE id IN ({','.join('?' * len(chunk))})
+            ''', chunk)
+            for row in rows:
+                user_data, user_token = row[:9], row[9]
+                for index in missing.get(str(row[0]), ()):
+                    token = pairs[index][1]
+                    if user_token and user_token == token:
+                        results[index] = user_data
+                        self.session_cache.put(pairs[index][0], token, user_data, user_data[7])
+        return results
+    
+    def user_info(self, user_data):
+        """会话数据行转换为返回给客户端的用户数据"""
+        return {
+            "id": user_data[0],
+            "anonymous_user": bool(user_data[1]),
+            "email": user_data[2],
+            "password": "",
+            "name": user_data[3],
+            "qq": user_data[4],
+            "theme_color": user_data[5],
+            "head_img": self.avatar_url(user_data[6])
+        }
+    
+    def avatar_url(self, head_img):
+        """head_img 为头像存储中的文件名时转换为读取地址，旧的 base64 数据和 'none' 原样返回"""
+        if avatar_store.is_avatar_name(head_img):
+            return self.avatar_base_url + head_img
+        return head_img
+    
+    def is_internal_request(self, request):
+        """请求是否带有正确的内部服务密钥"""
+        if not self.internal_secret:
+            return False
+        secret = request.headers.get('x-internal-secret', '').encode('utf-8')
+        return hmac.compare_digest(secret, self.internal_secret)
+    
+    def handle_batch_session(self, request, kind):
+        """处理批量token验证请求（仅限内部服务调用）
+
+        请求体为JSON: {"items": [{"user_id": "1", "token": "..."}, ...]}
+        kind 为 tokenlogin 时与 /tokenlogin 相同要求账户已激活，为 getuserdata 时与 /getuserdata 相同。
+        返回 (响应数据, 状态码)，results 中每一项与请求的 items 按顺序对应。
+        """
+        if not self.is_internal_request(request):
+            return {"success": False, "message": "forbidden"}, 403
+        
+        try:
+            items = json.loads(request.body or b'{}').get('items')
+        except (ValueError, AttributeError):
+            items = None
+        if not isinstance(items, list):
+            return {"success": False, "message": "请求体必须为包含items列表的JSON"}, 400
+        if len(items) > self.batch_max_items:
+            return {"success": False, "message": f"每次最多查询 {self.batch_max_items} 项"}, 413
+        
+        pairs = []
+        for item in items:
+            if not isinstance(item, dict):
+                item = {}
+            user_id = str(item.get('user_id') or '').strip()
+            if user_id.isdigit():
+                user_id = str(int(user_id))     # 与查询结果中的id格式一致
+            pairs.append((user_id, str(item.get('token') or '').strip()))
+        
+        valid = [index for index, (user_id, token) in enumerate(pairs) if user_id and token]
+        rows = self.get_token_sessions([pairs[index] for index in valid])
+        user_rows = dict(zip(valid, rows))
+        
+        current_time = int(time.time())
+        results = []
+        for index in range(len(pairs)):
+            result = {"success": False, "message": "", "user": None}
+            user_data = user_rows.get(index)
+            if index not in user_rows:
+                result["message"] = "empty user_id or user_token" if kind == 'tokenlogin' else "用户ID和token不能为空"
+            elif not user_data:
+                result["message"] = "token无效或用户不存在" if kind == 'tokenlogin' else "用户不存在或token无效"
+            elif user_data[7] and user_data[7] < current_time:
+                result["message"] = "token已过期，请重新登录"
+            elif kind == 'tokenlogin' and not user_data[8]:
+                result["message"] = "账户未激活，请先激活账户"
+            else:
+                result["success"] = True
+                result["message"] = "ok" if kind == 'tokenlogin' else "获取用户数据成功"
+                result["user"] = self.user_info(user_data)
+            results.append(result)
+        
+        return {"success": True, "message": "ok", "results": results}, 200
+    
     def handle_getuserdata(self, params, cookies):
         """处理获取用户数据请求"""
         response = {"success": False, "message": "", "user": None}
@@ -578,57 +1703,33 @@ class AccountService:
                 response["message"] = "用户ID和token不能为空"
                 return response
             
-            # 从Cookie中提取token和user_id（如果参数中没有提供）
-            cookie_dict = {}
-            for cookie in cookies:
-                parts = cookie.split('=')
-                if len(parts) == 2:
-                    cookie_dict[parts[0].strip()] = parts[1].strip()
-            
             # 优先使用参数中的值，如果没有则使用Cookie中的值
             if not user_id:
-                user_id = cookie_dict.get('user_id', '')
+                user_id = cookies.get('user_id', '')
             if not token:
-                token = cookie_dict.get('user_token', '')
+                token = cookies.get('user_token', '')
             
             if not user_id or not token:
                 response["message"] = "用户ID和token不能为空"
                 return response
             
             # 查询用户
-            user = self.db.execute_query('''
-                SELECT id, anonymous_user, email, name, qq, theme_color, head_img, token, token_expiry
-                FROM users 
-                WHERE id = ? AND token = ?
-            ''', (user_id, token))
+            user_data = self.get_token_session(user_id, token)
             
-            if not user:
+            if not user_data:
                 response["message"] = "用户不存在或token无效"
                 return response
             
-            user_data = user[0]
-            current_time = int(time.time())
-            
-            # 检查token是否过期
-            if user_data[8] and user_data[8] < current_time:
-                response["message"] = "token已过期，请重新登录"
-                return response
-            
-            # 准备返回的用户数据
-            user_data_info = {
-                "id": user_data[0],
-                "anonymous_user": bool(user_data[1]),
-                "email": user_data[2],
-                "password": "",
-                "name": user_data[3],
-                "qq": user_data[4],
-                "theme_color": user_data[5],
-                "head_img": user_data[6]
-            }
-            
+            current_time = int(time.time())
+            
+            # 检查token是否过期
+            if user_data[7] and user_data[7] < current_time:
+                response["message"] = "token已过期，请重新登录"
+                return response
+            
             response["success"] = True
             response["message"] = "获取用户数据成功"
-            response["user"] = user_data_info
+            response["user"] = self.user_info(user_data)
             
         except Exception as e:
             response["message"] = f"获取用户数据过程中发生错误: {str(e)}"
@@ -644,62 +1745,38 @@ class AccountService:
             user_id = params.get('user_id', '').strip()
             token = params.get('user_token', '').strip()
         
-            # 从Cookie中提取token和user_id（如果参数中没有提供）
-            cookie_dict = {}
-            for cookie in cookies:
-                parts = cookie.split('=')
-                if len(parts) == 2:
-                    cookie_dict[parts[0].strip()] = parts[1].strip()
-            
             # 优先使用参数中的值，如果没有则使用Cookie中的值
             if not user_id:
-                user_id = cookie_dict.get('user_id', '')
+                user_id = cookies.get('user_id', '')
             if not token:
-                token = cookie_dict.get('user_token', '')
+                token = cookies.get('user_token', '')
             
             if not user_id or not token:
                 response["message"] = "empty user_id or user_token"
                 return response
             
             # 查询用户
-            user = self.db.execute_query('''
-                SELECT id, anonymous_user, email, password, name, qq, theme_color, head_img, token, token_expiry, email_verified
-                FROM users 
-                WHERE id = ? AND token = ?
-            ''', (user_id, token))
+            user_data = self.get_token_session(user_id, token)
             
-            if not user:
+            if not user_data:
                 response["message"] = "token无效或用户不存在"
                 return response
             
-            user_data = user[0]
             current_time = int(time.time())
             
             # 检查token是否过期
-            if user_data[9] and user_data[9] < current_time:
+            if user_data[7] and user_data[7] < current_time:
                 response["message"] = "token已过期，请重新登录"
                 return response
             
             # 检查邮箱是否已验证
-            if not user_data[10]:
+            if not user_data[8]:
                 response["message"] = "账户未激活，请先激活账户"
                 return response
             
-            # 准备返回的用户数据
-            user_data_info = {
-                "id": user_data[0],
-                "anonymous_user": bool(user_data[1]),
-                "email": user_data[2],
-                "password": "",
-                "name": user_data[4],
-                "qq": user_data[5],
-                "theme_color": user_data[6],
-                "head_img": user_data[7]
-            }
-            
             response["success"] = True
             response["message"] = "ok"
-            response["user"] = user_data_info
+            response["user"] = self.user_info(user_data)
             
             return response
         
@@ -707,8 +1784,38 @@ class AccountService:
             response["message"] = f"自动登录过程中发生错误: {str(e)}"
             return response, []
     
+    def check_user_token(self, user_id, token):
+        """验证用户和token，通过时返回None，否则返回错误提示"""
+        user = self.db.execute_query('''
+            SELECT id, token, token_expiry
+            FROM users 
+            WHERE id = ? AND token = ?
+        ''', (user_id, token))
+        
+        if not user:
+            return "用户不存在或token无效"
+        
+        # 检查token是否过期
+        token_expiry = user[0][2]
+        if token_expiry and token_expiry < int(time.time()):
+            return "token已过期，请重新登录"
+        return None
+    
+    def update_head_img(self, user_id, name, response):
+        """保存头像文件名到用户数据，并在响应中返回头像地址"""
+        self.db.execute_query('''
+            UPDATE users 
+            SET head_img = ?
+            WHERE id = ?
+        ''', (name, user_id))
+        self.session_cache.invalidate_user(user_id)
+        
+        response["success"] = True
+        response["message"] = "更新头像成功！"
+        response["head_img"] = self.avatar_url(name)
+    
     def handle_setheadimg(self, params):
-        """设置用户自定义头像"""
+        """设置用户自定义头像（base64 格式的图片）"""
         response = {"success": False, "message": ""}
         
         try:
@@ -722,44 +1829,106 @@ class AccountService:
                 return response
             
             # 验证用户和token
-            user = self.db.execute_query('''
-                SELECT id, token, token_expiry
-                FROM users 
-                WHERE id = ? AND token = ?
-            ''', (user_id, token))
+            error = self.check_user_token(user_id, token)
+            if error:
+                response["message"] = error
+                return response
             
-            if not user:
-                response["message"] = "用户不存在或token无效"
+            # 验证base64图片数据 图片解码后保存到头像存储 数据库只保存文件名
+            image = avatar_store.decode_data_uri(base64_img)
+            name = self.avatars.put(image) if image else None
+            if not name:
+                response["message"] = "图片格式不正确"
                 return response
             
-            user_data = user[0]
-            current_time = int(time.time())
+            self.update_head_img(user_id, name, response)
             
-            # 检查token是否过期
-            if user_data[2] and user_data[2] < current_time:
-                response["message"] = "token已过期，请重新登录"
-                return response
+        except Exception as e:
+            response["message"] = f"更新头像失败: {str(e)}"
+        
+        return response
+    
+    def begin_avatar_upload(self, params):
+        """头像上传的请求体接收之前验证用户和token，通过后创建临时文件，返回 (错误提示, 接收器)"""
+        user_id = params.get('user_id', '').strip()
+        token = params.get('user_token', '').strip()
+        
+        # 验证参数
+        if not user_id or not token:
+            return "参数不完整", None
+        
+        # 验证用户和token
+        error = self.check_user_token(user_id, token)
+        if error:
+            return error, None
+        return None, self.avatars.begin_upload()
+    
+    def open_body_sink(self, request):
+        """流式请求体开始接收之前调用（准入中间件之后），验证通过后设置 request.body_sink 并返回None
+
+        验证失败时返回错误响应，不创建接收器，未通过验证的客户端不会在磁盘上产生文件；
+        剩余的请求体不再接收，响应后关闭连接
+        """
+        try:
+            error, sink = self.body_sinks[request.path](request.params)
+        except Exception as e:
+            error, sink = f"接收请求数据失败: {str(e)}", None
+        if error:
+            log_message(f"来自 {request.addr} 的 {request.path} 请求未通过验证: {error}")
+            return self.create_response({"success": False, "message": error}, keep_alive=False)
+        request.body_sink = sink
+        return None
+    
+    def handle_uploadavatar(self, params, request):
+        """上传用户头像（POST /avatar?user_id=...&user_token=...，请求体为图片文件）
+
+        用户和token在接收请求体之前已由 begin_avatar_upload 验证，
+        请求体在接收时已写入临时文件，这里按内容哈希保存
+        """
+        response = {"success": False, "message": ""}
+        
+        try:
+            user_id = params.get('user_id', '').strip()
             
-            # 验证base64图片数据
-            if not base64_img.startswith('data:image/'):
-                response["message"] = "图片格式不正确"
+            # 验证参数
+            if not user_id or request.body_sink is None:
+                response["message"] = "参数不完整"
                 return response
             
-            # 更新头像
-            self.db.execute_query('''
-                UPDATE users 
-                SET head_img = ?
-                WHERE id = ?
-            ''', (base64_img, user_id))
+            name = request.body_sink.commit()
+            if not name:
+                response["message"] = "图片格式不正确，仅支持 png/jpg/gif/webp"
+                return response
             
-            response["success"] = True
-            response["message"] = "更新头像成功！"
+            self.update_head_img(user_id, name, response)
             
         except Exception as e:
             response["message"] = f"更新头像失败: {str(e)}"
         
         return response
     
+    def handle_getavatar(self, request):
+        """读取头像图片（GET /avatar/哈希.扩展名）
+
+        文件名就是内容哈希，内容不会改变，可以长期缓存；ETag 使用哈希，
+        客户端带 If-None-Match 重新验证时直接返回304
+        """
+        name = request.path[len(self.avatar_prefix):]
+        keep_alive = request.keep_alive
+        avatar = self.avatars.get(name)
+        if avatar is None:
+            return self.create_response({"error": "Not found"}, 404, keep_alive=keep_alive)
+        
+        data, content_type = avatar
+        etag = f'"{name.split(".", 1)[0]}"'
+        headers = [
+            f"ETag: {etag}",
+            f"Cache-Control: public, max-age={self.avatar_max_age}, immutable"
+        ]
+        if etag in request.headers.get('if-none-match', ''):
+            return self.responses.build(304, [], content_type, keep_alive=keep_alive, headers=headers)
+        return self.responses.build(200, [data], content_type, keep_alive=keep_alive, headers=headers)
+    
     def handle_resetpwd(self, params):
         """处理重置密码请求(POST)"""
         response = {"success": False, "message": ""}
@@ -807,15 +1976,14 @@ class AccountService:
                 WHERE id = ?
             ''', (resetpwd_code, resetpwd_expiry, user_data[0]))
             
-            # 发送重置邮件
-            email_sent = self.email_utils.send_reset_password_email(
-                user_email, user_data[1], resetpwd_code, user_data[0]
-            )
-            
-            if email_sent:
+            # 将重置邮件放入发件箱 由后台线程发送
+            try:
+                subject, body = self.email_utils.build_reset_password_email(user_data[1], resetpwd_code, user_data[0])
+                self.outbox.enqueue(user_email, subject, body, 'resetpwd')
                 response["success"] = True
                 response["message"] = "重置邮件发送成功，请查收邮件以重置密码！"
-            else:
+            except Exception as e:
+                log_message(f"密码重置邮件入队失败: {user_email}, 错误: {e}", level='ERROR')
                 response["message"] = "抱歉！我们无法向您发送邮件，请联系管理员。"
             
         except Exception as e:
@@ -867,7 +2035,8 @@ class AccountService:
                 UPDATE users 
                 SET password = ?, resetpwd_expiry = ?
                 WHERE id = ?
-            ''', (self.hashed_reset_password, current_time - 1, user_id))  # 设置过期时间为过去时间
+            ''', (self.security.hash_password(self.default_reset_password), current_time - 1, user_id))  # 设置过期时间为过去时间
+            self.session_cache.invalidate_user(user_id)
             
             success_message = f"""
             您的密码已重置成功！<br><br>
@@ -899,18 +2068,11 @@ class AccountService:
             old_pwd = params.get('old_pwd', '')
             new_pwd = params.get('new_pwd', '')
             
-            # 从Cookie中提取token和user_id（如果参数中没有提供）
-            cookie_dict = {}
-            for cookie in cookies:
-                parts = cookie.split('=')
-                if len(parts) == 2:
-                    cookie_dict[parts[0].strip()] = parts[1].strip()
-            
             # 优先使用参数中的值，如果没有则使用Cookie中的值
             if not user_id:
-                user_id = cookie_dict.get('user_id', '')
+                user_id = cookies.get('user_id', '')
             if not user_token:
-                user_token = cookie_dict.get('user_token', '')
+                user_token = cookies.get('user_token', '')
             
             # 验证参数
             if not user_id or not user_token:
@@ -967,334 +2129,954 @@ class AccountService:
                 SET password = ?
                 WHERE id = ?
             ''', (hashed_new_password, user_id))
+            self.session_cache.invalidate_user(user_id)
             
             response["success"] = True
             response["message"] = "密码更新成功！"
             
+        except PasswordHashBusy:
+            response["message"] = "服务器繁忙，请稍后再试"
         except Exception as e:
             response["message"] = f"更新密码过程中发生错误: {str(e)}"
         
         return response
 
-    def handle_request(self, request_data, addr):
-        """处理HTTP请求"""
-        method, path, params = self.parse_request(request_data)
-        
-        if not method or not path:
-            return self.create_response({"error": "Invalid request"}, 400)
-        
-        # 检查路径是否在允许列表中
-        if path not in self.allowed_paths:
-            log_message(f"拒绝访问未允许的路径: {path} 来自 {addr}")
-            return self.create_response({"error": "Not found"}, 404)
-
-        # 记录请求信息
-        self.log_request(method, path, params, addr)
-        
-        # 获取Cookie
-        cookies = []
-        for line in request_data.split('\r\n'):
-            if line.startswith('Cookie:'):
-                cookies = [c.strip() for c in line[8:].split(';')]
-        
-        # 处理OPTIONS预检请求 返回空响应
-        if method == 'OPTIONS':
-            return self.create_response({})
-
-        # 路由处理
-        if   path == '/register'        and method == 'POST':
-            result = self.handle_register(params)
-            response = self.create_response(result)
-        elif path == '/tokenlogin'      and method == 'POST':
-            result = self.handle_tokenlogin(params, cookies)
-            response = self.create_response(result)
-        elif path == '/login'           and method == 'POST':
-            result, cookie_list = self.handle_login(params)
-            response = self.create_response(result, cookies=cookie_list)
-        elif path == '/activate'        and method == 'GET':
-            # 直接返回HTML响应
-            html_content = self.handle_activate(params)
-            # 创建完整的HTTP响应
-            response_lines = [
-                "HTTP/1.1 200 OK",
-                "Content-Type: text/html; charset=utf-8",
-                "Content-Length: " + str(len(html_content)),
-                "",
-                html_content.decode('utf-8')  # 转换为字符串
-            ]
-            response = "\r\n".join(response_lines).encode('utf-8')
-        elif path == '/getuserdata'     and method == 'POST':
-            result = self.handle_getuserdata(params, cookies)
-            response = self.create_response(result)
-        elif path == '/resetpwd'        and method == 'POST':
-            result = self.handle_resetpwd(params)
-            response = self.create_response(result)
-        elif path == '/resetpwdrun'     and method == 'GET':
-            # 直接返回HTML响应
-            html_content = self.handle_resetpwdrun(params)
-            # 创建完整的HTTP响应
-            response_lines = [
-                "HTTP/1.1 200 OK",
-                "Content-Type: text/html; charset=utf-8",
-                "Content-Length: " + str(len(html_content)),
-                "",
-                html_content.decode('utf-8')  # 转换为字符串
-            ]
-            response = "\r\n".join(response_lines).encode('utf-8')
-        elif path == '/updatepwd'       and method == 'POST':
-            result = self.handle_updatepwd(params, cookies)
-            response = self.create_response(result)
-        # 设置头像功能还未实装
-        # elif path == '/setheadimg'      and method == 'POST':
-        #     result = self.handle_setheadimg(params)
-        #     response = self.create_response(result)
+    def build_router(self):
+        """路由表 (方法, 路径) -> 处理函数，处理函数接收请求对象并返回响应"""
+        router = Router(self.handle_not_found, self.handle_method_not_allowed)
+        json_response = self.json_response
+        html_response = self.html_response
+        router.add('POST', '/register',     lambda request: json_response(request, self.handle_register(request.params)))
+        router.add('POST', '/tokenlogin',   lambda request: json_response(request, self.handle_tokenlogin(request.params, request.cookies)))
+        router.add('POST', '/login',        self.route_login)
+        router.add('GET',  '/activate',     lambda request: html_response(request, self.handle_activate(request.params)))
+        router.add('POST', '/getuserdata',  lambda request: json_response(request, self.handle_getuserdata(request.params, request.cookies)))
+        router.add('POST', '/resetpwd',     lambda request: json_response(request, self.handle_resetpwd(request.params)))
+        router.add('GET',  '/resetpwdrun',  lambda request: html_response(request, self.handle_resetpwdrun(request.params)))
+        router.add('POST', '/updatepwd',    lambda request: json_response(request, self.handle_updatepwd(request.params, request.cookies)))
+        router.add('POST', '/setheadimg',   lambda request: json_response(request, self.handle_setheadimg(request.params)))
+        router.add('POST', '/avatar',       lambda request: json_response(request, self.handle_uploadavatar(request.params, request)))
+        router.add('POST', '/batch/tokenlogin',     lambda request: self.route_batch_session(request, 'tokenlogin'))
+        router.add('POST', '/batch/getuserdata',    lambda request: self.route_batch_session(request, 'getuserdata'))
+        # 读取头像不记录请求日志
+        router.add('GET', self.avatar_prefix, self.handle_getavatar, prefix=True, log=False)
+        return router
+    
+    def json_response(self, request, result, status_code=200, cookies=None):
+        """处理结果转换为JSON响应，按客户端支持的编码压缩"""
+        encoding = self.compressor.negotiate(request.headers.get('accept-encoding'))
+        return self.create_response(result, status_code, cookies=cookies, keep_alive=request.keep_alive, encoding=encoding)
+    
+    def html_response(self, request, html_chunks):
+        """HTML页面转换为响应，按客户端支持的编码压缩"""
+        encoding = self.compressor.negotiate(request.headers.get('accept-encoding'))
+        return self.create_html_http_response(html_chunks, request.keep_alive, encoding)
+    
+    def route_login(self, request):
+        result, cookie_list = self.handle_login(request.params)
+        return self.json_response(request, result, cookies=cookie_list)
+    
+    def route_batch_session(self, request, kind):
+        result, status_code = self.handle_batch_session(request, kind)
+        return self.json_response(request, result, status_code)
+    
+    def handle_not_found(self, request):
+        """路径不存在"""
+        log_message(f"拒绝访问未允许的路径: {request.path} 来自 {request.addr}")
+        return self.create_response({"error": "Not found"}, 404, keep_alive=request.keep_alive)
+    
+    def handle_method_not_allowed(self, request):
+        """路径存在但不支持该方法"""
+        allow = ', '.join(self.router.allowed_methods(request.path) + ['OPTIONS'])
+        return self.create_response(
+            {"error": "Method not allowed"}, 405, keep_alive=request.keep_alive, headers=[f"Allow: {allow}"]
+        )
+    
+    def handle_bad_request(self, request):
+        """请求目标无法解析"""
+        return self.create_response({"error": "Invalid request"}, 400)
+    
+    def handle_request(self, request, addr, keep_alive=False):
+        """处理HTTP请求：在路由表中找到处理函数，经过中间件管道（指标、日志、CORS）执行"""
+        request.addr = addr
+        request.keep_alive = keep_alive
+        if request.parse():
+            request.route = self.router.match(request.method, request.path)
         else:
-            response = self.create_response({"error": "Not found"}, 404)
-        
-        # 记录响应信息
-        self.log_response(response, addr)
-        
-        return response
+            request.route = self.bad_request_route
+        return self.pipeline.handle(request, self.dispatch)
+    
+    @staticmethod
+    def dispatch(request):
+        return request.route.handler(request)
+
+class BlacklistMiddleware(Middleware):
+    """检测恶意请求，命中时把IP加入黑名单并直接关闭连接"""
+
+    name = 'blacklist'
+
+    def __init__(self, server):
+        self.server = server
+    
+    def before(self, request):
+        signature = self.server.is_malicious_request(request)
+        if signature:
+            log_message(f"检测到恶意请求来自 {request.addr} (特征: {signature}): {request.head[:100].decode('latin-1')}")
+            self.server.blacklisted_ips.add(request.addr[0], reason='malicious request')
+            raise DropConnection(signature)
+
+class RateLimitMiddleware(Middleware):
+    """按路径限流，OPTIONS预检请求和带内部服务密钥的请求不计数"""
+
+    name = 'rate_limit'
+
+    def __init__(self, server):
+        self.server = server
+    
+    def before(self, request):
+        server = self.server
+        client_ip = request.addr[0]
+        path = request.path
+        if (request.params is None or request.method == 'OPTIONS'
+                or server.account_service.is_internal_request(request)
+                or server.route_limiter.allow(client_ip, path)):
+            return None
+        log_message(f"IP {client_ip} 访问 {path} 过于频繁，已限制")
+        server.rate_limited_requests.inc((server.account_service.router.route_name(path),))
+        retry_after = server.route_limiter.retry_after(client_ip, path)
+        return server.account_service.create_response(
+            {"success": False, "message": "请求过于频繁，请稍后再试"},
+            429,
+            keep_alive=request.keep_alive,
+            headers=[f"Retry-After: {retry_after}"]
+        )
 
 class AccountServer:
     """账号服务器类"""
     
-    def __init__(self, host='0.0.0.0', port=810):
+    def __init__(self, host='0.0.0.0', port=810, listen_socket=None, shared_state=None, worker_index=None):
         self.host = host
         self.port = port
-        self.account_service = AccountService()
+        self.listen_socket = listen_socket      # 多进程模式下由主进程创建并共享的监听socket
+        self.shared_state = shared_state        # 多进程模式下共享的限流和黑名单状态
+        self.worker_index = worker_index
+        # 多进程模式下只由第一个工作进程清理过期数据
+        self.account_service = AccountService(shared_state, run_sweeper=not worker_index)
         self.ssl_enabled = configure._ssl_enable_
         self.ssl_crt_file = configure._ssl_crt_file_
         self.ssl_key_file = configure._ssl_key_file_
-        self.connection_tracker = {}        # 追踪连接
-        self.max_connections_per_ip = 20    # 每个IP最大连接数
+        self.ssl_handshake_timeout = getattr(configure, '_ssl_handshake_timeout_', 10)
+        self.ssl_num_tickets = getattr(configure, '_ssl_num_tickets_', 2)
+        self.ssl_context = None             # 所有连接共用同一个上下文 服务端会话缓存和会话票据才能生效
+        self.tls_stats = TlsHandshakeStats()
+        self.serve_mode = getattr(configure, '_serve_mode_', 'asyncio')
+        self.listen_backlog = getattr(configure, '_listen_backlog_', 1024)
+        self.executor_workers = getattr(configure, '_executor_workers_', 16)
+        self.max_pending_tasks = getattr(configure, '_max_pending_tasks_', 256)
+        self.executor = None                # 事件循环模式下执行数据库/邮件等阻塞任务的线程池
+        self.task_semaphore = None          # 限制同时排队/执行的阻塞任务数量
+        self.pending_tasks = 0              # 事件循环模式下已提交（含等待信号量）的请求数
+        self.worker_threads = getattr(configure, '_worker_threads_', 64)
+        self.admission_queue_size = getattr(configure, '_admission_queue_size_', 128)
+        self.overload_retry_after = getattr(configure, '_overload_retry_after_', 1)
+        self.drain_timeout = getattr(configure, '_drain_timeout_', 10)
+        self.connection_queue = None        # 线程模式下等待工作线程处理的连接
+        self.draining = False               # 正在关闭 不再接受新请求 长连接处理完当前请求后关闭
+        self.connections_lock = threading.Lock()
+        self.idle_connections = set()       # 正在等待下一个请求的连接（线程模式为socket 事件循环模式为任务）
+        self.connection_tasks = set()       # 事件循环模式下所有连接的处理任务
+        self.max_connections_per_ip = getattr(configure, '_max_connections_per_ip_', 20)  # 每个IP每分钟最大连接数
+        if shared_state is not None:
+            self.connection_limiter = SharedSlidingWindowRateLimiter(
+                shared_state, 'connection', self.max_connections_per_ip, 60
+            )
+        else:
+            self.connection_limiter = SlidingWindowRateLimiter(
+                self.max_connections_per_ip, 60,
+                max_keys=getattr(configure, '_rate_limit_max_keys_', 100000)
+            )
+        self.route_limiter = RouteRateLimiter(
+            getattr(configure, '_route_rate_limits_', {
+                '/login': (10, 60),
+                '/register': (5, 60),
+                '/resetpwd': (5, 60),
+                '/updatepwd': (10, 60),
+                '/avatar': (10, 60)
+            }),
+            getattr(configure, '_default_rate_limit_', (120, 60)),
+            max_keys=getattr(configure, '_rate_limit_max_keys_', 100000),
+            shared_state=shared_state
+        )
         self.connection_timeout = 30        # 连接超时秒数
-        self.blacklisted_ips = set()
-        self.suspicious_patterns = [
-            '/.env',
-            '/wp-admin',
-            '/phpmyadmin',
-            '/admin',
-            '/config',
-            '/debug',
-            '/test',
-            '/shell',
-            't3 12.1.2',   # WebLogic攻击
-            'miner1',      # 矿机连接
-            'jsonrpc'      # JSON-RPC攻击
-        ]
-    
-    def is_malicious_request(self, request_data, path):
-        """检测恶意请求"""
-        # 检查可疑路径
-        for pattern in self.suspicious_patterns:
-            if pattern in request_data or pattern in path:
-                return True
+        self.blacklisted_ips = IpBlacklist(
+            log_message,
+            snapshot_path=getattr(configure, '_blacklist_file_', 'blacklist.json'),
+            default_ttl=getattr(configure, '_blacklist_ttl_', 3600),
+            snapshot_interval=getattr(configure, '_blacklist_snapshot_interval_', 60),
+            shared_state=shared_state,
+            snapshot_owner=not worker_index     # 多进程模式下只由第一个工作进程保存快照
+        )
+        for network in getattr(configure, '_blacklist_static_', []):
+            self.blacklisted_ips.add(network, ttl=0, reason='static')
+        self.suspicious_patterns = RequestSignatureMatcher(
+            [
+                '/.env',
+                '/wp-admin',
+                '/phpmyadmin',
+                '/admin',
+                '/config',
+                '/debug',
+                '/test',
+                '/shell',
+                't3 12.1.2',   # WebLogic攻击
+                'miner1',      # 矿机连接
+                'jsonrpc'      # JSON-RPC攻击
+            ],
+            log_message,
+            signature_file=getattr(configure, '_signature_file_', 'signatures.txt'),
+            reload_interval=getattr(configure, '_signature_reload_interval_', 5)
+        )
         
-        # 检查异常请求方法
-        if ' HTTP/' not in request_data.split('\r\n')[0]:
-            return True
-        
-        return False
+        # 指标与账号服务共用同一个注册表 多进程模式下每个工作进程使用 端口+编号
+        metrics = self.account_service.metrics
+        self.active_connections = metrics.gauge('account_active_connections', '正在处理的连接数')
+        self.rejected_connections = metrics.counter(
+            'account_rejected_connections_total', '被拒绝的连接数', ('reason',))
+        self.rate_limited_requests = metrics.counter(
+            'account_rate_limited_requests_total', '因路径限流返回429的请求数', ('route',))
+        self.shed_requests = metrics.counter(
+            'account_shed_requests_total', '因服务器过载返回503的连接或请求数')
+        metrics.gauge('account_pending_work', '等待处理的连接数(线程模式)或请求数(事件循环模式)', callback=self.pending_work)
+        metrics.gauge('account_blacklist_entries', '黑名单条目数', callback=lambda: len(self.blacklisted_ips))
+        # 准入阶段的中间件 在接收请求的线程（事件循环模式下为事件循环）中执行 被拒绝的请求不占用工作线程
+        self.admission = MiddlewarePipeline(
+            [BlacklistMiddleware(self), RateLimitMiddleware(self)],
+            self.account_service.stage_seconds,
+            handler_stage=None
+        )
+        metrics_port = getattr(configure, '_metrics_port_', 0)
+        self.metrics_server = None
+        if metrics_port:
+            self.metrics_server = MetricsHttpServer(
+                metrics,
+                log_message,
+                host=getattr(configure, '_metrics_host_', '127.0.0.1'),
+                port=metrics_port + (worker_index or 0)
+            )
+    
+    def is_malicious_request(self, request):
+        """检测恶意请求，返回命中的特征，未命中返回None
+
+        请求行缺少 HTTP 版本的情况已由 HttpRequestReader 拒绝，这里只扫描特征。
+        请求头和内存中的请求体都要扫描（例如请求体中的JSON-RPC调用），
+        流式接收的请求体（上传的图片）不在内存中，不扫描
+        """
+        matcher = self.suspicious_patterns
+        return matcher.match(request.head) or (matcher.match(request.body) if request.body else None)
 
     def check_connection_rate(self, client_ip):
         """检查IP连接频率"""
-        current_time = time.time()
-        
-        # 清理过期记录
-        if client_ip in self.connection_tracker:
-            self.connection_tracker[client_ip] = [
-                ts for ts in self.connection_tracker[client_ip]
-                if current_time - ts < 60  # 只保留最近60秒的记录
-            ]
-        
-        # 添加当前连接
-        if client_ip not in self.connection_tracker:
-            self.connection_tracker[client_ip] = []
-        
-        self.connection_tracker[client_ip].append(current_time)
-        
-        # 检查是否超过限制
-        if len(self.connection_tracker[client_ip]) > self.max_connections_per_ip:
+        if not self.connection_limiter.allow(client_ip):
             log_message(f"IP {client_ip} 连接频率过高，已限制")
             return False
         
         return True
 
+    def create_request_reader(self):
+        """为新连接创建请求读取器"""
+        return HttpRequestReader(
+            max_header_size=8192, # 8KB限制
+            default_body_limit=8192,
+            body_limits=self.account_service.body_limits,
+            stream_paths=self.account_service.body_sinks
+        )
+    
+    def prepare_request(self, request, addr, requests_handled):
+        """解析请求、决定是否保持连接，并执行准入阶段的中间件（恶意请求检测、路径限流）
+
+        返回 (keep_alive, response)，response不为None时直接发送该响应而不再处理请求；
+        恶意请求抛出 DropConnection
+        """
+        request.addr = addr
+        # 流式请求体在准入检查之后才接收 请求被拒绝时剩余的请求体无法跳过 这类请求处理后关闭连接
+        request.keep_alive = (request.parse()
+                              and not request.stream_body
+                              and not self.draining
+                              and self.account_service.should_keep_alive(request)
+                              and requests_handled < keep_alive_max_requests_)
+        response = self.admission.handle(request, self.admit)
+        return request.keep_alive, response
+    
+    @staticmethod
+    def admit(request):
+        """准入检查全部通过 交给 AccountService 处理"""
+        return None
+    
+    def pending_work(self):
+        if self.connection_queue is not None:
+            return self.connection_queue.qsize()
+        return self.pending_tasks
+    
+    def overload_response(self, keep_alive=False):
+        """服务器过载时的503响应"""
+        return self.account_service.create_response(
+            {"success": False, "message": "服务器繁忙，请稍后再试"},
+            503,
+            keep_alive=keep_alive,
+            headers=[f"Retry-After: {self.overload_retry_after}"]
+        )
+    
+    def shed_connection(self, client_socket, addr):
+        """等待队列已满时拒绝连接（线程模式，在接受连接的线程中执行，不能阻塞）
+
+        未启用TLS时以非阻塞方式直接写入503响应；启用TLS时握手尚未进行，只能直接关闭连接。
+        """
+        self.shed_requests.inc()
+        log_message(f"等待队列已满，拒绝来自 {addr} 的连接")
+        try:
+            if not self.ssl_context:
+                client_socket.setblocking(False)
+                client_socket.send(b''.join(self.overload_response()))
+                client_socket.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        finally:
+            client_socket.close()
+    
+    def connection_worker(self):
+        """工作线程：从等待队列中取出连接并处理，开始关闭后退出"""
+        while not self.draining:
+            try:
+                client_socket, addr = self.connection_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self.handle_client(client_socket, addr)
+    
+    def receive(self, client_socket, reader):
+        """接收数据（线程模式），没有收到部分请求时的等待可被关闭流程中断"""
+        if reader.has_buffered_data():
+            return client_socket.recv(65536)
+        with self.connections_lock:
+            self.idle_connections.add(client_socket)
+        try:
+            if self.draining:
+                return b''
+            return client_socket.recv(65536)
+        finally:
+            with self.connections_lock:
+                self.idle_connections.discard(client_socket)
+    
+    def receive_body(self, client_socket, reader, request):
+        """验证请求后接收流式请求体写入 request.body_sink（线程模式），验证失败时返回错误响应
+
+        请求体接收完之前客户端断开时抛出 DropConnection，断开、超时或出错时立即删除未接收完的临时文件
+        """
+        response = self.account_service.open_body_sink(request)
+        if response is not None:
+            return response
+        sink = request.body_sink
+        complete = False
+        try:
+            while True:
+                data, complete = reader.read_body()
+                if data:
+                    sink.write(data)
+                if complete:
+                    return None
+                data = self.receive(client_socket, reader)
+                if not data:
+                    raise DropConnection("请求体未接收完")
+                reader.feed(data)
+        finally:
+            if not complete:
+                sink.discard()
+    
+    async def receive_body_async(self, reader, request_reader, request):
+        """验证请求后接收流式请求体写入 request.body_sink（事件循环模式），验证失败时返回错误响应
+
+        验证（数据库查询）、创建临时文件和写入文件都在线程池中执行，不阻塞事件循环。
+        请求体接收完之前客户端断开时抛出 DropConnection，断开、超时、出错或任务被取消时立即删除未接收完的临时文件
+        （线程池中正在进行的写入完成后才删除，见 AvatarUpload）
+        """
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(self.executor, self.account_service.open_body_sink, request)
+        if response is not None:
+            return response
+        sink = request.body_sink
+        complete = False
+        try:
+            while True:
+                data, complete = request_reader.read_body()
+                if data:
+                    await loop.run_in_executor(self.executor, sink.write, data)
+                if complete:
+                    return None
+                data = await asyncio.wait_for(reader.read(65536), timeout=self.connection_timeout)
+                if not data:
+                    raise DropConnection("请求体未接收完")
+                request_reader.feed(data)
+        finally:
+            if not complete:
+                sink.discard()
+    
+    def drain_threaded(self, workers):
+        """停止接受连接后等待工作线程处理完当前请求（线程模式）"""
+        self.draining = True
+        deadline = time.monotonic() + self.drain_timeout
+        # 还未开始处理的连接直接拒绝
+        while True:
+            try:
+                client_socket, addr = self.connection_queue.get_nowait()
+            except queue.Empty:
+                break
+            self.shed_connection(client_socket, addr)
+        # 中断正在等待下一个请求的长连接
+        with self.connections_lock:
+            idle = list(self.idle_connections)
+        for client_socket in idle:
+            try:
+                client_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for worker in workers:
+            worker.join(max(deadline - time.monotonic(), 0))
+        busy = sum(worker.is_alive() for worker in workers)
+        if busy:
+            log_message(f"等待超时，仍有 {busy} 个连接未处理完成", level='WARNING')
+        else:
+            log_message("所有连接已处理完成")
+    
+    def send_response(self, client_socket, response):
+        """发送响应字节块（线程模式）
+
+        普通socket使用 sendmsg 一次系统调用发送所有字节块；
+        TLS连接和不支持 sendmsg 的系统（Windows）拼接后发送。
+        """
+        if isinstance(client_socket, ssl.SSLSocket) or not hasattr(client_socket, 'sendmsg'):
+            client_socket.sendall(b''.join(response))
+            return
+        chunks = [memoryview(chunk) for chunk in response if chunk]
+        while chunks:
+            sent = client_socket.sendmsg(chunks)
+            # 只发送了一部分时 去掉已发送的字节块后继续
+            while chunks and sent >= len(chunks[0]):
+                sent -= len(chunks[0])
+                chunks.pop(0)
+            if sent:
+                chunks[0] = chunks[0][sent:]
+    
     def handle_client(self, client_socket, addr):
-        """处理客户端连接"""
+        """处理客户端连接（线程模式）"""
         client_ip = addr[0]
         
         # 检查黑名单
         if client_ip in self.blacklisted_ips:
             client_socket.close()
+            self.rejected_connections.inc(('blacklist',))
             return
         
         # 检查连接频率
         if not self.check_connection_rate(client_ip):
             client_socket.close()
-            self.blacklisted_ips.add(client_ip)
+            self.rejected_connections.inc(('rate_limit',))
+            self.blacklisted_ips.add(client_ip, reason='connection rate')
             log_message(f"IP {client_ip} 已被加入黑名单")
             return
         
+        # 在本连接的线程中完成TLS握手 慢速客户端不会阻塞接受连接的线程
+        if self.ssl_context:
+            client_socket = self.start_tls(client_socket, addr)
+            if client_socket is None:
+                return
+        
+        reader = self.create_request_reader()
+        requests_handled = 0
+        self.active_connections.inc()
         try:
             # 设置超时
             client_socket.settimeout(self.connection_timeout)
             
-            # 接收请求数据
-            request_data = client_socket.recv(8192).decode('utf-8', errors='ignore') # 8KB限制
-            if not request_data:
-                return
-            
-            # 检测恶意请求
-            method, path, params = self.account_service.parse_request(request_data)
-            if self.is_malicious_request(request_data, path or ''):
-                log_message(f"检测到恶意请求来自 {addr}: {request_data[:100]}")
-                self.blacklisted_ips.add(client_ip)
-                client_socket.close()
-                return
-            
-            # 处理请求
-            response = self.account_service.handle_request(request_data, addr)
-            
-            # 发送响应
+            while requests_handled < keep_alive_max_requests_:
+                # 接收请求数据 直到请求头和请求体完整
+                request = reader.next_request()
+                while request is None:
+                    data = self.receive(client_socket, reader)
+                    if not data:
+                        return
+                    reader.feed(data)
+                    request = reader.next_request()
+                
+                requests_handled += 1
+                try:
+                    keep_alive, response = self.prepare_request(request, addr, requests_handled)
+                    
+                    # 准入检查通过后才验证请求并接收流式请求体
+                    if response is None and request.stream_body:
+                        response = self.receive_body(client_socket, reader, request)
+                    
+                    # 处理请求
+                    if response is None:
+                        response = self.account_service.handle_request(request, addr, keep_alive)
+                finally:
+                    request.close()
+                
+                # 发送响应
+                try:
+                    self.send_response(client_socket, response)
+                except (BrokenPipeError, ConnectionResetError, socket.timeout) as e:
+                    log_message(f"发送响应到 {addr} 失败: {e}", level='ERROR')
+                    return
+                
+                if not keep_alive or self.draining:
+                    return
+                # 之后的请求使用长连接空闲超时
+                client_socket.settimeout(keep_alive_timeout_)
+        except HttpRequestError as e:
+            log_message(f"客户端 {addr} 请求无效: {e}")
+            if e.ban:
+                self.blacklisted_ips.add(client_ip, reason='malformed request')
             try:
-                client_socket.send(response)
-            except (BrokenPipeError, ConnectionResetError, socket.timeout) as e:
-                log_message(f"发送响应到 {addr} 失败: {e}")    
+                self.send_response(client_socket, self.account_service.create_response({"error": str(e)}, e.status_code))
+            except Exception:
+                pass
+        except DropConnection:
+            pass
         except socket.timeout:
-            log_message(f"客户端 {addr} 连接超时")
-        except UnicodeDecodeError as e:
-            log_message(f"客户端 {addr} 发送非UTF-8数据: {e}")
-            self.blacklisted_ips.add(client_ip)
+            if requests_handled == 0:
+                log_message(f"客户端 {addr} 连接超时")
         except Exception as e:
-            log_message(f"处理客户端 {addr} 请求时出错: {e}")
+            log_message(f"处理客户端 {addr} 请求时出错: {e}", level='ERROR')
         finally:
+            reader.close()
+            self.active_connections.dec()
             try:
                 client_socket.close()
             except:
                 pass
     
+    def start_tls(self, client_socket, addr):
+        """在工作线程中完成TLS握手（线程模式），失败时关闭连接并返回None"""
+        self.tls_stats.record_start()
+        start = time.perf_counter()
+        try:
+            tls_socket = self.ssl_context.wrap_socket(
+                client_socket, server_side=True, do_handshake_on_connect=False
+            )
+            tls_socket.settimeout(self.ssl_handshake_timeout)
+            tls_socket.do_handshake()
+        except socket.timeout:
+            self.tls_stats.record_failure(timeout=True)
+            log_message(f"客户端 {addr} TLS握手超时")
+            client_socket.close()
+            return None
+        except (ssl.SSLError, OSError) as e:
+            self.tls_stats.record_failure()
+            log_message(f"客户端 {addr} TLS握手失败: {e}", level='ERROR')
+            client_socket.close()
+            return None
+        
+        self.tls_stats.record(time.perf_counter() - start, tls_socket.session_reused)
+        return tls_socket
+    
+    async def handle_connection(self, reader, writer):
+        """处理客户端连接（事件循环模式，支持长连接和管线化请求）"""
+        addr = writer.get_extra_info('peername')
+        client_ip = addr[0]
+        
+        # 检查黑名单
+        if client_ip in self.blacklisted_ips:
+            writer.close()
+            self.rejected_connections.inc(('blacklist',))
+            return
+        
+        # 检查连接频率
+        if not self.check_connection_rate(client_ip):
+            writer.close()
+            self.rejected_connections.inc(('rate_limit',))
+            self.blacklisted_ips.add(client_ip, reason='connection rate')
+            log_message(f"IP {client_ip} 已被加入黑名单")
+            return
+        
+        log_message(f"接收到来自 {addr} 的连接")
+        
+        request_reader = self.create_request_reader()
+        requests_handled = 0
+        task = asyncio.current_task()
+        self.connection_tasks.add(task)
+        self.active_connections.inc()
+        try:
+            while requests_handled < keep_alive_max_requests_:
+                # 第一个请求使用连接超时 之后使用长连接空闲超时
+                timeout = self.connection_timeout if requests_handled == 0 else keep_alive_timeout_
+                
+                # 接收请求数据 管线化的后续请求会留在读取器的缓冲区中按顺序处理
+                request = request_reader.next_request()
+                while request is None:
+                    # 没有收到部分请求时 等待期间开始关闭会直接取消该任务
+                    idle = not request_reader.has_buffered_data()
+                    if idle:
+                        if self.draining:
+                            return
+                        self.idle_connections.add(task)
+                    try:
+                        data = await asyncio.wait_for(reader.read(65536), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        if requests_handled == 0:
+                            log_message(f"客户端 {addr} 连接超时")
+                        return
+                    finally:
+                        self.idle_connections.discard(task)
+                    if not data:
+                        # 客户端关闭了连接
+                        return
+                    request_reader.feed(data)
+                    request = request_reader.next_request()
+                
+                requests_handled += 1
+                try:
+                    keep_alive, response = self.prepare_request(request, addr, requests_handled)
+                    
+                    # 等待执行的请求过多时直接返回503 不再继续排队
+                    if response is None and self.pending_tasks >= self.max_pending_tasks + self.admission_queue_size:
+                        self.shed_requests.inc()
+                        response = self.overload_response(keep_alive)
+                    
+                    # 准入检查通过后才验证请求并接收流式请求体
+                    if response is None and request.stream_body:
+                        response = await self.receive_body_async(reader, request_reader, request)
+                    
+                    # 在线程池中处理请求 数据库和邮件操作不会阻塞事件循环
+                    if response is None:
+                        self.pending_tasks += 1
+                        try:
+                            async with self.task_semaphore:
+                                loop = asyncio.get_running_loop()
+                                response = await loop.run_in_executor(
+                                    self.executor,
+                                    self.account_service.handle_request,
+                                    request,
+                                    addr,
+                                    keep_alive
+                                )
+                        finally:
+                            self.pending_tasks -= 1
+                finally:
+                    request.close()
+                
+                # 发送响应
+                writer.writelines(response)
+                await asyncio.wait_for(writer.drain(), timeout=self.connection_timeout)
+                
+                if not keep_alive or self.draining:
+                    break
+        except HttpRequestError as e:
+            log_message(f"客户端 {addr} 请求无效: {e}")
+            if e.ban:
+                self.blacklisted_ips.add(client_ip, reason='malformed request')
+            writer.writelines(self.account_service.create_response({"error": str(e)}, e.status_code))
+            try:
+                await asyncio.wait_for(writer.drain(), timeout=self.connection_timeout)
+            except Exception:
+                pass
+        except DropConnection:
+            pass
+        except (BrokenPipeError, ConnectionResetError) as e:
+            log_message(f"发送响应到 {addr} 失败: {e}", level='ERROR')
+        except asyncio.TimeoutError:
+            log_message(f"发送响应到 {addr} 超时")
+        except Exception as e:
+            log_message(f"处理客户端 {addr} 请求时出错: {e}", level='ERROR')
+        finally:
+            request_reader.close()
+            self.active_connections.dec()
+            self.connection_tasks.discard(task)
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+    
+    def create_ssl_context(self):
+        """创建SSL上下文，未启用或配置失败时返回None"""
+        if not (self.ssl_enabled and self.ssl_crt_file and self.ssl_key_file):
+            return None
+        
+        try:
+            # 创建SSL上下文
+            context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            context.load_cert_chain(certfile=self.ssl_crt_file, keyfile=self.ssl_key_file)
+            
+            # 增强SSL配置
+            context.set_ciphers('HIGH:!aNULL:!eNULL:!MD5:!3DES:!CAMELLIA:!AES128')
+            context.minimum_version = ssl.TLSVersion.TLSv1_2
+            context.options |= ssl.OP_NO_COMPRESSION
+            context.options |= ssl.OP_SINGLE_DH_USE
+            context.options |= ssl.OP_SINGLE_ECDH_USE
+            
+            # 会话复用: TLS1.2 使用服务端会话缓存和会话票据 TLS1.3 使用会话票据
+            context.options &= ~ssl.OP_NO_TICKET
+            context.num_tickets = self.ssl_num_tickets
+            return context
+        except Exception as e:
+            log_message(f"SSL配置失败: {e}", level='ERROR')
+            return None
+    
+    async def serve_async(self):
+        """事件循环模式的服务主协程"""
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.executor_workers,
+            thread_name_prefix='account-worker'
+        )
+        self.task_semaphore = asyncio.Semaphore(self.max_pending_tasks)
+        
+        loop = asyncio.get_running_loop()
+        self.ssl_context = self.create_ssl_context()
+        
+        def protocol_factory():
+            # 与 asyncio.start_server 相同 另外记录TLS握手耗时
+            reader = asyncio.StreamReader(limit=2 ** 16, loop=loop)
+            return TlsTimingStreamProtocol(reader, self.handle_connection, self.tls_stats, loop=loop)
+        
+        # TLS握手由事件循环异步完成 不会阻塞其他连接
+        if self.listen_socket is not None:
+            address = {'sock': self.listen_socket}
+        else:
+            address = {'host': self.host, 'port': self.port, 'reuse_address': True}
+        server = await loop.create_server(
+            protocol_factory,
+            ssl=self.ssl_context,
+            ssl_handshake_timeout=self.ssl_handshake_timeout if self.ssl_context else None,
+            backlog=self.listen_backlog,
+            **address
+        )
+        
+        # 收到 SIGTERM/SIGINT 后停止接受连接并等待处理中的请求完成
+        # 不支持信号处理函数的系统（Windows）仍由 KeyboardInterrupt 直接结束
+        stop_event = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signum, stop_event.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        
+        protocol = 'https' if self.ssl_context else 'http'
+        log_message(f"账号服务器已启动 (事件循环模式, 线程池: {self.executor_workers})")
+        log_message(f"服务器地址: {protocol}://{self.host}:{self.port}")
+        
+        async with server:
+            await stop_event.wait()
+            log_message("服务器正在关闭...")
+            server.close()
+            await self.drain_async()
+    
+    async def drain_async(self):
+        """停止接受连接后等待处理中的请求完成（事件循环模式），超时后取消剩余连接"""
+        self.draining = True
+        for task in list(self.idle_connections):
+            task.cancel()
+        pending = set(self.connection_tasks)
+        if pending:
+            _, pending = await asyncio.wait(pending, timeout=self.drain_timeout)
+        if pending:
+            log_message(f"等待超时，仍有 {len(pending)} 个连接未处理完成", level='WARNING')
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending, timeout=1)
+        else:
+            log_message("所有连接已处理完成")
+    
     def start(self):
         """启动服务器"""
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.account_service.start()
+        self.blacklisted_ips.start()
+        if self.metrics_server:
+            self.metrics_server.start()
+        if self.serve_mode == 'thread':
+            self.start_threaded()
+        else:
+            self.start_asyncio()
+    
+    def start_asyncio(self):
+        """以事件循环模式启动服务器"""
+        try:
+            asyncio.run(self.serve_async())
+        except KeyboardInterrupt:
+            log_message("服务器正在关闭...")
+        except Exception as e:
+            log_message(f"服务器错误: {e}", level='ERROR')
+        finally:
+            self.close()
+    
+    def start_threaded(self):
+        """以线程池模式启动服务器
+
+        接受连接的线程只把连接放入有上限的等待队列，由固定数量的工作线程处理；
+        队列已满时返回503，不会无限制地创建线程。
+        """
+        if self.listen_socket is not None:
+            server_socket = self.listen_socket
+        else:
+            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         
         # 设置超时以避免永久阻塞
         server_socket.settimeout(5.0)  # 5秒超时
         
+        workers = []
         try:
-            server_socket.bind((self.host, self.port))
-            server_socket.listen(5)
+            if self.listen_socket is None:
+                server_socket.bind((self.host, self.port))
+                server_socket.listen(self.listen_backlog)
+            
+            # 如果启用SSL，TLS握手在工作线程中进行（见start_tls）
+            self.ssl_context = self.create_ssl_context()
+            self.connection_queue = queue.Queue(maxsize=self.admission_queue_size)
+            for index in range(self.worker_threads):
+                worker = threading.Thread(
+                    target=self.connection_worker,
+                    name=f'account-conn-{index}',
+                    daemon=True
+                )
+                worker.start()
+                workers.append(worker)
             
-            # 如果启用SSL，包装socket
-            if self.ssl_enabled and self.ssl_crt_file and self.ssl_key_file:
-                try:
-                    # 创建SSL上下文
-                    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-                    context.load_cert_chain(certfile=self.ssl_crt_file, keyfile=self.ssl_key_file)
-                    
-                    # 增强SSL配置
-                    context.set_ciphers('HIGH:!aNULL:!eNULL:!MD5:!3DES:!CAMELLIA:!AES128')
-                    context.minimum_version = ssl.TLSVersion.TLSv1_2
-                    context.options |= ssl.OP_NO_COMPRESSION
-                    context.options |= ssl.OP_SINGLE_DH_USE
-                    context.options |= ssl.OP_SINGLE_ECDH_USE
-
-                    # 包装socket
-                    server_socket = context.wrap_socket(server_socket, server_side=True)
-                    log_message(f"账号服务器已启动")
-                    log_message(f"服务器地址: https://{self.host}:{self.port}")
-                except Exception as e:
-                    log_message(f"SSL配置失败: {e}")
-                    log_message(f"账号服务器已启动")
-                    log_message(f"服务器地址: http://{self.host}:{self.port}")
-            else:
-                log_message(f"账号服务器已启动")
-                log_message(f"服务器地址: http://{self.host}:{self.port}")
+            protocol = 'https' if self.ssl_context else 'http'
+            log_message(f"账号服务器已启动 (线程模式, 工作线程: {self.worker_threads})")
+            log_message(f"服务器地址: {protocol}://{self.host}:{self.port}")
             
             while True:
                 try:
                     client_socket, addr = server_socket.accept()
                     log_message(f"接收到来自 {addr} 的连接")
                     
-                    # 为每个客户端创建新线程
-                    client_thread = threading.Thread(
-                        target=self.handle_client, 
-                        args=(client_socket, addr)
-                    )
-                    client_thread.daemon = True
-                    client_thread.start()
+                    try:
+                        self.connection_queue.put_nowait((client_socket, addr))
+                    except queue.Full:
+                        self.shed_connection(client_socket, addr)
                     
                 except socket.timeout:
                     # 超时是正常的，继续循环
                     continue
                 except Exception as e:
-                    log_message(f"接受客户端连接时出错: {e}")
+                    log_message(f"接受客户端连接时出错: {e}", level='ERROR')
                     continue
                     
         except KeyboardInterrupt:
             log_message("服务器正在关闭...")
         except Exception as e:
-            log_message(f"服务器错误: {e}")
+            log_message(f"服务器错误: {e}", level='ERROR')
         finally:
             server_socket.close()
-            log_file.close()
+            if workers:
+                self.drain_threaded(workers)
+            self.close()
+    
+    def close(self):
+        """停止后台任务并释放资源"""
+        if self.executor:
+            self.executor.shutdown(wait=False)
+        if self.metrics_server:
+            self.metrics_server.stop()
+        self.blacklisted_ips.stop()
+        log_message(f"恶意请求特征命中统计: {self.suspicious_patterns.stats()}")
+        if self.ssl_context:
+            log_message(f"TLS握手统计: {self.tls_stats.stats()}")
+        self.account_service.close()
+        log_message(f"日志统计: {logger.stats()}")
+        logger.stop()
+
+class AccountWorkerSupervisor(WorkerSupervisor):
+    """账号服务器的多进程主进程：工作进程运行 AccountServer，SIGHUP 时重新读取 configure.py"""
+
+    def __init__(self, host, port, workers):
+        super().__init__(
+            host, port, workers, log_message,
+            listen_backlog=getattr(configure, '_listen_backlog_', 1024),
+            shared_state_slots=getattr(configure, '_shared_state_slots_', 65536),
+            drain_timeout=getattr(configure, '_drain_timeout_', 10)
+        )
+        self.apply_worker_settings()
+    
+    def apply_worker_settings(self):
+        """每个工作进程有自己的密码哈希进程池 未配置时按工作进程数平分CPU核心"""
+        if not getattr(configure, '_hash_workers_', None):
+            configure._hash_workers_ = max(1, (os.cpu_count() or 1) // self.workers)
+    
+    def reload_config(self):
+        importlib.reload(configure)
+        apply_module_settings()
+        self.apply_worker_settings()
+        self.drain_timeout = getattr(configure, '_drain_timeout_', 10)
+    
+    def run_worker(self, index):
+        """工作进程入口"""
+        global logger
+        # 主进程的日志线程不会被fork 工作进程使用自己的日志文件
+        logger = create_logger(f'account-{index}', tag=f'w{index}')
+        try:
+            server = AccountServer(
+                host=self.host, port=self.port,
+                listen_socket=self.listen_socket,
+                shared_state=self.shared_state,
+                worker_index=index
+            )
+            server.start()
+        except Exception as e:
+            log_message(f"工作进程 {index} 出错: {e}", level='ERROR')
+            raise
+        finally:
+            logger.stop()
+    
+    def run(self):
+        try:
+            super().run()
+        finally:
+            logger.stop()
 
 def init_database():
-    """初始化数据库"""
+    """初始化数据库（按 PRAGMA user_version 只执行需要的结构迁移步骤）"""
     db_path = 'users_sqlite_3_py.db'
     
+    conn = None
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # 创建users表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                anonymous_user BOOLEAN DEFAULT 0,
-                email TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                name TEXT NOT NULL,
-                qq REAL DEFAULT 0,
-                theme_color TEXT DEFAULT 'rgba(255,255,255,1)',
-                head_img TEXT DEFAULT 'none',
-                token TEXT UNIQUE,
-                token_expiry INTEGER,
-                email_verified BOOLEAN DEFAULT 0,
-                verification_code TEXT,
-                code_expiry INTEGER,
-                resetpwd_code TEXT,
-                resetpwd_expiry INTEGER,
-                created_at INTEGER DEFAULT (strftime('%s', 'now')),
-                last_login INTEGER DEFAULT (strftime('%s', 'now'))
-            )
-        ''')
+        # isolation_level=None 时由 account_schema.migrate 显式控制事务
+        conn = sqlite3.connect(db_path, isolation_level=None)
         
-        # 创建索引以提高查询性能
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_email ON users(email)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_token ON users(token)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_verification_code ON users(verification_code)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_resetpwd_code ON users(resetpwd_code)')
+        # 使用WAL日志模式 读写互不阻塞（该设置会持久保存在数据库文件中）
+        conn.execute('PRAGMA journal_mode = WAL')
         
-        conn.commit()
-        log_message(f"数据库初始化成功")
+        account_schema.migrate(conn, log=log_message)
+        log_message(f"数据库初始化成功 (结构版本 {account_schema.get_schema_version(conn)})")
         log_message(f"数据文件: {db_path}")
         
-    except sqlite3.Error as e:
-        log_message(f"数据库初始化失败: {e}")
+    except (sqlite3.Error, account_schema.SchemaError) as e:
+        log_message(f"数据库初始化失败: {e}", level='ERROR')
     finally:
         if conn:
             conn.close()
 
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='账号服务器')
+    parser.add_argument('--workers', type=int, default=getattr(configure, '_workers_', 1),
+                        help='工作进程数量 大于1时以多进程模式运行 (默认: configure._workers_ 或 1)')
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_args()
     log_message(f"账号服务器将启动")
-    log_message(f"日志文件: {log_filename}")
+    log_message(f"日志目录: {os.path.abspath(logger.directory)}")
     
     # 初始化数据库
     init_database()
     
     # 启动服务器
-    server = AccountServer(host=configure._config_host_,port=configure._config_port_)
-    server.start()
\ No newline at end of file
+    if args.workers > 1 and hasattr(os, 'fork'):
+        AccountWorkerSupervisor(configure._config_host_, configure._config_port_, args.workers).run()
+    else:
+        if args.workers > 1:
+            log_message("当前系统不支持 os.fork，将以单进程模式运行", level='WARNING')
+        # SIGTERM 与 Ctrl+C 相同 停止接受连接并等待处理中的请求完成
+        signal.signal(signal.SIGTERM, WorkerSupervisor.raise_keyboard_interrupt)
+        server = AccountServer(host=configure._config_host_,port=configure._config_port_)
+        server.start()
\ No newline at end of file
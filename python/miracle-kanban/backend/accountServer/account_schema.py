@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/accountServer/account_schema.py
+# 账号数据库的表结构和版本迁移
+# account_main.py、database_init.py 和 database_version_migration.py 共用这里的建表语句。
+# 数据库的结构版本保存在 PRAGMA user_version 中，启动时只执行比当前版本新的迁移步骤，
+# 已是最新版本时只读取一次 user_version，与表中的数据量无关。
+# 此模块不依赖 configure
+
+# 修改表结构时：在 MIGRATIONS 末尾添加一个新版本的迁移函数（不要修改已发布的步骤），
+# 同时更新 EXPECTED_COLUMNS / COLUMN_DEFINITIONS 等，使新建的数据库直接是最新结构。
+
+# 查看数据库的结构版本
+# python account_schema.py --db-path users_sqlite_3_py.db
+
+import argparse
+import os
+import sqlite3
+
+# 表结构（列名和顺序）v1.0.2
+EXPECTED_COLUMNS = [
+    'id',                   # 0
+    'anonymous_user',       # 1
+    'email',                # 2
+    'password',             # 3
+    'name',                 # 4
+    'qq',                   # 5
+    'theme_color',          # 6
+    'head_img',             # 7
+    'token',                # 8
+    'token_expiry',         # 9
+    'email_verified',       # 10
+    'verification_code',    # 11
+    'code_expiry',          # 12
+    'resetpwd_code',        # 13
+    'resetpwd_expiry',      # 14
+    'created_at',           # 15
+    'last_login'            # 16
+]
+
+# 各列的定义
+COLUMN_DEFINITIONS = {
+    'id': 'INTEGER PRIMARY KEY AUTOINCREMENT',
+    'anonymous_user': 'BOOLEAN DEFAULT 0',
+    'email': 'TEXT UNIQUE NOT NULL',
+    'password': 'TEXT NOT NULL',
+    'name': 'TEXT NOT NULL',
+    'qq': 'REAL DEFAULT 0',
+    'theme_color': "TEXT DEFAULT 'rgba(255,255,255,1)'",
+    'head_img': "TEXT DEFAULT 'none'",
+    'token': 'TEXT UNIQUE',
+    'token_expiry': 'INTEGER',
+    'email_verified': 'BOOLEAN DEFAULT 0',
+    'verification_code': 'TEXT',
+    'code_expiry': 'INTEGER',
+    'resetpwd_code': 'TEXT',
+    'resetpwd_expiry': 'INTEGER',
+    'created_at': "INTEGER DEFAULT (strftime('%s', 'now'))",
+    'last_login': "INTEGER DEFAULT (strftime('%s', 'now'))"
+}
+
+# users表的索引
+USERS_INDEXES = [
+    # 创建索引以提高查询性能
+    'CREATE INDEX IF NOT EXISTS idx_email ON users(email)',
+    'CREATE INDEX IF NOT EXISTS idx_token ON users(token)',
+    'CREATE INDEX IF NOT EXISTS idx_verification_code ON users(verification_code)',
+    'CREATE INDEX IF NOT EXISTS idx_resetpwd_code ON users(resetpwd_code)',
+    # 过期数据清理使用的部分索引 只包含需要清理的行
+    'CREATE INDEX IF NOT EXISTS idx_code_expiry ON users(code_expiry) WHERE verification_code IS NOT NULL',
+    'CREATE INDEX IF NOT EXISTS idx_resetpwd_expiry ON users(resetpwd_expiry) WHERE resetpwd_code IS NOT NULL',
+    'CREATE INDEX IF NOT EXISTS idx_token_expiry ON users(token_expiry) WHERE token IS NOT NULL',
+    'CREATE INDEX IF NOT EXISTS idx_unverified_created_at ON users(created_at) WHERE email_verified = 0'
+]
+
+class SchemaError(Exception):
+    """数据库结构无法自动迁移（例如需要重建表，或数据库版本比程序新）"""
+
+def get_table_columns(conn:sqlite3.Connection, table_name:str='users'):
+    """获取表的列名（按顺序）"""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+
+def table_exists(conn:sqlite3.Connection, table_name:str):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table_name,)
+    ).fetchone() is not None
+
+def can_add_column(definition:str):
+    """该列能否用 ALTER TABLE ADD COLUMN 添加
+
+    SQLite 不允许添加 PRIMARY KEY/UNIQUE 列、默认值为表达式的列，以及没有默认值的 NOT NULL 列
+    """
+    upper = definition.upper()
+    if 'PRIMARY KEY' in upper or 'UNIQUE' in upper or 'DEFAULT (' in upper:
+        return False
+    if 'NOT NULL' in upper and 'DEFAULT' not in upper:
+        return False
+    return True
+
+def missing_columns_appendable(current_columns:list):
+    """当前列是否为预期列的前缀，且缺少的列都能直接添加（可以走 ADD COLUMN 快速路径）"""
+    if current_columns != EXPECTED_COLUMNS[:len(current_columns)]:
+        return False
+    return all(can_add_column(COLUMN_DEFINITIONS[col]) for col in EXPECTED_COLUMNS[len(current_columns):])
+
+def create_users_table(conn:sqlite3.Connection, table_name:str='users'):
+    """按预期结构创建users表（不含索引）"""
+    columns = ',\n            '.join(f"{col} {COLUMN_DEFINITIONS[col]}" for col in EXPECTED_COLUMNS)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            {columns}
+        )
+    ''')
+
+def create_users_indexes(conn:sqlite3.Connection):
+    """创建users表的全部索引"""
+    for sql in USERS_INDEXES:
+        conn.execute(sql)
+
+# ---- 迁移步骤 ----
+# 每个步骤把数据库从上一个版本升级到该版本，和设置 user_version 在同一事务中执行。
+# user_version 为 0 的数据库可能是新建的，也可能是引入版本号之前创建的，所以前几个步骤都是幂等的。
+
+def migrate_v1_users(conn:sqlite3.Connection):
+    """users表（v1.0.2 的列）和基本索引"""
+    if not table_exists(conn, 'users'):
+        create_users_table(conn)
+    else:
+        current_columns = get_table_columns(conn)
+        if current_columns != EXPECTED_COLUMNS:
+            if not missing_columns_appendable(current_columns):
+                raise SchemaError(
+                    f"users表的列 {current_columns} 需要重建表才能迁移，请先运行 database_version_migration.py"
+                )
+            # 只在末尾缺少列时直接添加 不复制数据
+            for col in EXPECTED_COLUMNS[len(current_columns):]:
+                conn.execute(f"ALTER TABLE users ADD COLUMN {col} {COLUMN_DEFINITIONS[col]}")
+    for sql in USERS_INDEXES[:4]:
+        conn.execute(sql)
+
+def migrate_v2_email_outbox(conn:sqlite3.Connection):
+    """邮件发件箱表"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            kind TEXT,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at INTEGER DEFAULT (strftime('%s', 'now')),
+            last_error TEXT,
+            created_at INTEGER DEFAULT (strftime('%s', 'now')),
+            sent_at INTEGER
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_due ON email_outbox(status, next_attempt_at)')
+
+def migrate_v3_expiry_indexes(conn:sqlite3.Connection):
+    """过期数据清理使用的部分索引"""
+    for sql in USERS_INDEXES[4:]:
+        conn.execute(sql)
+
+# 迁移步骤注册表 (版本号, 说明, 迁移函数)，版本号从1开始连续递增
+MIGRATIONS = [
+    (1, 'users表和基本索引', migrate_v1_users),
+    (2, '邮件发件箱表', migrate_v2_email_outbox),
+    (3, '过期数据清理索引', migrate_v3_expiry_indexes),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn:sqlite3.Connection):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn:sqlite3.Connection, log=print):
+    """把数据库升级到 SCHEMA_VERSION，返回执行的步骤列表 [(版本号, 说明)]
+
+    连接需要使用 isolation_level=None，每个步骤在单独的 BEGIN IMMEDIATE 事务中执行，
+    中途失败时已完成的步骤保留，出错的步骤整体回滚。多个进程同时调用时只有一个会执行迁移。
+    """
+    if conn.isolation_level is not None:
+        raise ValueError("migrate() 需要使用 isolation_level=None 的连接")
+    version = get_schema_version(conn)
+    if version > SCHEMA_VERSION:
+        raise SchemaError(f"数据库结构版本 {version} 比程序支持的版本 {SCHEMA_VERSION} 新，请更新程序")
+    applied = []
+    for target, description, step in MIGRATIONS:
+        if target <= version:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # 取得写锁后重新读取版本 其他进程可能已经完成了这一步
+            if get_schema_version(conn) >= target:
+                conn.execute('COMMIT')
+                continue
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {target}")
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        log(f"数据库结构已升级到版本 {target}: {description}")
+        applied.append((target, description))
+    return applied
+
+def main():
+    parser = argparse.ArgumentParser(description='查看账号数据库的结构版本')
+    parser.add_argument('--db-path', default='users_sqlite_3_py.db', help='数据库文件路径')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db_path):
+        print(f"数据库文件 {args.db_path} 不存在")
+        return
+    conn = sqlite3.connect(args.db_path)
+    try:
+        version = get_schema_version(conn)
+    finally:
+        conn.close()
+    print(f"数据库结构版本: {version}, 程序支持的版本: {SCHEMA_VERSION}")
+    for target, description, _ in MIGRATIONS:
+        print(f"  {'已完成' if target <= version else '待执行'} {target}: {description}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/accountServer/avatar_store.py
+# 头像存储
+# 头像图片按内容的SHA-256保存为文件，相同的图片只保存一份，
+# 数据库的 head_img 列只保存 "哈希.扩展名"，登录等接口返回的用户数据不再携带图片内容
+# 此模块不依赖 configure
+
+# 把数据库中旧的 base64 头像转存为文件（先停止账号服务器）
+# python avatar_store.py --migrate
+# python avatar_store.py --migrate --db-path /path/to/users_sqlite_3_py.db --dir avatars
+
+import argparse
+import base64
+import binascii
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# 扩展名 -> Content-Type
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'gif': 'image/gif',
+    'webp': 'image/webp'
+}
+
+# 文件名 "64位十六进制哈希.扩展名"
+NAME_PATTERN = re.compile(r'[0-9a-f]{64}\.(?:png|jpg|gif|webp)')
+
+def detect_image_type(header):
+    """根据文件头识别图片格式，返回扩展名，不是支持的图片时返回None"""
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if header.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+def is_avatar_name(value):
+    """是否为头像存储中的文件名（而不是旧的 base64 数据或 'none'）"""
+    return bool(value) and NAME_PATTERN.fullmatch(value) is not None
+
+class AvatarUpload:
+    """正在接收的头像上传
+
+    请求体边接收边写入临时文件并计算哈希，内存中只保留文件头用于识别格式。
+    commit() 后临时文件移动到存储目录，未提交的上传调用 discard() 删除临时文件。
+    写入可能在线程池中进行，而连接断开时 discard() 在其他线程中调用，各方法持有同一把锁，
+    discard() 会等正在进行的写入完成后再删除文件；已删除后的写入直接忽略。
+    """
+
+    HEADER_SIZE = 16
+
+    def __init__(self, store):
+        self.store = store
+        fd, self.temp_path = tempfile.mkstemp(suffix='.part', dir=store.temp_dir)
+        self.file = os.fdopen(fd, 'wb')
+        self.hasher = hashlib.sha256()
+        self.header = b''
+        self.received = 0
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        with self.lock:
+            if self.temp_path is None:
+                return
+            if len(self.header) < self.HEADER_SIZE:
+                self.header += bytes(data[:self.HEADER_SIZE - len(self.header)])
+            self.hasher.update(data)
+            self.file.write(data)
+            self.received += len(data)
+
+    def commit(self):
+        """保存上传的图片，返回文件名，不是支持的图片格式或已删除时返回None"""
+        with self.lock:
+            if self.temp_path is None:
+                return None
+            self.file.close()
+            extension = detect_image_type(self.header)
+            if extension is None:
+                self.remove_temp_file()
+                return None
+            name = f"{self.hasher.hexdigest()}.{extension}"
+            self.store.save_file(self.temp_path, name)
+            self.temp_path = None
+            return name
+
+    def discard(self):
+        """删除临时文件，已提交或已删除时不做任何事"""
+        with self.lock:
+            self.remove_temp_file()
+
+    def remove_temp_file(self):
+        """关闭并删除临时文件（调用方需持有锁）"""
+        if self.temp_path is None:
+            return
+        self.file.close()
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+        self.temp_path = None
+
+class AvatarStore:
+    """按内容哈希寻址的头像文件存储
+
+    文件保存在 directory/哈希前两位/哈希.扩展名，写入时先写临时文件再重命名，
+    读取时不会看到写了一半的文件。图片内容不会改变，读取结果按LRU缓存在内存中，
+    缓存总字节数不超过 cache_bytes。
+    """
+
+    def __init__(self, directory='avatars', cache_bytes=16 * 1024 * 1024):
+        self.directory = directory
+        self.temp_dir = os.path.join(directory, 'tmp')
+        self.cache_bytes = cache_bytes
+        self.cache = OrderedDict()      # 文件名 -> 图片内容
+        self.cached_bytes = 0
+        self.lock = threading.Lock()
+        os.makedirs(self.temp_dir, exist_ok=True)
+        self.remove_stale_uploads()
+
+    def remove_stale_uploads(self, max_age=3600):
+        """删除进程异常退出时遗留的临时文件（其他进程可能正在上传，只删除较旧的文件）"""
+        now = time.time()
+        for entry in os.scandir(self.temp_dir):
+            try:
+                if entry.name.endswith('.part') and now - entry.stat().st_mtime > max_age:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def path(self, name):
+        return os.path.join(self.directory, name[:2], name)
+
+    def begin_upload(self):
+        """开始接收一个上传，返回 AvatarUpload"""
+        return AvatarUpload(self)
+
+    def save_file(self, temp_path, name):
+        """把临时文件移动到存储位置，相同内容的文件已存在时直接删除临时文件"""
+        path = self.path(name)
+        if os.path.exists(path):
+            os.remove(temp_path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+    def put(self, data):
+        """保存图片内容，返回文件名，不是支持的图片格式时返回None"""
+        upload = self.begin_upload()
+        try:
+            upload.write(data)
+            return upload.commit()
+        finally:
+            upload.discard()
+
+    def get(self, name):
+        """读取图片，返回 (内容, Content-Type)，不存在时返回None"""
+        if not is_avatar_name(name):
+            return None
+        content_type = CONTENT_TYPES[name.rsplit('.', 1)[1]]
+        with self.lock:
+            data = self.cache.get(name)
+            if data is not None:
+                self.cache.move_to_end(name)
+                return data, content_type
+        try:
+            with open(self.path(name), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) <= self.cache_bytes // 4:
+            with self.lock:
+                if name not in self.cache:
+                    self.cache[name] = data
+                    self.cached_bytes += len(data)
+                while self.cached_bytes > self.cache_bytes:
+                    _, evicted = self.cache.popitem(last=False)
+                    self.cached_bytes -= len(evicted)
+        return data, content_type
+
+def decode_data_uri(value):
+    """解码 data:image/...;base64, 格式的图片，格式不正确时返回None"""
+    header, sep, payload = value.partition(',')
+    if not sep or not header.startswith('data:image/') or not header.endswith(';base64'):
+        return None
+    try:
+        return base64.b64decode(payload, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+
+def migrate_inline_avatars(db_path, store):
+    """把 head_img 中的 base64 图片转存到头像存储，返回 (转存数量, 无法识别的数量)"""
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT id, head_img FROM users WHERE head_img LIKE 'data:image/%'").fetchall()
+        migrated = invalid = 0
+        for user_id, head_img in rows:
+            data = decode_data_uri(head_img)
+            name = store.put(data) if data else None
+            if name is None:
+                print(f"  用户 {user_id} 的头像无法识别，已跳过")
+                invalid += 1
+                continue
+            conn.execute("UPDATE users SET head_img = ? WHERE id = ?", (name, user_id))
+            migrated += 1
+        conn.commit()
+        return migrated, invalid
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='头像存储工具')
+    parser.add_argument('--migrate', action='store_true', help='把数据库中的 base64 头像转存为文件')
+    parser.add_argument('--db-path', default='users_sqlite_3_py.db', help='数据库文件路径')
+    parser.add_argument('--dir', default='avatars', help='头像存储目录')
+    args = parser.parse_args()
+
+    if not args.migrate:
+        parser.print_help()
+        return
+    if not os.path.exists(args.db_path):
+        print(f"数据库文件 {args.db_path} 不存在")
+        return
+    migrated, invalid = migrate_inline_avatars(args.db_path, AvatarStore(args.dir))
+    print(f"转存完成: 成功 {migrated}, 跳过 {invalid}")
+
+if __name__ == '__main__':
+    main()
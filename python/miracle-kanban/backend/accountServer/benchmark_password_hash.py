@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/accountServer/benchmark_password_hash.py
+# 密码哈希微基准测试 统计不同代价参数下每秒可完成的登录验证次数
+# 用于调整 configure.py 中的 _password_hasher_ / _scrypt_n_ / _pbkdf2_iterations_ / _hash_workers_
+
+# 1.使用默认参数测试（进程数为CPU核心数，每项测试3秒）
+# python benchmark_password_hash.py
+
+# 2.指定进程数和每项测试时长
+# python benchmark_password_hash.py --workers 4 --seconds 5
+
+# 3.只测试 scrypt 的指定代价
+# python benchmark_password_hash.py --scrypt-n 8192 16384 32768 --pbkdf2-iterations
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import password_hasher
+
+def build_settings(args):
+    """生成需要测试的 (名称, 算法, 参数) 列表"""
+    settings = [('sha256 (旧版)', 'sha256', {})]
+    for n in args.scrypt_n:
+        settings.append((f'scrypt n={n} r=8 p=1', 'scrypt', {'n': n, 'r': 8, 'p': 1}))
+    for iterations in args.pbkdf2_iterations:
+        settings.append((f'pbkdf2_sha256 iterations={iterations}', 'pbkdf2_sha256', {'iterations': iterations}))
+    return settings
+
+def run_setting(executor, workers, algorithm, params, seconds):
+    """在进程池中持续验证密码，返回 (单次耗时毫秒, 每秒登录数)"""
+    password = 'benchmark-password'
+    encoded = password_hasher.hash_password(password, algorithm, params)
+
+    # 单次验证耗时
+    start = time.perf_counter()
+    assert password_hasher.verify_password(password, encoded)
+    single_ms = (time.perf_counter() - start) * 1000
+
+    # 保持每个进程都有任务 统计吞吐量
+    completed = 0
+    pending = [executor.submit(password_hasher.verify_password, password, encoded) for _ in range(workers * 2)]
+    start = time.perf_counter()
+    deadline = start + seconds
+    while pending:
+        future = pending.pop(0)
+        assert future.result()
+        completed += 1
+        if time.perf_counter() < deadline:
+            pending.append(executor.submit(password_hasher.verify_password, password, encoded))
+    elapsed = time.perf_counter() - start
+    return single_ms, completed / elapsed
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='密码哈希微基准测试')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                       help='进程池大小 (默认: CPU核心数)')
+    parser.add_argument('--seconds', type=float, default=3.0,
+                       help='每项测试持续的秒数 (默认: 3)')
+    parser.add_argument('--scrypt-n', type=int, nargs='*', default=[4096, 8192, 16384, 32768],
+                       help='需要测试的 scrypt n 参数')
+    parser.add_argument('--pbkdf2-iterations', type=int, nargs='*', default=[100000, 300000, 600000],
+                       help='需要测试的 PBKDF2 迭代次数')
+
+    args = parser.parse_args()
+
+    print(f"进程数: {args.workers}, 每项测试: {args.seconds}秒")
+    print("-" * 72)
+    print(f"{'算法和代价':<40} {'单次耗时(ms)':>14} {'登录/秒':>14}")
+    print("-" * 72)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for name, algorithm, params in build_settings(args):
+            single_ms, per_second = run_setting(executor, args.workers, algorithm, params, args.seconds)
+            print(f"{name:<40} {single_ms:>14.2f} {per_second:>14.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -14,7 +14,116 @@ _sender_email_ = 'noreply@yoursite.com'         # 发送给用户时用的电子
 _sender_password_ = 'your_email_password'       # 密码
 _server_url_ = 'https://login.site.com:810'     # 本账号服务器的地址
 
+# 内部服务调用相关配置（象棋服务器等通过 /batch/tokenlogin 和 /batch/getuserdata 批量验证token）
+_internal_secret_ = ''                          # 内部服务密钥 请求头 X-Internal-Secret 需与此一致 为空时不开放批量接口
+_batch_max_items_ = 500                         # 每次批量请求最多包含的 (user_id, token) 数量
+
 # ssl 相关配置
 _ssl_enable_ = False                            # 是否启用 ssl
 _ssl_crt_file_ = ''                             # crt 证书文件地址 请确保证书拥有完整的证书链
-_ssl_key_file_ = ''                             # key 密钥文件地址
\ No newline at end of file
+_ssl_key_file_ = ''                             # key 密钥文件地址
+_ssl_handshake_timeout_ = 10                    # TLS握手超时秒数
+_ssl_num_tickets_ = 2                           # TLS1.3 每次握手下发的会话票据数量 用于客户端复用会话
+
+# 服务模式相关配置
+_workers_ = 1                                   # 工作进程数 大于1时以多进程模式运行(仅Linux/macOS) 也可用命令行参数 --workers N 指定
+_shared_state_slots_ = 65536                    # 多进程模式下共享限流/黑名单状态表的槽位数 每个槽位48字节
+_serve_mode_ = 'asyncio'                        # 服务模式 asyncio(事件循环，推荐) 或 thread(每个连接一个线程)
+_listen_backlog_ = 1024                         # 监听队列长度
+_executor_workers_ = 16                         # 执行数据库和邮件等阻塞任务的线程数
+_max_pending_tasks_ = 256                       # 同时排队或执行的阻塞任务上限
+_worker_threads_ = 64                           # 线程模式下处理连接的工作线程数
+_admission_queue_size_ = 128                    # 等待队列长度 线程模式为等待工作线程的连接数 事件循环模式为超出 _max_pending_tasks_ 后可继续等待的请求数 队列满时返回503
+_overload_retry_after_ = 1                      # 返回503时 Retry-After 头的秒数
+_drain_timeout_ = 10                            # 收到 SIGTERM 后等待处理中的请求完成的最长秒数
+_keep_alive_timeout_ = 15                       # 长连接空闲超时秒数
+_keep_alive_max_requests_ = 100                 # 每个长连接最多处理的请求数
+_headimg_body_limit_ = 2 * 1024 * 1024          # 设置头像请求体的最大字节数
+
+# 数据库相关配置
+_db_pool_size_ = 16                             # 数据库连接池大小 建议不小于 _executor_workers_
+_db_statement_cache_ = 128                      # 每个连接缓存的预编译语句数量
+_db_busy_timeout_ = 5.0                         # 等待数据库锁或空闲连接的超时秒数
+
+# 会话缓存相关配置
+_session_cache_size_ = 10000                    # 缓存的 (user_id, token) 会话数量上限
+_session_cache_ttl_ = 60                        # 会话缓存有效秒数（不会超过token本身的有效期）
+
+# 邮件发件箱相关配置
+_smtp_use_ssl_ = True                           # 是否使用 SMTP_SSL 连接 本地测试用的SMTP服务可设为 False
+_smtp_starttls_ = False                         # 不使用SSL连接时是否执行 STARTTLS
+_smtp_timeout_ = 10                             # SMTP 连接超时秒数
+_smtp_idle_timeout_ = 30                        # SMTP 连接空闲多少秒后关闭
+_email_batch_size_ = 20                         # 每批发送的邮件数量
+_email_max_attempts_ = 5                        # 每封邮件最多尝试发送的次数
+_email_retry_base_ = 30                         # 首次重试等待秒数 之后每次翻倍
+_email_retry_max_ = 3600                        # 重试等待秒数上限
+_email_lease_seconds_ = 120                     # 邮件取出后未完成发送时 重新发送前的等待秒数
+_email_poll_interval_ = 5                       # 后台线程检查发件箱的间隔秒数
+
+# 过期数据清理相关配置（多进程模式下只在第一个工作进程中运行）
+_sweep_interval_ = 300                          # 清理过期激活码/重置码/token的间隔秒数 0表示不在服务器中清理
+_sweep_batch_size_ = 200                        # 每批清理的行数 批次越小占用数据库写锁的时间越短
+_sweep_batch_pause_ = 0.05                      # 两批之间的停顿秒数
+_inactive_account_ttl_ = 0                      # 注册后多少秒仍未激活的账户会被删除 例如 86400 0表示不删除（删除账户不可恢复 需要时再开启）
+
+# 数据库定时备份相关配置（多进程模式下只在第一个工作进程中运行 也可手动运行 database_online_backup.py）
+_backup_interval_ = 0                           # 定时在线备份的间隔秒数 例如 86400 0表示不在服务器中备份
+_backup_dir_ = 'database_backup'                # 备份目录
+_backup_keep_ = 7                               # 只保留最近的多少份备份 0表示全部保留
+_backup_compress_ = True                        # 是否使用gzip压缩备份文件
+_backup_pages_ = 256                            # 每批复制的数据库页数 批次越小占用数据库锁的时间越短
+_backup_sleep_ = 0.01                           # 两批之间的停顿秒数
+
+# 密码哈希相关配置（可用 benchmark_password_hash.py 测试不同代价下的每秒登录数）
+_password_hasher_ = 'scrypt'                    # 密码哈希算法 scrypt 或 pbkdf2_sha256
+_scrypt_n_ = 16384                              # scrypt CPU/内存代价 必须是2的幂
+_scrypt_r_ = 8                                  # scrypt 块大小
+_scrypt_p_ = 1                                  # scrypt 并行度
+_pbkdf2_iterations_ = 600000                    # PBKDF2 迭代次数
+_hash_workers_ = None                           # 密码哈希进程数 None 表示CPU核心数
+_hash_max_queue_ = 64                           # 等待哈希计算的请求数上限 超出时返回服务器繁忙
+_hash_wait_timeout_ = 10                        # 排队等待哈希计算的最长秒数
+
+# 限流相关配置
+_max_connections_per_ip_ = 20                   # 每个IP每分钟最大连接数 超出后加入黑名单
+_route_rate_limits_ = {                         # 各路径每个IP的限额 (次数, 窗口秒数)
+    '/login': (10, 60),
+    '/register': (5, 60),
+    '/resetpwd': (5, 60),
+    '/updatepwd': (10, 60),
+    '/avatar': (10, 60)
+}
+_default_rate_limit_ = (120, 60)                # 未单独配置的路径的限额 (次数, 窗口秒数)
+_rate_limit_max_keys_ = 100000                  # 限流器最多记录的IP数量 超出时淘汰最久未访问的IP
+_blacklist_ttl_ = 3600                          # 自动加入黑名单的IP封禁秒数 0表示永久
+_blacklist_file_ = 'blacklist.json'             # 黑名单快照文件 重启后自动恢复
+_blacklist_snapshot_interval_ = 60              # 清理过期条目并保存快照的间隔(秒)
+_blacklist_static_ = [                          # 永久封禁的IP或网段 支持CIDR 例如 '203.0.113.0/24'
+]
+_signature_file_ = 'signatures.txt'             # 额外的恶意请求特征文件 每行一条 #开头为注释 不存在时只使用内置特征
+_signature_reload_interval_ = 5                 # 检查特征文件是否修改的间隔(秒) 修改后自动重新加载
+
+# 日志相关配置
+_log_dir_ = 'logs'                              # 日志目录 日志文件为每行一个JSON对象
+_log_level_ = 'INFO'                            # 日志级别 DEBUG | INFO | WARNING | ERROR
+_log_max_bytes_ = 10 * 1024 * 1024              # 单个日志文件最大字节数 超出后切换新文件
+_log_rotate_interval_ = 86400                   # 每隔多少秒切换新日志文件
+_log_backup_count_ = 30                         # 保留的日志文件数量
+_log_queue_size_ = 10000                        # 日志队列长度 写入跟不上时丢弃日志并计数 不阻塞请求处理
+
+# 监控指标相关配置
+_metrics_port_ = 0                              # /metrics 指标服务端口(Prometheus文本格式) 0表示不启用 多进程模式下第N个工作进程使用 端口+N
+_metrics_host_ = '127.0.0.1'                    # 指标服务监听地址 只建议绑定本机
+
+# 响应压缩相关配置
+_compression_enable_ = True                     # 是否根据 Accept-Encoding 使用 gzip/deflate 压缩响应
+_compression_min_size_ = 512                    # 响应体达到多少字节才压缩 可根据 /metrics 中的压缩率和CPU耗时调整
+_compression_level_ = 6                         # 压缩级别 1(最快)-9(最小)
+
+# 头像存储相关配置（旧的 base64 头像可用 python avatar_store.py --migrate 转存）
+_avatar_dir_ = 'avatars'                        # 头像文件目录 文件名为图片内容的SHA-256 相同图片只保存一份
+_avatar_max_bytes_ = 2 * 1024 * 1024            # POST /avatar 上传的图片最大字节数
+_avatar_cache_bytes_ = 16 * 1024 * 1024         # 内存中缓存的头像总字节数
+_avatar_max_age_ = 31536000                     # GET /avatar/ 响应的 Cache-Control max-age 秒数
+_avatar_base_url_ = ''                          # 返回给客户端的头像地址前缀 为空时使用 _server_url_ + '/avatar/'
@@ -18,33 +18,22 @@
 # 5.自定义数据库路径
 # python database_clean_inactive_accounts.py --db-path /path/to/your/database.db --hours 48 --execute
 
+# 6.分批删除，每批 200 个，批次之间停顿 0.1 秒（账号服务器运行时也可以执行）
+# python database_clean_inactive_accounts.py --hours 24 --execute --batch-size 200 --pause 0.1
+
+# 7.后台定时清理，每小时执行一次
+# python database_clean_inactive_accounts.py --hours 24 --execute --daemon --interval 3600
+
 import sqlite3
 import time
 import os
 import argparse
 import logging
+import signal
+import threading
 from datetime import datetime
-
-# 表结构（列名和顺序）v1.0.2
-EXPECTED_COLUMNS = [
-    'id',                   # 0
-    'anonymous_user',       # 1
-    'email',                # 2
-    'password',             # 3
-    'name',                 # 4
-    'qq',                   # 5
-    'theme_color',          # 6
-    'head_img',             # 7
-    'token',                # 8
-    'token_expiry',         # 9
-    'email_verified',       # 10
-    'verification_code',    # 11
-    'code_expiry',          # 12
-    'resetpwd_code',        # 13
-    'resetpwd_expiry',      # 14
-    'created_at',           # 15
-    'last_login'            # 16
-]
+import account_schema
+from account_schema import EXPECTED_COLUMNS
 
 # 配置日志
 def setup_logging():
@@ -68,13 +57,16 @@ def setup_logging():
 class AccountCleaner:
     """账户清理器"""
     
-    def __init__(self, db_path='users_sqlite_3_py.db'):
+    def __init__(self, db_path='users_sqlite_3_py.db', batch_size=500, pause=0.05):
         self.db_path = db_path
+        self.batch_size = batch_size    # 每批删除的账户数 批次越小占用数据库写锁的时间越短
+        self.pause = pause              # 两批之间的停顿秒数 让账号服务器的写入可以进行
         self.logger = setup_logging()
+        self.stop_event = threading.Event()
     
     def get_connection(self):
-        """获取数据库连接"""
-        return sqlite3.connect(self.db_path)
+        """获取数据库连接（账号服务器正在写入时最多等待5秒）"""
+        return sqlite3.connect(self.db_path, timeout=5)
     
     def execute_query(self, query, params=None):
         """执行查询"""
@@ -94,6 +86,21 @@ class AccountCleaner:
         finally:
             conn.close()
     
+    def check_schema(self):
+        """检查数据库结构版本和users表的列是否与 account_schema 一致，返回错误信息，一致时返回None"""
+        conn = self.get_connection()
+        try:
+            version = account_schema.get_schema_version(conn)
+            columns = account_schema.get_table_columns(conn)
+        finally:
+            conn.close()
+        if version != account_schema.SCHEMA_VERSION:
+            return (f"数据库结构版本 {version} 与程序支持的版本 {account_schema.SCHEMA_VERSION} 不一致，"
+                    f"请先运行 database_init.py 或 database_version_migration.py")
+        if columns != EXPECTED_COLUMNS:
+            return f"users表的列 {columns} 与预期不一致，请先运行 database_version_migration.py"
+        return None
+    
     def format_duration(self, seconds):
         """将秒数格式化为可读的时间字符串"""
         if seconds < 60:
@@ -171,6 +178,10 @@ class AccountCleaner:
         duration_str = self.format_duration(seconds_threshold)
         self.logger.info(f"开始清理未激活账户 (试运行: {dry_run}, 阈值: {duration_str})")
         
+        # 实际删除时不预先读出全部账户，直接分批删除
+        if not dry_run:
+            return self.delete_inactive_accounts(seconds_threshold)
+        
         # 获取未激活账户
         inactive_accounts = self.get_inactive_accounts(seconds_threshold)
         
@@ -181,60 +192,92 @@ class AccountCleaner:
         # 显示账户信息
         self.display_inactive_accounts(inactive_accounts)
         
-        if dry_run:
-            self.logger.info(f"试运行完成: 将删除 {len(inactive_accounts)} 个未激活账户")
-            self.logger.info("使用 --execute 参数实际执行删除操作")
-            return len(inactive_accounts)
+        self.logger.info(f"试运行完成: 将删除 {len(inactive_accounts)} 个未激活账户")
+        self.logger.info("使用 --execute 参数实际执行删除操作")
+        return len(inactive_accounts)
+    
+    def delete_inactive_accounts(self, seconds_threshold=86400):
+        """
+        分批删除未激活账户
         
-        # 实际删除操作
-        self.logger.info("开始实际删除未激活账户...")
+        每批在一个事务中按 created_at 顺序（使用 idx_unverified_created_at 索引）
+        取出最多 batch_size 个账户并一次删除，批次之间停顿 pause 秒。
+        
+        Returns:
+            删除的账户数量
+        """
+        self.logger.info(f"开始分批删除未激活账户 (每批: {self.batch_size}, 停顿: {self.pause}秒)")
+        threshold_time = int(time.time()) - seconds_threshold
         
         deleted_count = 0
-        for account in inactive_accounts:
-            account_id, email, name, created_at, verified, code = account
-            
-            try:
-                # 删除账户
-                delete_query = "DELETE FROM users WHERE id = ?"
-                result = self.execute_query(delete_query, (account_id,))
+        conn = self.get_connection()
+        conn.isolation_level = None
+        try:
+            while not self.stop_event.is_set():
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    accounts = conn.execute('''
+                        SELECT id, email, name FROM users
+                        WHERE email_verified = 0 AND created_at < ?
+                        ORDER BY created_at ASC LIMIT ?
+                    ''', (threshold_time, self.batch_size)).fetchall()
+                    if accounts:
+                        placeholders = ','.join('?' * len(accounts))
+                        conn.execute(
+                            f"DELETE FROM users WHERE email_verified = 0 AND id IN ({placeholders})",
+                            [account[0] for account in accounts]
+                        )
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
                 
-                if result > 0:
+                for account_id, email, name in accounts:
                     self.logger.info(f"已删除账户: ID={account_id}, Email={email}, Name={name}")
-                    deleted_count += 1
-                else:
-                    self.logger.warning(f"删除账户失败: ID={account_id}")
-                    
-            except Exception as e:
-                self.logger.error(f"删除账户时出错 (ID={account_id}): {e}")
+                deleted_count += len(accounts)
+                if len(accounts) < self.batch_size:
+                    break
+                self.stop_event.wait(self.pause)
+        finally:
+            conn.close()
         
         self.logger.info(f"清理完成: 成功删除 {deleted_count} 个未激活账户")
         return deleted_count
     
+    def run_daemon(self, seconds_threshold=86400, interval=3600):
+        """定时清理，直到收到 SIGINT/SIGTERM"""
+        duration_str = self.format_duration(seconds_threshold)
+        self.logger.info(f"定时清理已启动 (间隔: {self.format_duration(interval)}, 阈值: {duration_str})")
+        while not self.stop_event.is_set():
+            try:
+                self.delete_inactive_accounts(seconds_threshold)
+            except sqlite3.Error as e:
+                self.logger.error(f"清理过程中发生错误: {e}")
+            self.stop_event.wait(interval)
+        self.logger.info("定时清理已停止")
+    
+    def stop(self, *args):
+        """停止定时清理（正在进行的清理会在两批之间停止）"""
+        self.stop_event.set()
+    
     def get_database_stats(self):
         """获取数据库统计信息"""
         stats = {}
         
         try:
-            # 总用户数
-            total_users = self.execute_query("SELECT COUNT(*) FROM users")[0][0]
+            # 一次扫描统计总用户数、已激活/未激活用户数和最早的未激活账户
+            total_users, verified_users, unverified_users, oldest_unverified = self.execute_query('''
+                SELECT COUNT(*),
+                       COALESCE(SUM(email_verified = 1), 0),
+                       COALESCE(SUM(email_verified = 0), 0),
+                       MIN(CASE WHEN email_verified = 0 THEN created_at END)
+                FROM users
+            ''')[0]
             stats['total_users'] = total_users
-            
-            # 已激活用户数
-            verified_users = self.execute_query("SELECT COUNT(*) FROM users WHERE email_verified = 1")[0][0]
             stats['verified_users'] = verified_users
-            
-            # 未激活用户数
-            unverified_users = self.execute_query("SELECT COUNT(*) FROM users WHERE email_verified = 0")[0][0]
             stats['unverified_users'] = unverified_users
-            
-            # 最早的未激活账户
-            oldest_unverified = self.execute_query('''
-                SELECT created_at FROM users 
-                WHERE email_verified = 0 
-                ORDER BY created_at ASC LIMIT 1
-            ''')
-            if oldest_unverified:
-                stats['oldest_unverified'] = self.format_timestamp(oldest_unverified[0][0])
+            if oldest_unverified is not None:
+                stats['oldest_unverified'] = self.format_timestamp(oldest_unverified)
             else:
                 stats['oldest_unverified'] = "无"
             
@@ -257,16 +300,30 @@ def main():
                        help='数据库文件路径 (默认: users_sqlite_3_py.db)')
     parser.add_argument('--stats', action='store_true',
                        help='显示数据库统计信息')
+    parser.add_argument('--batch-size', type=int, default=500,
+                       help='每批删除的账户数 (默认: 500)')
+    parser.add_argument('--pause', type=float, default=0.05,
+                       help='两批之间的停顿秒数 (默认: 0.05)')
+    parser.add_argument('--daemon', action='store_true',
+                       help='定时清理 需要同时指定 --execute')
+    parser.add_argument('--interval', type=int, default=3600,
+                       help='定时清理的间隔秒数 (默认: 3600)')
     
     args = parser.parse_args()
     
-    cleaner = AccountCleaner(args.db_path)
+    cleaner = AccountCleaner(args.db_path, batch_size=max(1, args.batch_size), pause=args.pause)
     
     # 检查数据库文件是否存在
     if not os.path.exists(args.db_path):
         cleaner.logger.error(f"数据库文件不存在: {args.db_path}")
         return
     
+    # 检查数据库结构 避免在旧结构或更新版本的数据库上执行清理
+    schema_error = cleaner.check_schema()
+    if schema_error:
+        cleaner.logger.error(schema_error)
+        return
+    
     # 显示统计信息
     if args.stats:
         stats = cleaner.get_database_stats()
@@ -284,6 +341,16 @@ def main():
     else:
         seconds_threshold = args.hours * 3600  # 将小时转换为秒
     
+    # 定时清理
+    if args.daemon:
+        if not args.execute:
+            cleaner.logger.error("定时清理需要同时指定 --execute")
+            return
+        signal.signal(signal.SIGINT, cleaner.stop)
+        signal.signal(signal.SIGTERM, cleaner.stop)
+        cleaner.run_daemon(seconds_threshold, args.interval)
+        return
+    
     # 执行清理操作
     try:
         deleted_count = cleaner.cleanup_inactive_accounts(
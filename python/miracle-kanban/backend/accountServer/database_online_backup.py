@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/accountServer/database_online_backup.py
+# 数据库在线备份
+# 使用 SQLite 的在线备份接口分批复制数据库页，每批之间短暂停顿，账号服务器运行时也可以备份，
+# 不会得到写了一半的文件，也不会长时间阻塞写入。备份完成后检查完整性，可选gzip压缩，只保留最近的若干份。
+# 账号服务器配置 _backup_interval_ 后会定期自动备份
+# 此模块不依赖 configure
+
+# 1.备份到 database_backup 目录
+# python database_online_backup.py
+
+# 2.压缩备份，只保留最近 7 份
+# python database_online_backup.py --compress --keep 7
+
+# 3.自定义数据库路径和备份目录
+# python database_online_backup.py --db-path /path/to/users_sqlite_3_py.db --dir /path/to/backup
+
+# 4.检查已有的备份文件
+# python database_online_backup.py --check database_backup/users_sqlite_3_py_2024_01_01_00_00_00.db.gz
+
+import argparse
+import gzip
+import os
+import pathlib
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+
+BACKUP_PREFIX = 'users_sqlite_3_py_'
+BACKUP_SUFFIXES = ('.db', '.db.gz')
+DEFAULT_PAGES = 256             # 每批复制的页数（默认页大小4KB时约1MB）
+DEFAULT_SLEEP = 0.01            # 两批之间的停顿秒数 此时其他连接可以写入
+
+def check_integrity(path, quick=False):
+    """检查数据库文件的完整性，返回 (是否完好, 检查结果)"""
+    # 路径中的 ? # % 等字符需要转义 否则会打开（或创建）别的文件
+    conn = sqlite3.connect(f"{pathlib.Path(path).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        pragma = 'quick_check' if quick else 'integrity_check'
+        rows = [row[0] for row in conn.execute(f"PRAGMA {pragma}")]
+        return rows == ['ok'], '; '.join(rows[:10])
+    except sqlite3.DatabaseError as e:
+        return False, str(e)
+    finally:
+        conn.close()
+
+def check_backup(path, quick=False):
+    """检查备份文件（.db 或 .db.gz）的完整性，返回 (是否完好, 检查结果)"""
+    if not path.endswith('.gz'):
+        return check_integrity(path, quick)
+    fd, temp_path = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as dst, gzip.open(path, 'rb') as src:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        return check_integrity(temp_path, quick)
+    except (OSError, EOFError) as e:
+        return False, str(e)
+    finally:
+        os.remove(temp_path)
+
+def compress_file(path):
+    """把文件压缩为 path.gz 并删除原文件，返回压缩后的路径"""
+    gz_path = path + '.gz'
+    with open(path, 'rb') as src, gzip.open(gz_path, 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.remove(path)
+    return gz_path
+
+def list_backups(backup_dir):
+    """返回备份目录中的备份文件路径，按文件名（即备份时间）从旧到新排列"""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [
+        name for name in os.listdir(backup_dir)
+        if name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIXES)
+    ]
+    return [os.path.join(backup_dir, name) for name in sorted(names)]
+
+def remove_old_backups(backup_dir, keep):
+    """只保留最近的 keep 份备份，返回删除的文件列表 keep为0时不删除"""
+    if not keep:
+        return []
+    removed = []
+    for path in list_backups(backup_dir)[:-keep]:
+        try:
+            os.remove(path)
+            removed.append(path)
+        except OSError:
+            pass
+    return removed
+
+def backup_database(db_path, backup_dir, pages=DEFAULT_PAGES, sleep=DEFAULT_SLEEP,
+                    compress=False, keep=0, check=True, stop_event=None):
+    """在线备份数据库
+
+    先备份到临时文件，检查完整性（和压缩）后再重命名为
+    users_sqlite_3_py_时间戳.db[.gz]，备份目录中不会出现不完整的备份文件。
+    其他连接在两批之间写入时 SQLite 会从头重新复制，写入频繁时可以增大 pages。
+    stop_event 被设置时在两批之间中止备份。
+    返回备份文件路径，失败时抛出异常（sqlite3.Error / OSError / RuntimeError）。
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
+    backup_path = os.path.join(backup_dir, f'{BACKUP_PREFIX}{timestamp}.db')
+    fd, temp_path = tempfile.mkstemp(prefix='.backup_', suffix='.db', dir=backup_dir)
+    os.close(fd)
+
+    def progress(status, remaining, total):
+        if stop_event is not None and stop_event.is_set():
+            raise RuntimeError('备份已中止')
+
+    try:
+        src = sqlite3.connect(db_path)
+        dst = sqlite3.connect(temp_path)
+        try:
+            src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+            # 源数据库是WAL模式时备份也会是WAL模式，改回普通模式使备份成为单个独立的文件
+            dst.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            dst.close()
+            src.close()
+        if check:
+            ok, result = check_integrity(temp_path)
+            if not ok:
+                raise RuntimeError(f'备份文件完整性检查失败: {result}')
+        if compress:
+            temp_path = compress_file(temp_path)
+            backup_path += '.gz'
+        os.replace(temp_path, backup_path)
+    except BaseException:
+        for path in (temp_path, temp_path + '.gz'):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    remove_old_backups(backup_dir, keep)
+    return backup_path
+
+def main():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description='数据库在线备份工具')
+    parser.add_argument('--db-path', default=os.path.join(base_dir, 'users_sqlite_3_py.db'), help='数据库文件路径')
+    parser.add_argument('--dir', default=os.path.join(base_dir, 'database_backup'), help='备份目录')
+    parser.add_argument('--pages', type=int, default=DEFAULT_PAGES, help='每批复制的页数')
+    parser.add_argument('--sleep', type=float, default=DEFAULT_SLEEP, help='两批之间的停顿秒数')
+    parser.add_argument('--compress', action='store_true', help='使用gzip压缩备份文件')
+    parser.add_argument('--keep', type=int, default=0, help='只保留最近的多少份备份 0表示全部保留')
+    parser.add_argument('--check', metavar='BACKUP', help='只检查指定备份文件的完整性')
+    args = parser.parse_args()
+
+    if args.check:
+        ok, result = check_backup(args.check)
+        print(f"{'备份完好' if ok else '备份已损坏'}: {result}")
+        return
+    if not os.path.exists(args.db_path):
+        print(f"数据库文件 {args.db_path} 不存在")
+        return
+    start = time.perf_counter()
+    try:
+        path = backup_database(args.db_path, args.dir, args.pages, args.sleep, args.compress, args.keep)
+    except (sqlite3.Error, OSError, RuntimeError) as e:
+        print(f"数据库备份失败: {e}")
+        return
+    print(f"数据库备份成功: {path} ({os.path.getsize(path)} 字节, 耗时 {time.perf_counter() - start:.2f} 秒)")
+
+if __name__ == '__main__':
+    main()
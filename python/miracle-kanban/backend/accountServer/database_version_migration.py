@@ -4,33 +4,15 @@
 
 import sqlite3
 import os
-import shutil
+import argparse
+from contextlib import contextmanager
 import time
-from datetime import datetime
-
-# 表结构（列名和顺序）v1.0.2
-EXPECTED_COLUMNS = [
-    'id',                   # 0
-    'anonymous_user',       # 1
-    'email',                # 2
-    'password',             # 3
-    'name',                 # 4
-    'qq',                   # 5
-    'theme_color',          # 6
-    'head_img',             # 7
-    'token',                # 8
-    'token_expiry',         # 9
-    'email_verified',       # 10
-    'verification_code',    # 11
-    'code_expiry',          # 12
-    'resetpwd_code',        # 13
-    'resetpwd_expiry',      # 14
-    'created_at',           # 15
-    'last_login'            # 16
-]
+import database_online_backup
+import account_schema
+from account_schema import EXPECTED_COLUMNS, get_table_columns, table_exists, missing_columns_appendable
 
 def backup_database():
-    """备份数据库文件"""
+    """在线备份数据库文件（使用 SQLite 备份接口，不会得到写了一半的文件）"""
     db_name = 'users_sqlite_3_py.db'
     db_path = os.path.join(os.path.dirname(__file__), db_name)
     
@@ -39,104 +21,155 @@ def backup_database():
         print(f"数据库文件 {db_name} 不存在，无需备份")
         return True
     
-    # 创建备份目录
     backup_dir = os.path.join(os.path.dirname(__file__), 'database_backup')
-    os.makedirs(backup_dir, exist_ok=True)
-    
-    # 生成带时间戳的备份文件名
-    timestamp = datetime.now().strftime('%Y_%m_%d_%H_%M_%S')
-    backup_name = f'users_sqlite_3_py_{timestamp}.db'
-    backup_path = os.path.join(backup_dir, backup_name)
-    
     try:
-        # 复制数据库文件
-        shutil.copy2(db_path, backup_path)
+        backup_path = database_online_backup.backup_database(db_path, backup_dir)
         print(f"数据库备份成功: {backup_path}")
         return True
     except Exception as e:
         print(f"数据库备份失败: {e}")
         return False
 
-def get_table_columns(cursor:sqlite3.Cursor, table_name:str):
-    """获取表的列信息"""
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    columns_info = cursor.fetchall()
-    
-    # 提取列名和顺序
-    columns = []
-    for col in columns_info:
-        columns.append(col[1])  # col[1] 是列名
-    
-    return columns
+SHADOW_TABLE = 'users_migration_new'        # 迁移过程中写入新结构数据的影子表
+OLD_TABLE = 'users_migration_old'           # 交换表名时旧表的临时名称
+PROGRESS_TABLE = 'users_migration_progress' # 迁移进度 与每批数据在同一事务中提交
+DEFAULT_BATCH_SIZE = 1000
+
+@contextmanager
+def transaction(conn:sqlite3.Connection):
+    """显式事务（连接使用 isolation_level=None），DDL 语句也在事务中，出错时整体回滚"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
 
 def check_columns_match(actual_columns:list):
     """检查实际列是否与预期列匹配（包括顺序）"""
     return actual_columns == EXPECTED_COLUMNS
 
-def read_all_data(cursor:sqlite3.Cursor, table_name:str, old_columns:list):
-    """读取表中的所有数据"""
-    cursor.execute(f"SELECT * FROM {table_name}")
-    rows = cursor.fetchall()
-    
-    # 将数据转换为字典数组
-    data = []
+def load_progress(conn:sqlite3.Connection, current_columns:list):
+    """读取上次中断时的迁移进度，返回 (已复制的最大rowid, 已复制数, 失败数)，没有可续传的进度时返回None"""
+    if not table_exists(conn, PROGRESS_TABLE) or not table_exists(conn, SHADOW_TABLE):
+        return None
+    row = conn.execute(
+        f"SELECT source_columns, last_rowid, copied, failed FROM {PROGRESS_TABLE} WHERE id = 1"
+    ).fetchone()
+    # 旧表结构与开始迁移时不同（例如中断后又改动过）时不能续传
+    if row is None or row[0] != ','.join(current_columns):
+        return None
+    return row[1], row[2], row[3]
+
+def start_shadow_copy(conn:sqlite3.Connection, current_columns:list):
+    """创建空的影子表和进度表"""
+    with transaction(conn):
+        conn.execute(f"DROP TABLE IF EXISTS {SHADOW_TABLE}")
+        conn.execute(f"DROP TABLE IF EXISTS {PROGRESS_TABLE}")
+        account_schema.create_users_table(conn, SHADOW_TABLE)
+        conn.execute(f'''
+            CREATE TABLE {PROGRESS_TABLE} (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                source_columns TEXT NOT NULL,
+                last_rowid INTEGER NOT NULL,
+                copied INTEGER NOT NULL,
+                failed INTEGER NOT NULL,
+                started_at INTEGER NOT NULL
+            )
+        ''')
+        conn.execute(
+            f"INSERT INTO {PROGRESS_TABLE} VALUES (1, ?, 0, 0, 0, ?)",
+            (','.join(current_columns), int(time.time()))
+        )
+
+def copy_batch_rows(conn:sqlite3.Connection, column_list:str, last_rowid:int, end_rowid:int):
+    """逐行复制一批数据（整批复制违反约束时使用），返回 (成功数, 失败数)"""
+    placeholders = ', '.join('?' * len(column_list.split(', ')))
+    rows = conn.execute(
+        f"SELECT rowid, {column_list} FROM users WHERE rowid > ? AND rowid <= ? ORDER BY rowid",
+        (last_rowid, end_rowid)
+    ).fetchall()
+    copied = failed = 0
     for row in rows:
-        row_dict = {}
-        for i, col_name in enumerate(old_columns):
-            row_dict[col_name] = row[i]
-        data.append(row_dict)
-    
-    return data
+        try:
+            conn.execute(f"INSERT INTO {SHADOW_TABLE} ({column_list}) VALUES ({placeholders})", row[1:])
+            copied += 1
+        except sqlite3.IntegrityError as e:
+            print(f"  迁移 rowid={row[0]} 的记录失败: {e}")
+            failed += 1
+    return copied, failed
 
-def get_column_default(column_name:str):
-    """获取列的默认值"""
-    # 根据 init_database 中的定义返回默认值
-    defaults = {
-        'anonymous_user': 0,
-        'qq': 0,
-        'theme_color': 'rgba(255,255,255,1)',
-        'head_img': 'none',
-        'email_verified': 0,
-        'created_at': "(strftime('%s', 'now'))",
-        'last_login': "(strftime('%s', 'now'))"
-    }
-    
-    return defaults.get(column_name, None)
+def copy_to_shadow(conn:sqlite3.Connection, current_columns:list, batch_size:int):
+    """分批把旧表数据复制到影子表，每批和进度在同一事务中提交，中断后从进度处继续
 
-def create_new_table(cursor:sqlite3.Cursor):
-    """创建新表（基于 init_database 中的结构）"""
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            anonymous_user BOOLEAN DEFAULT 0,
-            email TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            name TEXT NOT NULL,
-            qq REAL DEFAULT 0,
-            theme_color TEXT DEFAULT 'rgba(255,255,255,1)',
-            head_img TEXT DEFAULT 'none',
-            token TEXT UNIQUE,
-            token_expiry INTEGER,
-            email_verified BOOLEAN DEFAULT 0,
-            verification_code TEXT,
-            code_expiry INTEGER,
-            resetpwd_code TEXT,
-            resetpwd_expiry INTEGER,
-            created_at INTEGER DEFAULT (strftime('%s', 'now')),
-            last_login INTEGER DEFAULT (strftime('%s', 'now'))
-        )
-    ''')
+    两张表在同一个数据库中，每批用 INSERT ... SELECT 完成，数据不经过Python，内存占用与表大小无关。
+    旧表中没有的列不写入，使用新表的默认值。
+    """
+    progress = load_progress(conn, current_columns)
+    if progress is None:
+        start_shadow_copy(conn, current_columns)
+        last_rowid, copied, failed = 0, 0, 0
+    else:
+        last_rowid, copied, failed = progress
+        print(f"  从上次中断处继续: 已复制 {copied} 条，rowid > {last_rowid}")
     
-    # 创建索引以提高查询性能
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_email ON users(email)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_token ON users(token)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_verification_code ON users(verification_code)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_resetpwd_code ON users(resetpwd_code)')
+    column_list = ', '.join(col for col in EXPECTED_COLUMNS if col in current_columns)
+    total = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    while True:
+        # 本批最后一行的rowid 没有剩余数据时为None
+        end_rowid = conn.execute(
+            "SELECT MAX(rowid) FROM (SELECT rowid FROM users WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+            (last_rowid, batch_size)
+        ).fetchone()[0]
+        if end_rowid is None:
+            break
+        
+        with transaction(conn):
+            try:
+                cursor = conn.execute(
+                    f"INSERT INTO {SHADOW_TABLE} ({column_list}) "
+                    f"SELECT {column_list} FROM users WHERE rowid > ? AND rowid <= ? ORDER BY rowid",
+                    (last_rowid, end_rowid)
+                )
+                batch_copied, batch_failed = cursor.rowcount, 0
+            except sqlite3.IntegrityError:
+                # 违反约束的语句已被单独回滚 改为逐行复制并跳过出错的记录
+                batch_copied, batch_failed = copy_batch_rows(conn, column_list, last_rowid, end_rowid)
+            copied += batch_copied
+            failed += batch_failed
+            last_rowid = end_rowid
+            conn.execute(
+                f"UPDATE {PROGRESS_TABLE} SET last_rowid = ?, copied = ?, failed = ? WHERE id = 1",
+                (last_rowid, copied, failed)
+            )
+        print(f"  已迁移 {copied + failed}/{total} 条记录")
+    return copied, failed
+
+def swap_tables(conn:sqlite3.Connection):
+    """在一个事务中用影子表替换旧表并重建索引，失败时旧表保持不变"""
+    with transaction(conn):
+        conn.execute(f"ALTER TABLE users RENAME TO {OLD_TABLE}")
+        conn.execute(f"ALTER TABLE {SHADOW_TABLE} RENAME TO users")
+        conn.execute(f"DROP TABLE {OLD_TABLE}")
+        conn.execute(f"DROP TABLE {PROGRESS_TABLE}")
+        # 数据复制完成后再建索引 比边插入边维护索引快
+        account_schema.create_users_indexes(conn)
 
-def migrate_database():
+def rebuild_table(conn:sqlite3.Connection, current_columns:list, batch_size:int):
+    """分批复制到影子表后替换旧表"""
+    print(f"当前列: {current_columns}")
+    print(f"预期列: {EXPECTED_COLUMNS}")
+    print(f"   表结构不一致，开始分批复制数据到新表（每批 {batch_size} 条）...")
+    copied, failed = copy_to_shadow(conn, current_columns, batch_size)
+    print(f"   复制完成！成功: {copied}, 失败: {failed}")
+    print("   替换旧表...")
+    swap_tables(conn)
+
+def migrate_database(batch_size:int=DEFAULT_BATCH_SIZE):
     """执行数据库版本迁移"""
     print("警告！即将更新数据库，请退出所有正在使用此数据库的应用程序！")
-    print("警告！如果数据库过大请慎重在生产环境下进行数据库版本迁移！")
+    print("提示，数据分批复制到新表后再替换旧表，中断后重新运行本脚本会从中断处继续。")
     print("提示，如果出现异常请立即从database_backup中找到备份并还原。")
     user_input = input("请输入 ok 以开始进行数据库版本迁移：")
     if user_input.strip().lower() != 'ok':
@@ -157,139 +190,88 @@ def migrate_database():
         init_new_database()
         return True
     
+    # isolation_level=None 时不会自动开始事务 由 transaction() 显式控制
+    conn = sqlite3.connect(db_path, isolation_level=None)
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # 检查users表是否存在
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-        if not cursor.fetchone():
-            print("users表不存在，将创建新表")
-            create_new_table(cursor)
-            conn.commit()
-            conn.close()
-            return True
-        
         # 1. 获取当前表的列信息
         print("1. 检查数据表结构...")
-        current_columns = get_table_columns(cursor, 'users')
+        version = account_schema.get_schema_version(conn)
+        current_columns = get_table_columns(conn, 'users') if table_exists(conn, 'users') else []
+        print(f"结构版本: {version}, 最新版本: {account_schema.SCHEMA_VERSION}")
         
         # 2. 检查列是否完整且顺序一致
         print("2. 比较表结构差异...")
-        if check_columns_match(current_columns):
+        if version == account_schema.SCHEMA_VERSION and check_columns_match(current_columns):
             print("表结构完整且顺序一致，无需迁移")
-            conn.close()
             return True
         
-        print(f"当前列: {current_columns}")
-        print(f"预期列: {EXPECTED_COLUMNS}")
-        print("3. 表结构不一致，开始迁移...")
+        # 3. 引入结构版本之前的旧表列顺序不同或缺少无法直接添加的列时 先分批复制到影子表后替换旧表
+        # （只在末尾缺少列的旧表由第1个迁移步骤直接添加列）
+        if current_columns and version == 0 and not missing_columns_appendable(current_columns):
+            print("3. 重建旧表...")
+            rebuild_table(conn, current_columns, batch_size)
         
-        # 3. 读取旧表所有数据
-        print("4. 读取旧表数据...")
-        old_data = read_all_data(cursor, 'users', current_columns)
-        print(f"读取到 {len(old_data)} 条记录")
+        # 4. 执行需要的增量迁移步骤并记录结构版本
+        print("4. 执行增量迁移步骤...")
+        applied = account_schema.migrate(conn, log=lambda message: print(f"   {message}"))
+        if not applied:
+            print("   没有需要执行的步骤")
         
-        # 4. 删除旧表
-        print("5. 删除旧表...")
-        cursor.execute("DROP TABLE users")
-        
-        # 5. 创建新表
-        print("6. 创建新表...")
-        create_new_table(cursor)
-        
-        # 6. 插入数据
-        print("7. 迁移数据到新表...")
-        migration_stats = {
-            'total': len(old_data),
-            'success': 0,
-            'failed': 0
-        }
-        
-        for i, row_data in enumerate(old_data, 1):
-            try:
-                # 准备插入的数据
-                insert_values = []
-                
-                # 为每一列准备值
-                for col in EXPECTED_COLUMNS:
-                    if col in row_data:
-                        # 旧表中有该列，使用旧值
-                        insert_values.append(row_data[col])
-                    else:
-                        # 旧表中没有该列，使用默认值
-                        default_val = get_column_default(col)
-                        if default_val is None:
-                            insert_values.append(None)
-                        else:
-                            insert_values.append(default_val)
-                
-                # 构建插入语句
-                placeholders = ', '.join(['?'] * len(EXPECTED_COLUMNS))
-                insert_sql = f"INSERT INTO users ({', '.join(EXPECTED_COLUMNS)}) VALUES ({placeholders})"
-                
-                cursor.execute(insert_sql, insert_values)
-                migration_stats['success'] += 1
-                
-                if i % 100 == 0:
-                    print(f"  已迁移 {i}/{len(old_data)} 条记录")
-                    
-            except Exception as e:
-                print(f"  迁移第 {i} 条记录失败: {e}")
-                migration_stats['failed'] += 1
-                # 继续迁移其他记录
-        
-        conn.commit()
-        print(f"8. 迁移完成！成功: {migration_stats['success']}, 失败: {migration_stats['failed']}, 总计: {migration_stats['total']}")
+        # 5. 表结构仍与预期不同（例如被手动修改过）时重建表
+        current_columns = get_table_columns(conn, 'users')
+        if not check_columns_match(current_columns):
+            print("5. 重建表...")
+            rebuild_table(conn, current_columns, batch_size)
         
         # 验证迁移结果
-        cursor.execute("SELECT COUNT(*) FROM users")
-        new_count = cursor.fetchone()[0]
-        print(f"9. 新表记录数: {new_count}")
+        new_count = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        print(f"6. 新表记录数: {new_count}")
         
         # 验证表结构
-        final_columns = get_table_columns(cursor, 'users')
+        final_columns = get_table_columns(conn, 'users')
         if check_columns_match(final_columns):
-            print("10. 迁移验证成功！")
+            print(f"7. 迁移验证成功！结构版本: {account_schema.get_schema_version(conn)}")
         else:
-            print("10. 警告：迁移后表结构可能不正确")
+            print("7. 警告：迁移后表结构可能不正确")
             print(f"    迁移后列: {final_columns}")
         
         return True
         
-    except sqlite3.Error as e:
+    except (sqlite3.Error, account_schema.SchemaError) as e:
         print(f"数据库迁移失败: {e}")
+        print("已复制的进度已保存，修复问题后重新运行本脚本会从中断处继续")
         return False
     finally:
-        if 'conn' in locals():
-            conn.close()
+        conn.close()
 
 def init_new_database():
     """初始化新数据库（当没有旧数据库时）"""
     db_path = os.path.join(os.path.dirname(__file__), 'users_sqlite_3_py.db')
     
+    conn = None
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        create_new_table(cursor)
-        conn.commit()
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        account_schema.migrate(conn)
         
         print("已创建新的数据库和users表")
         return True
         
-    except sqlite3.Error as e:
+    except (sqlite3.Error, account_schema.SchemaError) as e:
         print(f"创建新数据库失败: {e}")
         return False
     finally:
-        if 'conn' in locals():
+        if conn:
             conn.close()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='数据库版本迁移')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='每批复制的记录数')
+    args = parser.parse_args()
+    
     print("开始数据库版本迁移...")
     print("=" * 50)
     
-    success = migrate_database()
+    success = migrate_database(args.batch_size)
     
     print("=" * 50)
     if success:
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/accountServer/http_request.py
+# HTTP请求的增量读取、路由表和中间件管道
+# 由 account_main.py 的线程模式和asyncio模式共用，只处理字节数据，不涉及socket。
+# 此模块不依赖 configure
+
+import time
+from urllib.parse import parse_qs, urlparse
+
+class HttpRequestError(Exception):
+    """HTTP请求格式错误或超出限制
+
+    ban 为 True 时（请求行根本不是HTTP请求）客户端IP会被加入黑名单，
+    请求头或 Content-Length 格式错误可能来自有问题的代理或客户端，只返回错误不封禁。
+    """
+
+    def __init__(self, status_code, message, ban=False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.ban = ban
+
+class DropConnection(Exception):
+    """不发送任何响应直接关闭连接（例如检测到恶意请求），由连接处理循环统一处理"""
+
+class HttpRequest:
+    """已完整读取的HTTP请求（请求头已解析，请求体为原始字节）
+
+    参数和Cookie由 parse() 解析一次后保存在请求对象中，之后的中间件和处理函数直接使用。
+    每个请求都会创建一个对象，使用 __slots__ 减少内存占用和属性访问开销。
+    """
+
+    __slots__ = (
+        'method', 'target', 'version', 'path', 'headers', 'head', 'body', 'content_length', 'stream_body', 'body_sink',
+        'params', 'cookies', 'addr', 'keep_alive', 'route', 'start_time'
+    )
+
+    def __init__(self, method, target, version, headers, head):
+        self.method = method                # GET POST OPTIONS
+        self.target = target                # 包含路径和参数
+        self.version = version              # HTTP/1.1
+        self.path = target.split('?', 1)[0]
+        self.headers = headers              # 小写的头名称 -> 值
+        self.head = head                    # 原始请求头字节（含请求行）
+        self.body = b''
+        self.content_length = 0
+        self.stream_body = False            # 请求体由调用方在准入检查之后用 HttpRequestReader.read_body() 接收
+        self.body_sink = None               # 流式接收的请求体（写入文件而不是保存在body中）
+        self.params = None                  # 查询参数和POST参数 parse() 后可用
+        self.cookies = None                 # Cookie名称 -> 值 parse() 后可用
+        self.addr = None                    # 客户端地址
+        self.keep_alive = False             # 响应后是否保持连接 None表示直接关闭连接
+        self.route = None                   # 路由表中匹配到的 Route
+        self.start_time = 0.0
+    
+    def parse(self):
+        """解析路径、参数和Cookie，已解析过时直接返回；请求目标无法解析时返回False"""
+        if self.params is not None:
+            return True
+        try:
+            parsed_url = urlparse(self.target)
+        except ValueError:
+            return False
+        self.path = parsed_url.path
+        
+        params = {}
+        for key, value in parse_qs(parsed_url.query).items():
+            params[key] = value[0] if value else ''
+        # 解析POST数据 同名参数覆盖查询参数
+        if self.method == 'POST' and self.body:
+            try:
+                post_data = parse_qs(self.body.decode('utf-8'))
+            except UnicodeDecodeError:
+                post_data = {}
+            for key, value in post_data.items():
+                params[key] = value[0] if value else ''
+        self.params = params
+        
+        cookies = {}
+        for item in self.headers.get('cookie', '').split(';'):
+            name, sep, value = item.partition('=')
+            if sep:
+                cookies[name.strip()] = value.strip()
+        self.cookies = cookies
+        return True
+    
+    def close(self):
+        """释放流式接收的请求体（未被处理函数提交的临时文件会被删除）"""
+        if self.body_sink is not None:
+            self.body_sink.discard()
+
+class HttpRequestReader:
+    """增量HTTP请求读取器
+
+    在多次读取之间累积字节数据，直到请求头和Content-Length指定的请求体都已到齐。
+    只对请求头进行解码，请求体保持为字节，并按路径限制请求体大小。
+    stream_paths 中的路径的POST请求在请求头到齐后立即返回（stream_body 为True），请求体不在内存中累积，
+    调用方完成准入检查和验证后再用 read_body() 逐段取出，缓冲区只保留一次读取的数据量。
+    """
+
+    def __init__(self, max_header_size=8192, default_body_limit=8192, body_limits=None, stream_paths=()):
+        self.max_header_size = max_header_size
+        self.default_body_limit = default_body_limit
+        self.body_limits = body_limits or {}
+        self.stream_paths = stream_paths
+        self.buffer = bytearray()
+        self.scan_pos = 0       # 已扫描过请求头结束标记的位置 避免重复扫描
+        self.pending = None     # 已解析请求头 正在等待请求体的请求
+        self.streaming = None   # 正在由调用方接收请求体的请求
+        self.stream_remaining = 0
+    
+    def feed(self, data):
+        """追加新接收到的数据"""
+        self.buffer += data
+    
+    def has_buffered_data(self):
+        """缓冲区中是否还有未处理的数据（管线化请求）"""
+        return bool(self.buffer) or self.pending is not None or self.streaming is not None
+    
+    def next_request(self):
+        """取出下一个完整请求，数据不足时返回None"""
+        if self.pending is None:
+            end = self.buffer.find(b'\r\n\r\n', self.scan_pos)
+            if end < 0:
+                if len(self.buffer) > self.max_header_size:
+                    raise HttpRequestError(431, "请求头过大")
+                # 请求行已完整但不是HTTP请求时无需等待剩余数据
+                line_end = self.buffer.find(b'\n')
+                if line_end >= 0 and self.buffer.find(b' HTTP/', 0, line_end) < 0:
+                    raise HttpRequestError(400, "请求行格式错误", ban=True)
+                # 下次从可能被截断的结束标记处继续扫描
+                self.scan_pos = max(0, len(self.buffer) - 3)
+                return None
+            
+            head_size = end + 4
+            if head_size > self.max_header_size:
+                raise HttpRequestError(431, "请求头过大")
+            
+            with memoryview(self.buffer) as view:
+                head = bytes(view[:head_size])
+            del self.buffer[:head_size]
+            self.scan_pos = 0
+            request = self.parse_head(head)
+            if request.stream_body:
+                self.streaming = request
+                self.stream_remaining = request.content_length
+                return request
+            self.pending = request
+        
+        request = self.pending
+        if len(self.buffer) < request.content_length:
+            return None
+        
+        if request.content_length:
+            with memoryview(self.buffer) as view:
+                request.body = bytes(view[:request.content_length])
+            del self.buffer[:request.content_length]
+        self.pending = None
+        return request
+    
+    def read_body(self):
+        """取出流式请求体中已收到的部分，返回 (数据, 是否已全部接收)"""
+        size = min(self.stream_remaining, len(self.buffer))
+        with memoryview(self.buffer) as view:
+            data = bytes(view[:size])
+        del self.buffer[:size]
+        self.stream_remaining -= size
+        if self.stream_remaining:
+            return data, False
+        self.streaming = None
+        return data, True
+    
+    def parse_head(self, head):
+        """解析请求行和请求头"""
+        lines = head[:-4].decode('latin-1').split('\r\n')
+        
+        parts = lines[0].split()
+        if len(parts) != 3:
+            raise HttpRequestError(400, "请求行格式错误", ban=True)
+        method, target, version = parts
+        
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise HttpRequestError(400, "请求头格式错误")
+            headers[name.strip().lower()] = value.strip()
+        
+        request = HttpRequest(method, target, version, headers, head)
+        
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HttpRequestError(411, "不支持chunked请求体")
+        
+        try:
+            content_length = int(headers.get('content-length', '0'))
+        except ValueError:
+            raise HttpRequestError(400, "Content-Length无效")
+        if content_length < 0:
+            raise HttpRequestError(400, "Content-Length无效")
+        if content_length > self.body_limits.get(request.path, self.default_body_limit):
+            raise HttpRequestError(413, "请求数据过大")
+        
+        request.content_length = content_length
+        request.stream_body = method == 'POST' and content_length > 0 and request.path in self.stream_paths
+        return request
+    
+    def close(self):
+        """连接关闭时释放未接收完的请求体"""
+        self.pending = None
+        if self.streaming is not None:
+            self.streaming.close()
+            self.streaming = None
+
+class Route:
+    """路由表中的一项 name 用作指标标签，log 为False时不记录请求日志"""
+
+    __slots__ = ('name', 'handler', 'log')
+
+    def __init__(self, name, handler, log=True):
+        self.name = name
+        self.handler = handler
+        self.log = log
+
+class Router:
+    """按方法和路径查找处理函数的路由表
+
+    路径精确匹配时一次字典查找即可找到处理函数；带参数的路径（如 /avatar/文件名）使用前缀路由。
+    路径不存在时返回 not_found 路由（指标标签为other），路径存在但方法不允许时返回
+    method_not_allowed 路由（指标标签为该路径）。
+    """
+
+    UNKNOWN = 'other'
+
+    def __init__(self, not_found, method_not_allowed):
+        self.routes = {}        # 路径 -> {方法: Route}
+        self.prefixes = []      # [(前缀, {方法: Route})]
+        self.not_found = Route(self.UNKNOWN, not_found, log=False)
+        self.method_not_allowed = method_not_allowed
+        self.disallowed = {}    # 路径 -> 方法不允许时使用的 Route
+    
+    def add(self, method, path, handler, prefix=False, log=True):
+        """添加路由，prefix为True时匹配以path开头的所有路径"""
+        if prefix:
+            methods = dict(self.prefixes).get(path)
+            if methods is None:
+                methods = {}
+                self.prefixes.append((path, methods))
+        else:
+            methods = self.routes.setdefault(path, {})
+        methods[method] = Route(path, handler, log)
+        self.disallowed.setdefault(path, Route(path, self.method_not_allowed))
+    
+    def lookup(self, path):
+        """返回 (路由名称, {方法: Route})，路径不存在时返回 (None, None)"""
+        methods = self.routes.get(path)
+        if methods is not None:
+            return path, methods
+        if path:
+            for prefix, methods in self.prefixes:
+                if path.startswith(prefix):
+                    return prefix, methods
+        return None, None
+    
+    def match(self, method, path):
+        """查找处理请求的 Route"""
+        name, methods = self.lookup(path)
+        if methods is None:
+            return self.not_found
+        route = methods.get(method)
+        if route is None:
+            return self.disallowed[name]
+        return route
+    
+    def allowed_methods(self, path):
+        """路径允许的方法列表"""
+        _, methods = self.lookup(path)
+        return sorted(methods) if methods else []
+    
+    def route_name(self, path):
+        """路径对应的路由名称，用作指标标签，不存在的路径返回other"""
+        name, _ = self.lookup(path)
+        return name or self.UNKNOWN
+
+class Middleware:
+    """中间件基类
+
+    before() 在路由处理函数之前按顺序执行，返回响应时不再执行后续中间件和处理函数；
+    after() 按相反顺序执行，可以替换响应。name 用作各阶段耗时指标的标签。
+    """
+
+    name = 'middleware'
+
+    def before(self, request):
+        return None
+    
+    def after(self, request, response):
+        return response
+
+class MiddlewarePipeline:
+    """中间件管道
+
+    记录每个阶段自身的耗时（中间件的 before 和 after 之和，不含后续阶段），
+    处理函数作为最后一个阶段记录，可以看出每个请求的开销花在了哪里。
+    """
+
+    STAGE_BUCKETS = (0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                     0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+    def __init__(self, middlewares, stage_seconds, handler_stage='handler'):
+        # handler_stage 为None时不记录处理函数的耗时
+        self.middlewares = list(middlewares)
+        self.stage_seconds = stage_seconds
+        self.labels = [(middleware.name,) for middleware in self.middlewares]
+        self.handler_labels = (handler_stage,)
+    
+    def handle(self, request, handler):
+        """执行中间件和处理函数，返回响应"""
+        perf_counter = time.perf_counter
+        middlewares = self.middlewares
+        elapsed = [0.0] * len(middlewares)
+        response = None
+        executed = 0
+        for index, middleware in enumerate(middlewares):
+            start = perf_counter()
+            response = middleware.before(request)
+            elapsed[index] = perf_counter() - start
+            executed += 1
+            if response is not None:
+                break
+        else:
+            start = perf_counter()
+            response = handler(request)
+            if self.handler_labels[0]:
+                self.stage_seconds.observe(perf_counter() - start, self.handler_labels)
+        
+        for index in range(executed - 1, -1, -1):
+            start = perf_counter()
+            response = middlewares[index].after(request, response)
+            elapsed[index] += perf_counter() - start
+            self.stage_seconds.observe(elapsed[index], self.labels[index])
+        return response
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/accountServer/metrics.py
+# Prometheus文本格式的指标（计数器、数值、直方图）和 /metrics 服务
+# 此模块不依赖 configure，日志通过构造参数 log 传入的函数 log(message, level='INFO') 记录
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class MetricFamily:
+    """同名指标的一组带标签的样本"""
+
+    def __init__(self, name, help_text, metric_type, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.metric_type = metric_type
+        self.labelnames = tuple(labelnames)
+        self.values = {}                # 标签值元组 -> 数值
+        self.lock = threading.Lock()
+        self.callback = None            # 读取时调用的函数 返回数值或 {标签值元组: 数值}
+    
+    def format_labels(self, labels, extra=()):
+        pairs = list(zip(self.labelnames, labels)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+    
+    def collect(self):
+        """返回 (标签值元组, 数值) 列表"""
+        if self.callback is not None:
+            value = self.callback()
+            return list(value.items()) if isinstance(value, dict) else [((), value)]
+        with self.lock:
+            return list(self.values.items())
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        for labels, value in self.collect():
+            lines.append(f"{self.name}{self.format_labels(labels)} {value}")
+        return lines
+
+class Counter(MetricFamily):
+    """只增不减的计数器"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, 'counter', labelnames)
+    
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(MetricFamily):
+    """可增可减的数值"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, 'gauge', labelnames)
+    
+    def set(self, value, labels=()):
+        with self.lock:
+            self.values[labels] = value
+    
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+    
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+class Histogram(MetricFamily):
+    """固定分桶的直方图，分位数按桶内线性插值估算"""
+
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, 'histogram', labelnames)
+        self.buckets = tuple(buckets)
+        # 标签值元组 -> [各桶计数(非累计, 最后一个为+Inf), 总和, 总数]
+    
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self.values[labels] = state
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+    
+    def quantile(self, counts, total, q):
+        """根据分桶计数估算分位数"""
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, counts):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.buckets[-1]     # 落在+Inf桶中 只能给出最大的有限边界
+    
+    def render(self):
+        with self.lock:
+            items = [(labels, (list(state[0]), state[1], state[2])) for labels, state in self.values.items()]
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total_sum, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{self.format_labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self.format_labels(labels)} {total_sum}")
+            lines.append(f"{self.name}_count{self.format_labels(labels)} {total}")
+        # 分位数估算值 (p50/p95/p99)
+        lines.append(f"# HELP {self.name}_quantile {self.help_text} (按分桶估算的分位数)")
+        lines.append(f"# TYPE {self.name}_quantile gauge")
+        for labels, (counts, _, total) in items:
+            for q in self.QUANTILES:
+                lines.append(f"{self.name}_quantile{self.format_labels(labels, [('quantile', q)])} {self.quantile(counts, total, q)}")
+        return lines
+
+class MetricsRegistry:
+    """指标注册表，输出Prometheus文本格式"""
+
+    def __init__(self):
+        self.families = []
+    
+    def register(self, family, callback=None):
+        family.callback = callback
+        self.families.append(family)
+        return family
+    
+    def counter(self, name, help_text, labelnames=(), callback=None):
+        return self.register(Counter(name, help_text, labelnames), callback)
+    
+    def gauge(self, name, help_text, labelnames=(), callback=None):
+        return self.register(Gauge(name, help_text, labelnames), callback)
+    
+    def histogram(self, name, help_text, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+    
+    def render(self):
+        """输出所有指标，读取失败的指标跳过"""
+        lines = []
+        for family in self.families:
+            try:
+                lines.extend(family.render())
+            except Exception as e:
+                lines.append(f"# {family.name} 读取失败: {e}")
+        return '\n'.join(lines) + '\n'
+
+class MetricsHttpServer:
+    """在本机端口提供 /metrics 的HTTP服务（独立线程，不经过账号服务的请求处理流程）"""
+
+    def __init__(self, registry, log, host='127.0.0.1', port=9810):
+        self.registry = registry
+        self.log = log
+        self.host = host
+        self.port = port
+        self.httpd = None
+        self.thread = None
+    
+    def start(self):
+        registry = self.registry
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass    # 不记录抓取请求
+        
+        try:
+            self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        except OSError as e:
+            self.log(f"指标服务启动失败 {self.host}:{self.port}: {e}", level='ERROR')
+            return
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-http', daemon=True)
+        self.thread.start()
+        self.log(f"指标地址: http://{self.host}:{self.port}/metrics")
+    
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/accountServer/password_hasher.py
+# 密码哈希算法
+# 此模块不依赖 configure 且没有导入时副作用，可以在进程池的子进程中安全导入
+
+import hashlib
+import hmac
+import base64
+import os
+import signal
+import threading
+import time
+
+def b64encode(data):
+    """无填充的base64编码"""
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+def b64decode(text):
+    """解码无填充的base64"""
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+class LegacySha256Hasher:
+    """旧版无盐 SHA-256 哈希，仅用于验证旧密码"""
+
+    algorithm = 'sha256'
+
+    def __init__(self, **params):
+        pass
+
+    @staticmethod
+    def matches(encoded):
+        """是否为旧版哈希（64位十六进制字符串）"""
+        return len(encoded) == 64 and '$' not in encoded
+
+    def hash(self, password):
+        return hashlib.sha256(password.encode()).hexdigest()
+
+    def verify(self, password, encoded):
+        return hmac.compare_digest(self.hash(password), encoded)
+
+    def needs_rehash(self, encoded):
+        return True
+
+class ScryptHasher:
+    """scrypt 内存密集型哈希
+
+    格式: scrypt$n$r$p$salt$hash
+    """
+
+    algorithm = 'scrypt'
+
+    def __init__(self, n=16384, r=8, p=1, dklen=32, salt_size=16):
+        self.n = n
+        self.r = r
+        self.p = p
+        self.dklen = dklen
+        self.salt_size = salt_size
+
+    def derive(self, password, salt, n, r, p, dklen):
+        # scrypt 需要约 128*n*r 字节内存 maxmem 留出余量
+        return hashlib.scrypt(
+            password.encode(), salt=salt, n=n, r=r, p=p,
+            maxmem=256 * n * r + 1024 * 1024, dklen=dklen
+        )
+
+    def hash(self, password):
+        salt = os.urandom(self.salt_size)
+        digest = self.derive(password, salt, self.n, self.r, self.p, self.dklen)
+        return f"{self.algorithm}${self.n}${self.r}${self.p}${b64encode(salt)}${b64encode(digest)}"
+
+    def verify(self, password, encoded):
+        try:
+            _, n, r, p, salt, digest = encoded.split('$')
+            expected = b64decode(digest)
+            actual = self.derive(password, b64decode(salt), int(n), int(r), int(p), len(expected))
+        except (ValueError, TypeError):
+            return False
+        return hmac.compare_digest(actual, expected)
+
+    def needs_rehash(self, encoded):
+        try:
+            _, n, r, p, _, _ = encoded.split('$')
+        except ValueError:
+            return True
+        return (int(n), int(r), int(p)) != (self.n, self.r, self.p)
+
+class Pbkdf2Hasher:
+    """PBKDF2-HMAC-SHA256 哈希
+
+    格式: pbkdf2_sha256$iterations$salt$hash
+    """
+
+    algorithm = 'pbkdf2_sha256'
+
+    def __init__(self, iterations=600000, dklen=32, salt_size=16):
+        self.iterations = iterations
+        self.dklen = dklen
+        self.salt_size = salt_size
+
+    def hash(self, password):
+        salt = os.urandom(self.salt_size)
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, self.iterations, self.dklen)
+        return f"{self.algorithm}${self.iterations}${b64encode(salt)}${b64encode(digest)}"
+
+    def verify(self, password, encoded):
+        try:
+            _, iterations, salt, digest = encoded.split('$')
+            expected = b64decode(digest)
+            actual = hashlib.pbkdf2_hmac('sha256', password.encode(), b64decode(salt), int(iterations), len(expected))
+        except (ValueError, TypeError):
+            return False
+        return hmac.compare_digest(actual, expected)
+
+    def needs_rehash(self, encoded):
+        try:
+            _, iterations, _, _ = encoded.split('$')
+        except ValueError:
+            return True
+        return int(iterations) != self.iterations
+
+# 可选的哈希算法
+HASHERS = {
+    ScryptHasher.algorithm: ScryptHasher,
+    Pbkdf2Hasher.algorithm: Pbkdf2Hasher,
+    LegacySha256Hasher.algorithm: LegacySha256Hasher
+}
+
+def identify_hasher(encoded):
+    """根据哈希字符串识别算法，返回哈希类"""
+    if LegacySha256Hasher.matches(encoded):
+        return LegacySha256Hasher
+    return HASHERS.get(encoded.split('$', 1)[0])
+
+def hash_password(password, algorithm, params):
+    """使用指定算法和参数计算密码哈希"""
+    return HASHERS[algorithm](**params).hash(password)
+
+def verify_password(password, encoded):
+    """验证密码，算法参数从哈希字符串中读取"""
+    if not encoded:
+        return False
+    hasher_class = identify_hasher(encoded)
+    if hasher_class is None:
+        return False
+    return hasher_class().verify(password, encoded)
+
+def needs_rehash(encoded, algorithm, params):
+    """哈希是否需要按当前算法和参数重新计算"""
+    hasher_class = identify_hasher(encoded)
+    if hasher_class is None or hasher_class.algorithm != algorithm:
+        return True
+    return hasher_class(**params).needs_rehash(encoded)
+
+def warm_up():
+    """进程池预热任务"""
+    return os.getpid()
+
+def init_worker(owner_pid):
+    """进程池子进程初始化
+
+    Ctrl+C 由创建进程池的进程统一处理；该进程被强制结束时子进程无法收到关闭通知，
+    因此在后台检查该进程是否还在，退出后立即结束自身（仅POSIX系统）。
+    使用 forkserver 时子进程的父进程是 forkserver 而不是创建进程池的进程，所以按pid检查。
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if os.name != 'posix':
+        return
+
+    def watch_parent():
+        while True:
+            time.sleep(1)
+            try:
+                os.kill(owner_pid, 0)
+            except ProcessLookupError:
+                os._exit(0)
+            except PermissionError:
+                pass
+
+    threading.Thread(target=watch_parent, daemon=True).start()
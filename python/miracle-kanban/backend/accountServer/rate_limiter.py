@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/accountServer/rate_limiter.py
+# 滑动窗口限流器
+# 单进程时计数保存在进程内，多进程模式下计数保存在 shared_state.SharedStateTable 中。
+# 此模块不依赖 configure
+
+import threading
+import time
+from collections import OrderedDict
+
+class SlidingWindowRateLimiter:
+    """基于计数器的滑动窗口限流器
+
+    每个键只保存 [当前窗口起点, 上一窗口计数, 当前窗口计数] 三个值，
+    用上一窗口计数按剩余比例加权估算滑动窗口内的请求数，单次检查为O(1)。
+    键按最近访问顺序排列，超过两个窗口未访问的键以及超出数量上限的键会被淘汰。
+    """
+
+    def __init__(self, limit, window, max_keys=100000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.states = OrderedDict()     # 键 -> [窗口起点, 上一窗口计数, 当前窗口计数]
+        self.lock = threading.Lock()
+        self.rejected = 0
+    
+    def allow(self, key, now=None):
+        """记录一次访问，超出限制时返回False"""
+        if now is None:
+            now = time.time()
+        window_start = now - now % self.window
+        
+        with self.lock:
+            state = self.states.get(key)
+            if state is None:
+                state = [window_start, 0, 0]
+                self.states[key] = state
+            else:
+                self.states.move_to_end(key)
+                if state[0] != window_start:
+                    # 进入新窗口 相邻窗口的计数成为上一窗口计数
+                    previous = state[2] if window_start - state[0] == self.window else 0
+                    state[0] = window_start
+                    state[1] = previous
+                    state[2] = 0
+            
+            weight = 1 - (now - window_start) / self.window
+            allowed = state[1] * weight + state[2] < self.limit
+            if allowed:
+                state[2] += 1
+            else:
+                self.rejected += 1
+            
+            self.evict(now)
+            return allowed
+    
+    def retry_after(self, key, now=None):
+        """距离可以再次访问的估计秒数"""
+        if now is None:
+            now = time.time()
+        return max(1, int(self.window - now % self.window))
+    
+    def evict(self, now):
+        """淘汰空闲或超出数量上限的键（调用方需持有锁）"""
+        while self.states:
+            key, state = next(iter(self.states.items()))
+            if len(self.states) > self.max_keys or state[0] < now - 2 * self.window:
+                del self.states[key]
+            else:
+                break
+
+class SharedSlidingWindowRateLimiter:
+    """使用 SharedStateTable 计数的滑动窗口限流器（多进程模式），接口与 SlidingWindowRateLimiter 相同"""
+
+    def __init__(self, table, namespace, limit, window):
+        self.table = table
+        self.namespace = namespace
+        self.limit = limit
+        self.window = window
+        self.rejected = 0
+    
+    def allow(self, key, now=None):
+        """记录一次访问，超出限制时返回False"""
+        allowed = self.table.sliding_window(key, self.namespace, self.limit, self.window, now)
+        if not allowed:
+            self.rejected += 1
+        return allowed
+    
+    def retry_after(self, key, now=None):
+        """距离可以再次访问的估计秒数"""
+        if now is None:
+            now = time.time()
+        return max(1, int(self.window - now % self.window))
+
+class RouteRateLimiter:
+    """按路径区分限额的限流器，未配置的路径使用默认限额
+
+    shared_state 不为None时（多进程模式）计数保存在共享表中
+    """
+
+    def __init__(self, route_limits, default_limit, max_keys=100000, shared_state=None):
+        self.max_keys = max_keys
+        
+        def create(name, limit, window):
+            if shared_state is not None:
+                return SharedSlidingWindowRateLimiter(shared_state, f'route:{name}', limit, window)
+            return SlidingWindowRateLimiter(limit, window, max_keys)
+        
+        self.default = create('*', default_limit[0], default_limit[1])
+        self.routes = {
+            path: create(path, limit, window)
+            for path, (limit, window) in route_limits.items()
+        }
+    
+    def get_limiter(self, path):
+        return self.routes.get(path, self.default)
+    
+    def allow(self, key, path):
+        """记录一次访问，超出该路径的限制时返回False"""
+        return self.get_limiter(path).allow(key)
+    
+    def retry_after(self, key, path):
+        return self.get_limiter(path).retry_after(key)
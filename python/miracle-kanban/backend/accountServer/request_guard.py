@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/accountServer/request_guard.py
+# IP黑名单和恶意请求特征匹配
+# 此模块不依赖 configure，日志通过构造参数 log 传入的函数 log(message, level='INFO') 记录
+
+import ipaddress
+import json
+import os
+import re
+import threading
+import time
+
+class IpBlacklist:
+    """支持过期时间和CIDR网段的IP黑名单
+
+    网段保存在按地址位展开的二进制前缀树中，查询时沿IP的高位向下走，
+    途中遇到未过期的网段即命中，耗时只与前缀长度有关。
+    黑名单会定期清理过期条目并保存到快照文件，重启后自动恢复。
+    多进程模式下单个IP的封禁同时写入共享表，所有工作进程都能查到，
+    只由 snapshot_owner 为True的进程保存快照（包含共享表中的条目）。
+    """
+
+    def __init__(self, log, snapshot_path=None, default_ttl=3600, snapshot_interval=60,
+                 shared_state=None, snapshot_owner=True):
+        self.log = log
+        self.shared_state = shared_state
+        self.snapshot_owner = snapshot_owner
+        self.snapshot_path = snapshot_path
+        self.default_ttl = default_ttl              # 未指定时的有效秒数 None或0表示永久
+        self.snapshot_interval = snapshot_interval
+        self.roots = {4: [None, None, None], 6: [None, None, None]}    # 节点: [0子节点, 1子节点, 条目]
+        self.count = 0
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+    
+    @staticmethod
+    def parse_network(value):
+        """解析IP或CIDR字符串，IPv4映射的IPv6地址按IPv4处理"""
+        network = ipaddress.ip_network(value, strict=False)
+        if network.version == 6 and network.prefixlen >= 96:
+            mapped = network.network_address.ipv4_mapped
+            if mapped is not None:
+                network = ipaddress.ip_network(f"{mapped}/{network.prefixlen - 96}")
+        return network
+    
+    def add(self, value, ttl=None, reason=''):
+        """加入IP或网段，ttl为None时使用默认有效期，0表示永久"""
+        try:
+            network = self.parse_network(value)
+        except ValueError:
+            return False
+        if ttl is None:
+            ttl = self.default_ttl
+        expires_at = time.time() + ttl if ttl else 0
+        self.insert(network, (expires_at, reason))
+        if self.shared_state is not None and network.prefixlen == network.max_prefixlen:
+            self.shared_state.set(network.network_address, 'blacklist', expires_at or float('inf'))
+        return True
+    
+    def insert(self, network, entry):
+        """在前缀树中写入网段条目"""
+        bits = network.max_prefixlen
+        value = int(network.network_address)
+        with self.lock:
+            node = self.roots[network.version]
+            for i in range(network.prefixlen):
+                bit = (value >> (bits - 1 - i)) & 1
+                if node[bit] is None:
+                    node[bit] = [None, None, None]
+                node = node[bit]
+            if node[2] is None:
+                self.count += 1
+            node[2] = entry
+            self.dirty = True
+    
+    def remove(self, value):
+        """移除IP或网段"""
+        network = self.parse_network(value)
+        bits = network.max_prefixlen
+        address = int(network.network_address)
+        with self.lock:
+            node = self.roots[network.version]
+            for i in range(network.prefixlen):
+                node = node[(address >> (bits - 1 - i)) & 1]
+                if node is None:
+                    return False
+            if node[2] is None:
+                return False
+            node[2] = None
+            self.count -= 1
+            self.dirty = True
+            return True
+    
+    def lookup(self, ip):
+        """查询IP命中的黑名单条目 (过期时间, 原因)，未命中返回None"""
+        try:
+            address = ipaddress.ip_address(ip.split('%', 1)[0])
+        except ValueError:
+            return None
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        
+        bits = address.max_prefixlen
+        value = int(address)
+        now = time.time()
+        node = self.roots[address.version]
+        i = 0
+        while node is not None:
+            entry = node[2]
+            if entry is not None and (not entry[0] or entry[0] > now):
+                return entry
+            if i == bits:
+                break
+            node = node[(value >> (bits - 1 - i)) & 1]
+            i += 1
+        
+        if self.shared_state is not None:
+            # 其他工作进程封禁的IP
+            shared = self.shared_state.get(address, 'blacklist', now)
+            if shared is not None:
+                return (0 if shared[0] == float('inf') else shared[0], 'shared')
+        return None
+    
+    def __contains__(self, ip):
+        return self.lookup(ip) is not None
+    
+    def __len__(self):
+        return self.count
+    
+    def entries(self):
+        """遍历所有条目，返回 (网段字符串, 过期时间, 原因) 列表"""
+        result = []
+        with self.lock:
+            for version, root in self.roots.items():
+                bits = 32 if version == 4 else 128
+                stack = [(root, 0, 0)]
+                while stack:
+                    node, value, depth = stack.pop()
+                    if node[2] is not None:
+                        address = ipaddress.ip_address(value << (bits - depth)) if version == 4 \
+                            else ipaddress.IPv6Address(value << (bits - depth))
+                        result.append((f"{address}/{depth}", node[2][0], node[2][1]))
+                    for bit in (0, 1):
+                        if node[bit] is not None:
+                            stack.append((node[bit], (value << 1) | bit, depth + 1))
+        return result
+    
+    def purge_expired(self):
+        """删除过期条目并裁剪空节点，返回删除的数量"""
+        now = time.time()
+        removed = 0
+        
+        def prune(node):
+            nonlocal removed
+            for bit in (0, 1):
+                if node[bit] is not None and prune(node[bit]):
+                    node[bit] = None
+            entry = node[2]
+            if entry is not None and entry[0] and entry[0] <= now:
+                node[2] = None
+                removed += 1
+            return node[0] is None and node[1] is None and node[2] is None
+        
+        with self.lock:
+            for root in self.roots.values():
+                prune(root)
+            self.count -= removed
+            if removed:
+                self.dirty = True
+        return removed
+    
+    def save(self):
+        """保存快照（先写临时文件再替换）"""
+        if not self.snapshot_path or not self.snapshot_owner:
+            return
+        data = [
+            {"network": network, "expires_at": expires_at, "reason": reason}
+            for network, expires_at, reason in self.entries()
+            if reason != 'static'       # 配置文件中的静态条目每次启动重新加载
+        ]
+        if self.shared_state is not None:
+            saved = {item['network'] for item in data}
+            for key, expires_at, _ in self.shared_state.items('blacklist'):
+                address = ipaddress.IPv6Address(key)
+                address = address.ipv4_mapped or address
+                network = f"{address}/{address.max_prefixlen}"
+                if network not in saved:
+                    data.append({"network": network, "expires_at": 0 if expires_at == float('inf') else expires_at, "reason": 'shared'})
+        self.dirty = False
+        temp_path = self.snapshot_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, self.snapshot_path)
+    
+    def load(self):
+        """从快照恢复未过期的条目"""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return 0
+        with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        now = time.time()
+        loaded = 0
+        for item in data:
+            expires_at = item.get('expires_at', 0)
+            if expires_at and expires_at <= now:
+                continue
+            try:
+                self.insert(self.parse_network(item['network']), (expires_at, item.get('reason', '')))
+                loaded += 1
+            except (KeyError, ValueError):
+                continue
+        self.dirty = False
+        return loaded
+    
+    def start(self):
+        """加载快照并启动定期清理和保存的后台线程"""
+        try:
+            loaded = self.load()
+            if loaded:
+                self.log(f"已从 {self.snapshot_path} 恢复 {loaded} 条黑名单记录")
+        except Exception as e:
+            self.log(f"加载黑名单快照失败: {e}", level='ERROR')
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='ip-blacklist', daemon=True)
+        self.thread.start()
+    
+    def run(self):
+        """后台清理和保存循环"""
+        while not self.stop_event.wait(self.snapshot_interval):
+            try:
+                self.purge_expired()
+                if self.dirty:
+                    self.save()
+            except Exception as e:
+                self.log(f"保存黑名单快照失败: {e}", level='ERROR')
+    
+    def stop(self):
+        """停止后台线程并保存最终快照"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(5)
+        try:
+            self.purge_expired()
+            self.save()
+        except Exception as e:
+            self.log(f"保存黑名单快照失败: {e}", level='ERROR')
+
+class RequestSignatureMatcher:
+    """恶意请求特征匹配器
+
+    所有特征按前缀树合并成一个编译好的正则表达式，原始请求头和请求体各只扫描一遍，
+    分支按首字节选择，特征数量增加时每个请求的开销基本不变。
+    额外的特征可以写在特征文件中（每行一条，#开头为注释），文件修改后自动重新加载。
+    """
+
+    def __init__(self, builtin_signatures, log, signature_file=None, reload_interval=5):
+        self.log = log
+        self.builtin_signatures = list(builtin_signatures)
+        self.signature_file = signature_file
+        self.reload_interval = reload_interval
+        self.file_mtime = None
+        self.next_reload_check = 0
+        self.hits = {}
+        self.lock = threading.Lock()
+        self.signatures = []
+        self.pattern = None
+        self.compile(self.builtin_signatures + self.read_signature_file())
+    
+    @staticmethod
+    def build_trie_pattern(signatures):
+        """把特征列表按公共前缀合并成正则表达式 (bytes)"""
+        trie = {}
+        for signature in signatures:
+            node = trie
+            for byte in signature:
+                node = node.setdefault(byte, {})
+            node[None] = True       # 特征结束标记
+        
+        def to_regex(node):
+            end = None in node
+            branches = [re.escape(bytes([byte])) + to_regex(child)
+                        for byte, child in sorted((k, v) for k, v in node.items() if k is not None)]
+            if not branches:
+                return b''
+            body = branches[0] if len(branches) == 1 else b'(?:' + b'|'.join(branches) + b')'
+            if end:
+                # 较长的特征优先 同时允许在此处结束
+                return b'(?:' + body + b')?'
+            return body
+        
+        return to_regex(trie)
+    
+    def compile(self, signatures):
+        """编译特征列表"""
+        encoded = []
+        for signature in signatures:
+            data = signature.encode('utf-8')
+            if data and data not in encoded:
+                encoded.append(data)
+        pattern = re.compile(self.build_trie_pattern(encoded)) if encoded else None
+        with self.lock:
+            # 一次性替换 正在匹配的请求继续使用旧的表达式
+            self.signatures = [item.decode('utf-8') for item in encoded]
+            self.pattern = pattern
+            for signature in self.signatures:
+                self.hits.setdefault(signature, 0)
+    
+    def read_signature_file(self):
+        """读取特征文件，文件不存在时返回空列表"""
+        if not self.signature_file:
+            return []
+        try:
+            self.file_mtime = os.stat(self.signature_file).st_mtime
+            with open(self.signature_file, 'r', encoding='utf-8') as f:
+                lines = [line.strip() for line in f]
+        except FileNotFoundError:
+            self.file_mtime = None
+            return []
+        return [line for line in lines if line and not line.startswith('#')]
+    
+    def maybe_reload(self):
+        """按间隔检查特征文件是否修改，修改后重新编译"""
+        now = time.monotonic()
+        if not self.signature_file or now < self.next_reload_check:
+            return
+        self.next_reload_check = now + self.reload_interval
+        try:
+            mtime = os.stat(self.signature_file).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.file_mtime:
+            return
+        try:
+            extra = self.read_signature_file()
+            self.compile(self.builtin_signatures + extra)
+            self.log(f"已重新加载请求特征文件 {self.signature_file}，共 {len(self.signatures)} 条特征")
+        except Exception as e:
+            self.log(f"加载请求特征文件失败: {e}", level='ERROR')
+    
+    def match(self, data):
+        """扫描原始请求数据，命中时返回特征字符串并计数，否则返回None"""
+        self.maybe_reload()
+        pattern = self.pattern
+        if pattern is None:
+            return None
+        found = pattern.search(data)
+        if found is None:
+            return None
+        signature = found.group(0).decode('utf-8', 'replace')
+        with self.lock:
+            self.hits[signature] = self.hits.get(signature, 0) + 1
+        return signature
+    
+    def stats(self):
+        """各特征的命中次数（只包含命中过的特征）"""
+        with self.lock:
+            return {signature: count for signature, count in self.hits.items() if count}
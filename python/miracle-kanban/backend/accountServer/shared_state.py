@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/accountServer/shared_state.py
+# 多进程模式下各工作进程共享的状态表
+# 由 WorkerSupervisor 在fork工作进程之前创建，用于共享限流计数、黑名单和会话失效标记。
+# 此模块不依赖 configure
+
+import hashlib
+import ipaddress
+import mmap
+import multiprocessing
+import os
+import struct
+import time
+import zlib
+
+class SharedStateTable:
+    """多进程模式下各工作进程共享的定长哈希表
+
+    数据保存在匿名共享内存中，fork出的工作进程共用同一块内存和同一组进程锁。
+    槽位按区段分组，每个区段一把锁，键的线性探测只在所属区段内进行，
+    不同键的操作很少争用同一把锁。
+    每个槽位保存 (键, 命名空间, 过期时间, 数值, 上一窗口计数, 当前窗口计数)，
+    过期的槽位可以复用；探测范围内没有空位时覆盖最早过期的槽位。
+    用于共享限流计数、黑名单和会话失效标记，使按IP的限制在所有工作进程中保持一致。
+
+    asyncio模式下在事件循环线程中调用，获取锁最多等待 LOCK_TIMEOUT 秒，超时后跳过本次操作（放行），
+    不会让整个事件循环停顿。持有锁的进程pid记录在共享内存中，工作进程异常退出后
+    主进程调用 release_locks_held_by() 释放它未释放的锁。
+    """
+
+    SLOT = struct.Struct('<16sH6xddII')     # 48字节
+    OWNER = struct.Struct('<I')             # 持有区段锁的进程pid 0表示未持有
+    PROBES = 16                             # 线性探测的最大槽位数
+    STRIPES = 64                            # 区段（锁）数量
+    LOCK_TIMEOUT = 0.002                    # 获取锁的最长等待秒数 临界区只有几微秒
+
+    def __init__(self, slots=65536):
+        self.stripes = max(1, min(self.STRIPES, slots // self.PROBES))
+        self.stripe_slots = max(self.PROBES, slots // self.stripes)
+        self.slots = self.stripe_slots * self.stripes
+        self.buffer = mmap.mmap(-1, self.slots * self.SLOT.size)
+        self.owners = mmap.mmap(-1, self.stripes * self.OWNER.size)
+        self.locks = [multiprocessing.Lock() for _ in range(self.stripes)]
+        self.lock_timeouts = 0
+    
+    @staticmethod
+    def make_key(value):
+        """把IP、用户ID或字符串转换为16字节的键，IPv4地址使用IPv4映射的IPv6格式"""
+        if isinstance(value, int):
+            return value.to_bytes(16, 'big', signed=False)
+        if isinstance(value, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+            address = value
+        else:
+            try:
+                address = ipaddress.ip_address(str(value).split('%', 1)[0])
+            except ValueError:
+                return hashlib.blake2b(str(value).encode('utf-8'), digest_size=16).digest()
+        if address.version == 4:
+            return b'\x00' * 10 + b'\xff\xff' + address.packed
+        return address.packed
+    
+    @staticmethod
+    def namespace_id(namespace):
+        """命名空间字符串转换为非0的16位编号"""
+        return zlib.crc32(namespace.encode('utf-8')) % 0xFFFF + 1
+    
+    def stripe_of(self, key, namespace):
+        """键所在的区段和区段内的起始位置"""
+        index = zlib.crc32(key, namespace)
+        return index % self.stripes, (index // self.stripes) % self.stripe_slots
+    
+    def find(self, key, namespace, now, create):
+        """查找槽位（调用方需持有该键所在区段的锁），返回 (偏移量, 是否为已有的有效条目)"""
+        stripe, start = self.stripe_of(key, namespace)
+        base = stripe * self.stripe_slots
+        victim = None
+        oldest = None
+        oldest_expires = None
+        for i in range(self.PROBES):
+            offset = (base + (start + i) % self.stripe_slots) * self.SLOT.size
+            slot_key, slot_namespace, expires_at = self.SLOT.unpack_from(self.buffer, offset)[:3]
+            if slot_namespace == namespace and slot_key == key:
+                if expires_at > now:
+                    return offset, True
+                return (offset, False) if create else (None, False)
+            if victim is None and (slot_namespace == 0 or expires_at <= now):
+                victim = offset
+            if oldest_expires is None or expires_at < oldest_expires:
+                oldest, oldest_expires = offset, expires_at
+        if not create:
+            return None, False
+        return (victim if victim is not None else oldest), False
+    
+    def acquire(self, stripe):
+        """获取区段锁，超时返回False（调用方跳过本次操作）"""
+        if self.locks[stripe].acquire(timeout=self.LOCK_TIMEOUT):
+            self.OWNER.pack_into(self.owners, stripe * self.OWNER.size, os.getpid())
+            return True
+        self.lock_timeouts += 1
+        return False
+    
+    def release(self, stripe):
+        self.OWNER.pack_into(self.owners, stripe * self.OWNER.size, 0)
+        self.locks[stripe].release()
+    
+    def release_locks_held_by(self, pid):
+        """释放已退出的进程持有的区段锁（由主进程在回收工作进程时调用），返回释放的数量"""
+        released = 0
+        for stripe in range(self.stripes):
+            offset = stripe * self.OWNER.size
+            if self.OWNER.unpack_from(self.owners, offset)[0] == pid:
+                self.OWNER.pack_into(self.owners, offset, 0)
+                try:
+                    self.locks[stripe].release()
+                    released += 1
+                except ValueError:
+                    pass    # 进程在释放锁之后、清除pid之前退出
+        return released
+    
+    def sliding_window(self, value, namespace, limit, window, now=None):
+        """滑动窗口计数（与 SlidingWindowRateLimiter 算法相同），超出限制时返回False"""
+        if now is None:
+            now = time.time()
+        key = self.make_key(value)
+        namespace = self.namespace_id(namespace)
+        window_start = now - now % window
+        stripe = self.stripe_of(key, namespace)[0]
+        if not self.acquire(stripe):
+            return True
+        try:
+            offset, found = self.find(key, namespace, now, True)
+            if found:
+                _, _, _, state_start, previous, current = self.SLOT.unpack_from(self.buffer, offset)
+                if state_start != window_start:
+                    previous = current if window_start - state_start == window else 0
+                    current = 0
+            else:
+                previous = current = 0
+            
+            weight = 1 - (now - window_start) / window
+            allowed = previous * weight + current < limit
+            if allowed:
+                current += 1
+            self.SLOT.pack_into(self.buffer, offset, key, namespace,
+                                window_start + 2 * window, window_start, previous, current)
+            return allowed
+        finally:
+            self.release(stripe)
+    
+    def set(self, value, namespace, expires_at, number=0.0):
+        """写入一个在 expires_at 之前有效的数值"""
+        key = self.make_key(value)
+        namespace = self.namespace_id(namespace)
+        stripe = self.stripe_of(key, namespace)[0]
+        if not self.acquire(stripe):
+            return
+        try:
+            offset, _ = self.find(key, namespace, time.time(), True)
+            self.SLOT.pack_into(self.buffer, offset, key, namespace, expires_at, number, 0, 0)
+        finally:
+            self.release(stripe)
+    
+    def get(self, value, namespace, now=None):
+        """读取未过期的条目，返回 (过期时间, 数值)，不存在时返回None"""
+        if now is None:
+            now = time.time()
+        key = self.make_key(value)
+        namespace = self.namespace_id(namespace)
+        stripe = self.stripe_of(key, namespace)[0]
+        if not self.acquire(stripe):
+            return None
+        try:
+            offset, found = self.find(key, namespace, now, False)
+            if not found:
+                return None
+            return self.SLOT.unpack_from(self.buffer, offset)[2:4]
+        finally:
+            self.release(stripe)
+    
+    def items(self, namespace, now=None):
+        """遍历某个命名空间中未过期的条目，返回 (键, 过期时间, 数值) 列表"""
+        if now is None:
+            now = time.time()
+        namespace = self.namespace_id(namespace)
+        result = []
+        size = self.stripe_slots * self.SLOT.size
+        for stripe in range(self.stripes):
+            # 逐个区段加锁读取 获取不到锁的区段跳过
+            if not self.acquire(stripe):
+                continue
+            try:
+                with memoryview(self.buffer) as whole, whole[stripe * size:(stripe + 1) * size] as view:
+                    for key, slot_namespace, expires_at, number, _, _ in self.SLOT.iter_unpack(view):
+                        if slot_namespace == namespace and expires_at > now:
+                            result.append((key, expires_at, number))
+            finally:
+                self.release(stripe)
+        return result
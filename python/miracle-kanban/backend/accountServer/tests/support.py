@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/accountServer/tests/support.py
+# 测试共用的准备工作
+# account_main.py 导入 configure 模块，测试时总是使用 configure.py.example.py 的默认配置，
+# 不受部署时的 configure.py 影响；日志写入临时目录。
+
+import importlib.util
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+def load_configure(**overrides):
+    """把 configure.py.example.py 作为 configure 模块载入，overrides 覆盖其中的配置项"""
+    spec = importlib.util.spec_from_file_location('configure', os.path.join(SERVER_DIR, 'configure.py.example.py'))
+    configure = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(configure)
+    configure._log_dir_ = tempfile.mkdtemp(prefix='account_test_logs_')
+    for name, value in overrides.items():
+        setattr(configure, name, value)
+    sys.modules['configure'] = configure
+    return configure
+
+def import_account_main(**overrides):
+    """载入测试配置后导入 account_main"""
+    if 'account_main' not in sys.modules:
+        load_configure(**overrides)
+    import account_main
+    for name, value in overrides.items():
+        setattr(account_main.configure, name, value)
+    return account_main
+
+class DatabaseTestCase(unittest.TestCase):
+    """在临时目录中运行的测试，数据库已迁移到最新结构（账号服务使用当前目录下的数据库文件）"""
+
+    DB_PATH = 'users_sqlite_3_py.db'
+
+    def setUp(self):
+        self.old_cwd = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp(prefix='account_test_')
+        os.chdir(self.temp_dir)
+        import account_schema
+        conn = sqlite3.connect(self.DB_PATH, isolation_level=None)
+        try:
+            conn.execute('PRAGMA journal_mode = WAL')
+            account_schema.migrate(conn, log=lambda message: None)
+        finally:
+            conn.close()
+
+    def tearDown(self):
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def query(self, sql, params=()):
+        conn = sqlite3.connect(self.DB_PATH)
+        try:
+            rows = conn.execute(sql, params).fetchall()
+            conn.commit()
+            return rows
+        finally:
+            conn.close()
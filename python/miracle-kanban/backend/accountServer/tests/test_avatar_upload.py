@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/accountServer/tests/test_avatar_upload.py
+# 流式上传的测试：准入检查和验证通过之前不创建临时文件，请求体未接收完时删除临时文件
+# 在 accountServer 目录下运行: python -m unittest discover -s tests
+
+import asyncio
+import os
+import shutil
+import socket
+import tempfile
+import types
+import unittest
+
+import support
+
+account_main = support.import_account_main()
+
+import avatar_store
+from http_request import DropConnection, HttpRequestError, HttpRequestReader
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 40
+
+def upload_head(length, token=b'tok'):
+    return (b"POST /avatar?user_id=1&user_token=%s HTTP/1.1\r\nHost: example\r\nContent-Length: %d\r\n\r\n"
+            % (token, length))
+
+class StreamedUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='account_test_avatars_')
+        self.store = avatar_store.AvatarStore(self.directory)
+        self.rejected = []
+
+        def open_body_sink(request):
+            if request.params.get('user_token') != 'tok':
+                self.rejected.append(request.path)
+                return [b'rejected']
+            request.body_sink = self.store.begin_upload()
+            return None
+
+        # AccountServer 的接收方法只用到这些属性
+        self.server = types.SimpleNamespace(
+            account_service=types.SimpleNamespace(open_body_sink=open_body_sink),
+            receive=lambda client_socket, reader: client_socket.recv(65536),
+            executor=None,
+            connection_timeout=5
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def temp_files(self):
+        return os.listdir(self.store.temp_dir)
+
+    def read_head(self, data):
+        reader = HttpRequestReader(body_limits={'/avatar': 1024 * 1024}, stream_paths={'/avatar'})
+        reader.feed(data)
+        request = reader.next_request()
+        request.parse()
+        return reader, request
+
+    def receive_body(self, client_socket, reader, request):
+        return account_main.AccountServer.receive_body(self.server, client_socket, reader, request)
+
+    def receive_body_async(self, stream, reader, request):
+        return account_main.AccountServer.receive_body_async(self.server, stream, reader, request)
+
+    def test_head_returned_before_body(self):
+        reader, request = self.read_head(upload_head(len(PNG)) + PNG[:100])
+        self.assertTrue(request.stream_body)
+        self.assertIsNone(request.body_sink)
+        self.assertEqual(self.temp_files(), [])
+        self.assertEqual(reader.read_body(), (PNG[:100], False))
+
+    def test_body_too_large_creates_nothing(self):
+        with self.assertRaises(HttpRequestError) as caught:
+            self.read_head(upload_head(2 * 1024 * 1024))
+        self.assertEqual(caught.exception.status_code, 413)
+        self.assertEqual(self.temp_files(), [])
+
+    def test_rejected_token_creates_nothing(self):
+        reader, request = self.read_head(upload_head(len(PNG), b'bad'))
+        server_socket, client_socket = socket.socketpair()
+        try:
+            self.assertEqual(self.receive_body(server_socket, reader, request), [b'rejected'])
+        finally:
+            server_socket.close()
+            client_socket.close()
+        self.assertEqual(self.rejected, ['/avatar'])
+        self.assertEqual(self.temp_files(), [])
+
+    def test_complete_upload(self):
+        reader, request = self.read_head(upload_head(len(PNG)) + PNG[:1000])
+        server_socket, client_socket = socket.socketpair()
+        try:
+            client_socket.sendall(PNG[1000:])
+            self.assertIsNone(self.receive_body(server_socket, reader, request))
+        finally:
+            server_socket.close()
+            client_socket.close()
+        self.assertEqual(request.body_sink.received, len(PNG))
+        self.assertTrue(request.body_sink.commit())
+        self.assertEqual(self.temp_files(), [])
+
+    def test_drop_mid_body_removes_temp_file(self):
+        reader, request = self.read_head(upload_head(len(PNG)) + PNG[:1000])
+        server_socket, client_socket = socket.socketpair()
+        try:
+            client_socket.sendall(PNG[1000:2000])
+            client_socket.close()
+            with self.assertRaises(DropConnection):
+                self.receive_body(server_socket, reader, request)
+        finally:
+            server_socket.close()
+        self.assertEqual(self.temp_files(), [])
+
+    def test_drop_mid_body_removes_temp_file_async(self):
+        reader, request = self.read_head(upload_head(len(PNG)) + PNG[:1000])
+
+        async def run():
+            stream = asyncio.StreamReader()
+            stream.feed_data(PNG[1000:2000])
+            stream.feed_eof()
+            await self.receive_body_async(stream, reader, request)
+
+        with self.assertRaises(DropConnection):
+            asyncio.run(run())
+        self.assertEqual(self.temp_files(), [])
+
+    def test_cancel_mid_body_removes_temp_file_async(self):
+        reader, request = self.read_head(upload_head(len(PNG)) + PNG[:1000])
+
+        async def run():
+            stream = asyncio.StreamReader()
+            task = asyncio.ensure_future(self.receive_body_async(stream, reader, request))
+            while request.body_sink is None or request.body_sink.received < 1000:
+                await asyncio.sleep(0.01)
+            self.assertEqual(len(self.temp_files()), 1)
+            # 关闭服务器时取消等待请求体的任务
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(run())
+        self.assertEqual(self.temp_files(), [])
+
+    def test_discard_is_idempotent_after_commit(self):
+        upload = self.store.begin_upload()
+        upload.write(PNG)
+        name = upload.commit()
+        upload.discard()
+        upload.write(b'ignored')
+        self.assertTrue(os.path.exists(self.store.path(name)))
+        self.assertEqual(self.temp_files(), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/accountServer/tests/test_email_outbox.py
+# 邮件发件箱的测试，使用本机的临时SMTP服务（不需要真实的邮件服务器）
+# 在 accountServer 目录下运行: python -m unittest discover -s tests
+
+import socketserver
+import threading
+import time
+import unittest
+
+import support
+
+account_main = support.import_account_main()
+
+class SmtpStubHandler(socketserver.StreamRequestHandler):
+    """只实现 smtplib 发送邮件用到的命令"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 stub ESMTP')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 stub')
+            elif verb == 'MAIL':
+                recipients = []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                address = command.split(':', 1)[1].strip().strip('<>')
+                if address in server.refuse:
+                    self.reply('451 try again later')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 end with .')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                with server.lock:
+                    server.messages.extend(recipients)
+                self.reply('250 queued')
+            elif verb in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('502 not implemented')
+
+class SmtpStub(socketserver.ThreadingTCPServer):
+    """本机临时SMTP服务，记录连接数和收到的邮件，refuse 中的收件人返回临时错误"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SmtpStubHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []      # 收件人列表（每封邮件一项）
+        self.refuse = set()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+class EmailOutboxTest(support.DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.smtp = SmtpStub()
+        configure = account_main.configure
+        configure._smtp_server_ = '127.0.0.1'
+        configure._smtp_port_ = self.smtp.server_address[1]
+        configure._smtp_use_ssl_ = False
+        configure._smtp_starttls_ = False
+        configure._sender_password_ = ''
+        self.db = account_main.DatabaseManager()
+        self.outboxes = []
+
+    def tearDown(self):
+        for outbox in self.outboxes:
+            outbox.stop()
+        self.db.close_all()
+        self.smtp.close()
+        super().tearDown()
+
+    def create_outbox(self):
+        outbox = account_main.EmailOutbox(self.db)
+        self.outboxes.append(outbox)
+        return outbox
+
+    def send_due(self, outbox):
+        """取出并发送一批到期邮件，返回取出的数量"""
+        batch = outbox.claim_batch()
+        if batch:
+            outbox.send_batch(batch)
+        return len(batch)
+
+    def row(self, outbox_id):
+        return self.query(
+            "SELECT status, attempts, next_attempt_at, last_error, sent_at FROM email_outbox WHERE id = ?",
+            (outbox_id,)
+        )[0]
+
+    def make_due(self, outbox_id):
+        self.query("UPDATE email_outbox SET next_attempt_at = ? WHERE id = ?", (int(time.time()), outbox_id))
+
+    def test_enqueue_send_marks_sent(self):
+        outbox = self.create_outbox()
+        outbox_id = outbox.enqueue('a@example.com', '主题', '<p>内容</p>', 'test')
+        self.assertEqual(outbox.pending_count(), 1)
+
+        self.assertEqual(self.send_due(outbox), 1)
+        status, attempts, _, last_error, sent_at = self.row(outbox_id)
+        self.assertEqual((status, attempts, last_error), ('sent', 0, None))
+        self.assertIsNotNone(sent_at)
+        self.assertEqual(self.smtp.messages, ['a@example.com'])
+        self.assertEqual(outbox.pending_count(), 0)
+        self.assertEqual((outbox.sent_count, outbox.failed_count), (1, 0))
+
+    def test_failed_send_backs_off_and_retries_on_same_connection(self):
+        outbox = self.create_outbox()
+        outbox.retry_base = 30
+        self.smtp.refuse.add('flaky@example.com')
+        flaky = outbox.enqueue('flaky@example.com', '主题', '内容')
+        good = outbox.enqueue('good@example.com', '主题', '内容')
+
+        start = int(time.time())
+        self.assertEqual(self.send_due(outbox), 2)
+        status, attempts, next_attempt_at, last_error, _ = self.row(flaky)
+        self.assertEqual((status, attempts), ('pending', 1))
+        self.assertIn('451', last_error)
+        self.assertTrue(start + 30 <= next_attempt_at <= int(time.time()) + 30)
+        self.assertEqual(self.row(good)[0], 'sent')
+        # 退避期间不会再次取出
+        self.assertEqual(self.send_due(outbox), 0)
+
+        # 再次失败时等待时间翻倍
+        self.make_due(flaky)
+        start = int(time.time())
+        self.assertEqual(self.send_due(outbox), 1)
+        status, attempts, next_attempt_at, _, _ = self.row(flaky)
+        self.assertEqual((status, attempts), ('pending', 2))
+        self.assertTrue(start + 60 <= next_attempt_at <= int(time.time()) + 60)
+
+        self.smtp.refuse.clear()
+        self.make_due(flaky)
+        self.assertEqual(self.send_due(outbox), 1)
+        self.assertEqual(self.row(flaky)[:2], ('sent', 2))
+        self.assertEqual(sorted(self.smtp.messages), ['flaky@example.com', 'good@example.com'])
+        # 收件人被拒绝不影响连接 所有发送复用同一个SMTP连接
+        self.assertEqual(self.smtp.connections, 1)
+
+    def test_gives_up_after_max_attempts(self):
+        outbox = self.create_outbox()
+        outbox.max_attempts = 2
+        self.smtp.refuse.add('bad@example.com')
+        outbox_id = outbox.enqueue('bad@example.com', '主题', '内容')
+
+        self.send_due(outbox)
+        self.make_due(outbox_id)
+        self.send_due(outbox)
+        self.assertEqual(self.row(outbox_id)[:2], ('failed', 2))
+        self.make_due(outbox_id)
+        self.assertEqual(self.send_due(outbox), 0)
+        self.assertEqual(outbox.failed_count, 2)
+
+    def test_reconnects_when_server_unreachable(self):
+        outbox = self.create_outbox()
+        outbox_id = outbox.enqueue('a@example.com', '主题', '内容')
+        self.smtp.close()
+
+        self.assertEqual(self.send_due(outbox), 1)
+        status, attempts, _, last_error, _ = self.row(outbox_id)
+        self.assertEqual((status, attempts), ('pending', 1))
+        self.assertTrue(last_error)
+
+        self.smtp = SmtpStub()
+        account_main.configure._smtp_port_ = self.smtp.server_address[1]
+        self.make_due(outbox_id)
+        self.assertEqual(self.send_due(outbox), 1)
+        self.assertEqual(self.row(outbox_id)[0], 'sent')
+
+    def test_resume_after_restart(self):
+        # 上一个进程取出（租用）了两封邮件后退出，还有一封邮件在停机期间写入
+        crashed = account_main.EmailOutbox(self.db)
+        crashed.lease_seconds = 2
+        leased = [crashed.enqueue(f'leased{i}@example.com', '主题', '内容') for i in range(2)]
+        self.assertEqual(len(crashed.claim_batch()), 2)
+        waiting = crashed.enqueue('waiting@example.com', '主题', '内容')
+
+        outbox = self.create_outbox()
+        outbox.poll_interval = 0.05
+        outbox.start()
+
+        deadline = time.time() + 1
+        while self.row(waiting)[0] != 'sent' and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.row(waiting)[0], 'sent')
+        # 租期结束前不会重复发送
+        self.assertEqual([self.row(outbox_id)[0] for outbox_id in leased], ['pending', 'pending'])
+
+        deadline = time.time() + 5
+        while outbox.pending_count() and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual([self.row(outbox_id)[0] for outbox_id in leased], ['sent', 'sent'])
+        self.assertEqual(sorted(self.smtp.messages),
+                         ['leased0@example.com', 'leased1@example.com', 'waiting@example.com'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/accountServer/tests/test_login.py
+# 登录的测试：验证密码期间密码被修改时不能签发token，也不能用旧密码的重新哈希覆盖新密码
+# 在 accountServer 目录下运行: python -m unittest discover -s tests
+
+import unittest
+
+import support
+
+account_main = support.import_account_main()
+
+class LoginTest(support.DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.service = account_main.AccountService(run_sweeper=False)
+        self.user_id = self.query(
+            "INSERT INTO users (email, password, name, email_verified) VALUES ('a@b.com', 'old-hash', 'a', 1) RETURNING id"
+        )[0][0]
+        # 不启动密码哈希进程池 密码验证结果由各测试指定
+        self.service.security.needs_rehash = lambda hashed: False
+        self.service.security.verify_password = lambda password, hashed: hashed == 'old-hash'
+
+    def tearDown(self):
+        self.service.db.close_all()
+        super().tearDown()
+
+    def login(self):
+        response, cookies = self.service.handle_login({'email': 'a@b.com', 'password': 'secret'})
+        return response
+
+    def change_password(self, new_hash):
+        self.query("UPDATE users SET password = ? WHERE id = ?", (new_hash, self.user_id))
+
+    def test_login_issues_token(self):
+        response = self.login()
+        self.assertTrue(response['success'], response['message'])
+        token = self.query("SELECT token FROM users WHERE id = ?", (self.user_id,))[0][0]
+        self.assertEqual(response['user']['token'], token)
+
+    def test_password_changed_during_verify(self):
+        def verify(password, hashed):
+            # 验证进行中密码被重置
+            self.change_password('reset-hash')
+            return True
+        self.service.security.verify_password = verify
+
+        response = self.login()
+        self.assertFalse(response['success'])
+        self.assertEqual(self.query("SELECT password, token FROM users WHERE id = ?", (self.user_id,)),
+                         [('reset-hash', None)])
+
+    def test_rehash_does_not_overwrite_new_password(self):
+        def hash_password(password):
+            # 重新哈希进行中密码被修改
+            self.change_password('changed-hash')
+            return 'rehashed-old-password'
+        self.service.security.needs_rehash = lambda hashed: True
+        self.service.security.hash_password = hash_password
+
+        response = self.login()
+        self.assertFalse(response['success'])
+        self.assertEqual(self.query("SELECT password, token FROM users WHERE id = ?", (self.user_id,)),
+                         [('changed-hash', None)])
+
+    def test_rehash_on_login(self):
+        self.service.security.needs_rehash = lambda hashed: True
+        self.service.security.hash_password = lambda password: 'new-format-hash'
+
+        response = self.login()
+        self.assertTrue(response['success'], response['message'])
+        self.assertEqual(self.query("SELECT password FROM users WHERE id = ?", (self.user_id,))[0][0], 'new-format-hash')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/accountServer/tests/test_request_guard.py
+# 恶意请求检测的测试
+# 在 accountServer 目录下运行: python -m unittest discover -s tests
+
+import types
+import unittest
+
+import support
+
+account_main = support.import_account_main()
+
+from http_request import DropConnection, HttpRequestReader
+from request_guard import IpBlacklist, RequestSignatureMatcher
+
+def read_request(data):
+    reader = HttpRequestReader()
+    reader.feed(data)
+    request = reader.next_request()
+    request.addr = ('203.0.113.7', 50000)
+    request.parse()
+    return request
+
+def post(path, body):
+    return read_request(
+        b"POST %s HTTP/1.1\r\nHost: example\r\nContent-Length: %d\r\n\r\n" % (path, len(body)) + body
+    )
+
+class MaliciousRequestTest(unittest.TestCase):
+
+    def setUp(self):
+        matcher = RequestSignatureMatcher(['/.env', '/admin', 'jsonrpc'], lambda message, level='INFO': None)
+        self.server = types.SimpleNamespace(
+            suspicious_patterns=matcher,
+            blacklisted_ips=IpBlacklist(lambda message, level='INFO': None, default_ttl=60)
+        )
+        self.server.is_malicious_request = types.MethodType(account_main.AccountServer.is_malicious_request, self.server)
+
+    def test_signature_in_head(self):
+        request = read_request(b"GET /.env HTTP/1.1\r\nHost: example\r\n\r\n")
+        self.assertEqual(self.server.is_malicious_request(request), '/.env')
+
+    def test_signature_only_in_body(self):
+        request = post(b'/login', b'{"jsonrpc":"2.0","method":"eth_getWork","id":1}')
+        self.assertNotIn(b'jsonrpc', request.head)
+        self.assertEqual(self.server.is_malicious_request(request), 'jsonrpc')
+
+    def test_clean_request(self):
+        request = post(b'/login', b'email=a%40b.com&password=secret')
+        self.assertIsNone(self.server.is_malicious_request(request))
+
+    def test_body_signature_drops_connection_and_bans(self):
+        request = post(b'/login', b'method=jsonrpc')
+        middleware = account_main.BlacklistMiddleware(self.server)
+        with self.assertRaises(DropConnection):
+            middleware.before(request)
+        self.assertIn('203.0.113.7', self.server.blacklisted_ips)
+
+if __name__ == '__main__':
+    unittest.main()
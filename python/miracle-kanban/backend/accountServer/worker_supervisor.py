@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/accountServer/worker_supervisor.py
+# 多进程模式的主进程
+# 创建共享的监听socket和共享状态表后fork出工作进程，负责重启、平滑重载和关闭。
+# 工作进程的入口和重新读取配置由子类实现（见 account_main.AccountWorkerSupervisor）。
+# 此模块不依赖 configure，日志通过构造参数 log 传入的函数 log(message, level='INFO') 记录
+
+import os
+import signal
+import socket
+import time
+
+from shared_state import SharedStateTable
+
+class WorkerSupervisor:
+    """多进程模式的主进程
+
+    主进程创建监听socket和共享状态表后fork出多个工作进程，所有工作进程在同一个socket上接受连接。
+    主进程负责监控工作进程、在异常退出时重启（连续快速退出时逐步延长重启间隔），
+    收到 SIGHUP 时重新读取配置并逐个替换工作进程（平滑重载），
+    收到 SIGTERM/SIGINT 时通知所有工作进程退出。仅支持提供 os.fork 的系统。
+    子类实现 run_worker()（工作进程入口）和 reload_config()（平滑重载时重新读取配置）。
+    """
+
+    def __init__(self, host, port, workers, log, listen_backlog=1024, shared_state_slots=65536, drain_timeout=10):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.log = log
+        self.listen_backlog = listen_backlog
+        self.shared_state_slots = shared_state_slots
+        self.drain_timeout = drain_timeout      # 关闭时等待工作进程处理完请求的秒数
+        self.listen_socket = None
+        self.shared_state = None
+        self.children = {}          # pid -> 工作进程编号
+        self.started_at = {}        # 工作进程编号 -> 启动时间
+        self.restart_delay = {}     # 工作进程编号 -> 下次重启前的等待秒数
+        self.restart_at = {}        # 工作进程编号 -> 计划重启的时间
+        self.stopping = False
+        self.reload_requested = False
+    
+    def create_listen_socket(self):
+        """创建所有工作进程共享的监听socket"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(self.listen_backlog)
+        return sock
+    
+    def spawn(self, index):
+        """fork一个工作进程"""
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self.start_worker(index)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = index
+        self.started_at[index] = time.time()
+        self.log(f"工作进程 {index} 已启动 (pid: {pid})")
+        return pid
+    
+    def start_worker(self, index):
+        """fork出的子进程中执行：设置信号处理后进入工作进程入口"""
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, self.raise_keyboard_interrupt)
+        signal.signal(signal.SIGINT, self.raise_keyboard_interrupt)
+        self.run_worker(index)
+    
+    def run_worker(self, index):
+        """工作进程入口（子类实现），使用 self.listen_socket 接受连接，正常返回时进程以代码0退出"""
+        raise NotImplementedError
+    
+    def reload_config(self):
+        """平滑重载前重新读取配置（子类实现），抛出异常时放弃本次重载"""
+    
+    @staticmethod
+    def raise_keyboard_interrupt(signum, frame):
+        # 与Ctrl+C走相同的关闭流程
+        raise KeyboardInterrupt
+    
+    def handle_stop(self, signum, frame):
+        self.stopping = True
+    
+    def handle_reload(self, signum, frame):
+        self.reload_requested = True
+    
+    def reap(self):
+        """回收已退出的工作进程，未在关闭或替换中的进程安排重启"""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.release_shared_locks(pid)
+            index = self.children.pop(pid, None)
+            if index is None:
+                continue    # 平滑重载时被替换的旧进程
+            code = os.waitstatus_to_exitcode(status)
+            if self.stopping:
+                continue
+            # 启动后很快退出说明可能无法正常运行 逐步延长重启间隔
+            if time.time() - self.started_at.get(index, 0) < 10:
+                delay = min(self.restart_delay.get(index, 0.5) * 2, 30)
+            else:
+                delay = 0.5
+            self.restart_delay[index] = delay
+            self.restart_at[index] = time.time() + delay
+            self.log(f"工作进程 {index} (pid: {pid}) 已退出 (代码: {code})，{delay:.1f}秒后重启", level='ERROR')
+    
+    def reload(self):
+        """重新读取配置并逐个替换工作进程，监听socket保持打开，不会中断接受连接"""
+        self.reload_requested = False
+        try:
+            self.reload_config()
+        except Exception as e:
+            self.log(f"重新加载配置失败: {e}", level='ERROR')
+            return
+        self.log("正在平滑重载工作进程...")
+        for pid, index in list(self.children.items()):
+            self.spawn(index)
+            del self.children[pid]
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    
+    def stop_children(self, timeout=None):
+        """通知所有工作进程退出，超时后强制结束"""
+        if timeout is None:
+            # 留出工作进程等待请求完成和释放资源的时间
+            timeout = self.drain_timeout + 5
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.time() + timeout
+        while self.children and time.time() < deadline:
+            self.reap_all()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.reap_all()
+    
+    def reap_all(self):
+        """回收已退出的工作进程（关闭过程中使用，不安排重启）"""
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            self.release_shared_locks(pid)
+            self.children.pop(pid, None)
+    
+    def release_shared_locks(self, pid):
+        """工作进程被强制结束时可能仍持有共享表的锁 释放后其他工作进程才能继续使用共享表"""
+        if self.shared_state is None:
+            return
+        released = self.shared_state.release_locks_held_by(pid)
+        if released:
+            self.log(f"已释放退出的工作进程 (pid: {pid}) 持有的 {released} 把共享状态锁", level='WARNING')
+    
+    def run(self):
+        """主进程循环"""
+        self.listen_socket = self.create_listen_socket()
+        self.shared_state = SharedStateTable(self.shared_state_slots)
+        
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+        signal.signal(signal.SIGHUP, self.handle_reload)
+        
+        self.log(f"账号服务器以多进程模式启动 (工作进程: {self.workers}, 主进程pid: {os.getpid()})")
+        for index in range(self.workers):
+            self.spawn(index)
+        
+        try:
+            while not self.stopping:
+                time.sleep(0.5)
+                self.reap()
+                if self.reload_requested:
+                    self.reload()
+                now = time.time()
+                for index, restart_at in list(self.restart_at.items()):
+                    if restart_at <= now and not self.stopping:
+                        del self.restart_at[index]
+                        self.spawn(index)
+        finally:
+            self.log("服务器正在关闭...")
+            self.stop_children()
+            self.listen_socket.close()
+            self.log("所有工作进程已退出")
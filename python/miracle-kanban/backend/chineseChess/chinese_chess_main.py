@@ -17,28 +17,31 @@ import aiohttp
 from urllib.parse import urlencode
 from websockets.exceptions import ConnectionClosed
 from functools import partial
-
-# 创建日志文件
-logs_folder = "logs"
-if not os.path.exists(logs_folder):
-    os.makedirs(logs_folder)
-current_time = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
-log_filename = f"./logs/{current_time}-log.log"
-log_file = open(log_filename, 'w', encoding='utf-8')
-
-def log_message(message:str):
-    """记录日志信息到文件和控制台"""
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
+import sys
+
+# 共享模块位于 backend/shared
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.queue_logger import QueueLogger
+
+# 日志写入 logs 目录 由后台线程批量写入 不阻塞事件循环
+logger = QueueLogger(
+    'chess',
+    directory=getattr(configure, '_config_log_dir_', 'logs'),
+    level=getattr(configure, '_config_log_level_', 'INFO'),
+    max_bytes=getattr(configure, '_config_log_max_bytes_', 10 * 1024 * 1024),
+    rotate_interval=getattr(configure, '_config_log_rotate_interval_', 86400),
+    backup_count=getattr(configure, '_config_log_backup_count_', 30),
+    queue_size=getattr(configure, '_config_log_queue_size_', 10000)
+)
+
+def log_message(message:str, level:str='INFO', **fields):
+    """记录日志信息到文件和控制台（放入日志队列，不阻塞）"""
     # 限制消息长度不超过100字符（不包括时间戳部分）
     max_message_length = 100
     if len(message) > max_message_length:
         message = message[:max_message_length] + " [已截断...]"
     
-    formatted_message = f"[{timestamp}] {message}"
-    print(formatted_message)
-    log_file.write(formatted_message + '\n')
-    log_file.flush()  # 确保立即写入文件
+    logger.log(level, message, **fields)
 
 # 从storage.json加载初始值
 def load_storage():
@@ -174,8 +177,27 @@ class SwitchCampPoll:
 class HTTPClient:
     """HTTP客户端工具类"""
     
-    @staticmethod
-    async def post_request(url: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    _session: Optional[aiohttp.ClientSession] = None  # 复用的会话 保持与账号服务器的长连接
+    
+    @classmethod
+    def get_session(cls) -> aiohttp.ClientSession:
+        """获取共享的ClientSession，首次调用时创建"""
+        if cls._session is None or cls._session.closed:
+            connector = aiohttp.TCPConnector(limit=32, keepalive_timeout=15)
+            # 账号服务器无响应时不让等待中的登录验证一直挂起（aiohttp默认总超时为300秒）
+            timeout = aiohttp.ClientTimeout(total=getattr(configure, '_api_request_timeout_', 10))
+            cls._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return cls._session
+    
+    @classmethod
+    async def close(cls):
+        """关闭共享的ClientSession"""
+        if cls._session is not None and not cls._session.closed:
+            await cls._session.close()
+        cls._session = None
+    
+    @classmethod
+    async def post_request(cls, url: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """发送POST请求 (application/x-www-form-urlencoded格式)"""
         try:
             # 将数据转换为URL编码格式
@@ -185,23 +207,103 @@ class HTTPClient:
                 'Content-Type': 'application/x-www-form-urlencoded'
             }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, data=form_data, headers=headers) as response:
-                    response_text = await response.text()
-                    
-                    if response.status == 200:
-                        try:
-                            result = await response.json()
-                            return result
-                        except:
-                            return None
-                    else:
-                        log_message(f"HTTP请求失败: {response.status} - {response_text}")
+            session = cls.get_session()
+            async with session.post(url, data=form_data, headers=headers) as response:
+                response_text = await response.text()
+                
+                if response.status == 200:
+                    try:
+                        result = await response.json()
+                        return result
+                    except:
                         return None
+                else:
+                    log_message(f"HTTP请求失败: {response.status} - {response_text}")
+                    return None
+        except Exception as e:
+            log_message(f"HTTP请求异常: {e}")
+            return None
+    
+    @classmethod
+    async def post_json(cls, url: str, data: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> Optional[Dict[str, Any]]:
+        """发送POST请求 (application/json格式)"""
+        try:
+            session = cls.get_session()
+            async with session.post(url, json=data, headers=headers) as response:
+                if response.status == 200:
+                    try:
+                        return await response.json()
+                    except:
+                        return None
+                log_message(f"HTTP请求失败: {response.status} - {await response.text()}")
+                return None
         except Exception as e:
             log_message(f"HTTP请求异常: {e}")
             return None
 
+class TokenLoginBatcher:
+    """合并同时到达的token登录验证
+    
+    服务器重启后大量客户端会同时重连，短时间内的验证请求合并为一次 /batch/tokenlogin 调用，
+    账号服务器只需一次查询。未配置内部服务密钥或批量调用失败时逐个调用 /tokenlogin。
+    """
+    
+    def __init__(self, account_server_url: str, secret: str, window: float = 0.01, max_items: int = 200):
+        self.account_server_url = account_server_url
+        self.secret = secret
+        self.window = window            # 等待合并的秒数
+        self.max_items = max_items      # 每批最多的数量 达到后立即发送
+        self.pending = []               # (user_id, user_token, future)
+        self.flush_handle = None
+    
+    async def verify(self, user_id: str, user_token: str) -> Optional[Dict[str, Any]]:
+        """验证token，返回与 /tokenlogin 相同格式的结果，账号服务器无响应时返回None"""
+        if not self.secret:
+            return await self.verify_single(user_id, user_token)
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((user_id, user_token, future))
+        if len(self.pending) >= self.max_items:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.window, self.flush)
+        return await future
+    
+    async def verify_single(self, user_id: str, user_token: str) -> Optional[Dict[str, Any]]:
+        request_data = {'user_id': user_id, 'user_token': user_token}
+        return await HTTPClient.post_request(f"{self.account_server_url}/tokenlogin", request_data)
+    
+    def flush(self):
+        """发送当前等待中的验证请求"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        if batch:
+            asyncio.ensure_future(self.send(batch))
+    
+    async def send(self, batch):
+        items = [{'user_id': user_id, 'token': user_token} for user_id, user_token, _ in batch]
+        try:
+            response = await HTTPClient.post_json(
+                f"{self.account_server_url}/batch/tokenlogin",
+                {'items': items},
+                headers={'X-Internal-Secret': self.secret}
+            )
+            results = response.get('results') if response and response.get('success') else None
+            if results is None or len(results) != len(batch):
+                # 账号服务器不支持批量接口或密钥错误时逐个验证
+                log_message(f"批量token验证失败，改为逐个验证 ({len(batch)} 项)", level='WARNING')
+                results = await asyncio.gather(*(self.verify_single(user_id, user_token) for user_id, user_token, _ in batch))
+        except Exception as e:
+            log_message(f"批量token验证出错: {e}", level='ERROR')
+            results = [None] * len(batch)
+        
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
 class PlayerModelState:
     """玩家模型状态类"""
     
@@ -264,6 +366,13 @@ class ChineseChessServer:
         # 指令
         self.instruct = chinese_chess_instruct.ChineseChessInstruct()
 
+        # token登录验证 同时到达的验证请求合并为一次批量调用
+        self.token_login_batcher = TokenLoginBatcher(
+            configure._api_account_server_url_,
+            getattr(configure, '_api_internal_secret_', ''),
+            window=getattr(configure, '_api_token_batch_window_', 0.01)
+        )
+
         # 预编译指令树
         self._init_instruct_tree()
 
@@ -548,7 +657,11 @@ class ChineseChessServer:
         # 启动自动保存任务
         asyncio.create_task(self.auto_save_task())
 
-        await asyncio.Future()  # 永久运行
+        try:
+            await asyncio.Future()  # 永久运行
+        finally:
+            # 关闭与账号服务器的共享HTTP会话
+            await HTTPClient.close()
 
     def init_chess_pieces_state(self):
         """初始化棋子状态"""
@@ -1155,10 +1268,8 @@ class ChineseChessServer:
             await websocket.send(self.instruct.create_token_login('no').to_json())
             return
         
-        # 发送验证请求到账号服务器 (使用form格式)
-        request_data = {'user_id': str(user_id),'user_token': user_token}
-        
-        response = await HTTPClient.post_request(f"{account_server_url}/tokenlogin", request_data)
+        # 发送验证请求到账号服务器 (同时到达的请求会合并为一次批量验证)
+        response = await self.token_login_batcher.verify(str(user_id), user_token)
         
         if response and response.get('success'):
             user_data = response.get('user', {})
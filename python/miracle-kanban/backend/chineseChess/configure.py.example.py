@@ -16,6 +16,17 @@ _config_server_name_                = 'cName'   # 服务器名称
 _config_max_online_                 = 100       # 最大在线人数
 _config_publickey_                  = RSAKEYPAIR._PUBLICKEY_    # 公钥
 _config_privatekey_                 = RSAKEYPAIR._PRIVATEKEY_   # 私钥
+_api_internal_secret_               = ''        # 账号服务器的内部服务密钥(与账号服务器 _internal_secret_ 一致) 为空时逐个调用 /tokenlogin
+_api_token_batch_window_            = 0.01      # token登录验证合并等待的秒数 同时到达的验证合并为一次 /batch/tokenlogin 调用
+_api_request_timeout_               = 10        # 请求账号服务器的超时秒数 超时后按账号服务器无响应处理
+
+# 日志配置
+_config_log_dir_                    = 'logs'    # 日志目录 日志文件为每行一个JSON对象
+_config_log_level_                  = 'INFO'    # 日志级别 DEBUG | INFO | WARNING | ERROR
+_config_log_max_bytes_              = 10485760  # 单个日志文件最大字节数 超出后切换新文件
+_config_log_rotate_interval_        = 86400     # 每隔多少秒切换新日志文件
+_config_log_backup_count_           = 30        # 保留的日志文件数量
+_config_log_queue_size_             = 10000     # 日志队列长度 写入跟不上时丢弃日志并计数 不阻塞事件循环
 
 # SSL配置
 _config_ssl_cert_file_              = ''        # SSL证书文件路径
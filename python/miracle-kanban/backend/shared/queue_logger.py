@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# The relative position of this file: /backend/shared/queue_logger.py
+# 队列日志 由账号服务器和象棋服务器共用
+# 调用方只把日志放入队列，控制台输出和文件写入在后台线程中批量完成，
+# 队列满时丢弃日志并计数，不会阻塞请求处理或事件循环
+
+import atexit
+import datetime
+import glob
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+
+class QueueLogger:
+    """后台批量写入、按大小和时间轮转的日志记录器
+
+    控制台输出保持 "[时间] 消息" 格式（看板程序读取标准输出显示日志），
+    日志文件为每行一个JSON对象，保存在 directory 目录下，文件名为 "时间-名称.log"。
+    tag 不为None时（例如多进程模式下的工作进程编号）会加在控制台输出的消息前面。
+    """
+
+    def __init__(self, name, directory='logs', level='INFO', console=True,
+                 max_bytes=10 * 1024 * 1024, rotate_interval=86400, backup_count=10,
+                 queue_size=10000, batch_size=256, flush_interval=0.5, tag=None):
+        self.name = name
+        self.prefix = f"[{tag}] " if tag else ''
+        self.directory = directory
+        self.level = LEVELS.get(str(level).upper(), LEVELS['INFO'])
+        self.console = console
+        self.max_bytes = max_bytes                  # 单个文件的最大字节数 0表示不按大小轮转
+        self.rotate_interval = rotate_interval      # 按时间轮转的秒数 0表示不按时间轮转
+        self.backup_count = backup_count            # 保留的日志文件数量 0表示全部保留
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.written = 0
+        self.rotations = 0
+        self.file = None
+        self.file_size = 0
+        self.next_rotation = 0
+        self.thread = None
+        self.closed = False
+        self.start_lock = threading.Lock()
+
+    def log(self, level, message, **fields):
+        """记录一条日志，不会阻塞；fields会作为额外字段写入JSON日志"""
+        level_no = LEVELS.get(level, LEVELS['INFO'])
+        if level_no < self.level:
+            return
+        record = (time.time(), level, message, fields)
+        if self.closed:
+            # 已停止（例如退出过程中）直接输出到控制台
+            self.write_console([record])
+            return
+        if self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, message, **fields):
+        self.log('DEBUG', message, **fields)
+
+    def info(self, message, **fields):
+        self.log('INFO', message, **fields)
+
+    def warning(self, message, **fields):
+        self.log('WARNING', message, **fields)
+
+    def error(self, message, **fields):
+        self.log('ERROR', message, **fields)
+
+    def start(self):
+        """启动后台写入线程（首次记录日志时自动调用）"""
+        with self.start_lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, name=f'{self.name}-logger', daemon=True)
+            self.thread.start()
+            atexit.register(self.stop)
+
+    def run(self):
+        """后台写入循环：取出一批日志后统一写入"""
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                # 丢弃警告通常正是在写入出错时产生 写入失败不能让线程退出
+                try:
+                    self.write_batch(self.dropped_records())
+                except Exception as e:
+                    sys.stderr.write(f"写入日志失败: {e}\n")
+                continue
+            batch = [record]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            if stop:
+                batch.pop()
+            try:
+                self.write_batch(batch + self.dropped_records())
+            except Exception as e:
+                sys.stderr.write(f"写入日志失败: {e}\n")
+            if stop:
+                return
+
+    def dropped_records(self):
+        """队列满时丢弃的日志数量有变化时生成一条警告日志"""
+        dropped = self.dropped
+        if dropped == self.reported_dropped:
+            return []
+        count = dropped - self.reported_dropped
+        self.reported_dropped = dropped
+        return [(time.time(), 'WARNING', f"日志队列已满，丢弃了 {count} 条日志 (累计 {dropped} 条)", {})]
+
+    @staticmethod
+    def format_time(timestamp, with_ms=False):
+        moment = datetime.datetime.fromtimestamp(timestamp)
+        if with_ms:
+            return moment.isoformat(timespec='milliseconds')
+        return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+    def write_console(self, batch):
+        if not self.console or not batch:
+            return
+        try:
+            sys.stdout.write(''.join(f"[{self.format_time(t)}] {self.prefix}{message}\n" for t, _, message, _ in batch))
+            sys.stdout.flush()
+        except (OSError, ValueError):
+            pass
+
+    def write_batch(self, batch):
+        """把一批日志写入控制台和日志文件"""
+        if not batch:
+            return
+        self.write_console(batch)
+
+        lines = []
+        for timestamp, level, message, fields in batch:
+            entry = {'time': self.format_time(timestamp, True), 'level': level, 'logger': self.name, 'message': message}
+            if fields:
+                entry.update(fields)
+            lines.append(json.dumps(entry, ensure_ascii=False, default=str))
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+
+        self.maybe_rotate(len(data))
+        self.file.write(data)
+        self.file.flush()
+        self.file_size += len(data)
+        self.written += len(batch)
+
+    def maybe_rotate(self, incoming):
+        """文件超过大小或到达轮转时间时切换到新文件"""
+        now = time.time()
+        if self.file is not None:
+            too_large = self.max_bytes and self.file_size and self.file_size + incoming > self.max_bytes
+            expired = self.rotate_interval and now >= self.next_rotation
+            if not (too_large or expired):
+                return
+            self.file.close()
+            self.file = None
+            self.rotations += 1
+
+        os.makedirs(self.directory, exist_ok=True)
+        current_time = datetime.datetime.fromtimestamp(now).strftime("%Y-%m-%d-%H-%M-%S")
+        path = os.path.join(self.directory, f"{current_time}-{self.name}.log")
+        sequence = 0
+        while self.rotations and os.path.exists(path):
+            # 同一秒内多次轮转时加上序号 避免写回刚轮转出去的文件
+            sequence += 1
+            path = os.path.join(self.directory, f"{current_time}.{sequence}-{self.name}.log")
+        self.file = open(path, 'ab')
+        self.file_size = self.file.tell()
+        self.next_rotation = now + self.rotate_interval if self.rotate_interval else 0
+        self.remove_old_files()
+
+    def remove_old_files(self):
+        """只保留最新的 backup_count 个日志文件"""
+        if not self.backup_count:
+            return
+        files = sorted(glob.glob(os.path.join(self.directory, f"*-{self.name}.log")), key=os.path.getmtime)
+        for path in files[:-self.backup_count]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stop(self, timeout=5):
+        """写完队列中剩余的日志后停止后台线程"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.thread is not None:
+            try:
+                # 停止标记必须放入队列 队列满时等待后台线程腾出空间
+                self.queue.put(None, timeout=timeout)
+                self.thread.join(timeout)
+            except queue.Full:
+                pass
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def stats(self):
+        return {'written': self.written, 'dropped': self.dropped, 'queued': self.queue.qsize(), 'rotations': self.rotations}
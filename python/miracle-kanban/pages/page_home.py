@@ -196,8 +196,8 @@ class HomePage(QWidget):
                 else:  # Unix/Linux/Mac
                     os.kill(self.backend_account_process.pid, signal.SIGTERM)
                 
-                # 等待进程结束
-                self.backend_account_process.wait(timeout=5)
+                # 等待进程结束 账号服务收到SIGTERM后会等待处理中的请求完成(默认最多10秒)再退出
+                self.backend_account_process.wait(timeout=20)
                 
             except subprocess.TimeoutExpired:
                 self.log_emitter.log("账号服务正常终止超时，强制终止...")